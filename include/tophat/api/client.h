@@ -40,4 +40,26 @@ PyObject *send_command(PyObject *client_pyobj, const char *device_name, PyObject
         PyErr_Clear();
     }
     return result;
-}
\ No newline at end of file
+}
+
+PyObject *create_batch_item(const char *device_name, PyObject *command) {
+    PyObject *batch_item_pyobj = Py_BuildValue("(s, O)", device_name, command);
+    if (PyErr_Occurred()) {
+        PyErr_Print();
+        PyErr_Clear();
+    }
+    return batch_item_pyobj;
+}
+
+PyObject *send_batch(PyObject *client_pyobj, PyObject *batch_items, const int parallel, const int stop_on_error) {
+    PyObject *results = PyObject_CallMethod(client_pyobj,
+                                            "send_batch",
+                                            "(O, N, N)",
+                                            batch_items, PyBool_FromLong(parallel), PyBool_FromLong(stop_on_error));
+
+    if (PyErr_Occurred()) {
+        PyErr_Print();
+        PyErr_Clear();
+    }
+    return results;
+}
@@ -96,4 +96,52 @@ PyObject *create_rainbow_wave_command(const unsigned long duration,
     }
     Py_DECREF(neopixel_module_pyobj);
     return rainbow_wave_command_pyobj;
-}
\ No newline at end of file
+}
+
+enum neopixel_easing {
+    NEOPIXEL_EASING_STEP = 0,
+    NEOPIXEL_EASING_LINEAR = 1,
+    NEOPIXEL_EASING_EASE_IN = 2,
+    NEOPIXEL_EASING_EASE_OUT = 3,
+    NEOPIXEL_EASING_EASE_IN_OUT = 4,
+};
+
+PyObject *create_keyframe(const double time,
+                          const unsigned long start,
+                          const unsigned long stop,
+                          PyObject *color,
+                          const enum neopixel_easing easing) {
+    PyObject *keyframe_pyobj = Py_BuildValue("(d, k, k, O, k)", time, start, stop, color, (unsigned long) easing);
+    if (PyErr_Occurred()) {
+        PyErr_Print();
+        PyErr_Clear();
+    }
+    return keyframe_pyobj;
+}
+
+PyObject *create_timeline_command(PyObject *keyframes,
+                                  const unsigned long frequency,
+                                  const int repeat) {
+    PyObject *neopixel_module_pyobj = get_module("tophat.devices.neopixel");
+    if (neopixel_module_pyobj == NULL) return NULL;
+
+    PyObject *keyframes_tuple_pyobj = PySequence_Tuple(keyframes);
+    if (keyframes_tuple_pyobj == NULL) {
+        PyErr_Print();
+        PyErr_Clear();
+        Py_DECREF(neopixel_module_pyobj);
+        return NULL;
+    }
+
+    PyObject *timeline_command_pyobj = PyObject_CallMethod(neopixel_module_pyobj,
+                                                           "TimelineCommand",
+                                                           "(O, k, N)",
+                                                           keyframes_tuple_pyobj, frequency, PyBool_FromLong(repeat));
+    if (PyErr_Occurred()) {
+        PyErr_Print();
+        PyErr_Clear();
+    }
+    Py_DECREF(keyframes_tuple_pyobj);
+    Py_DECREF(neopixel_module_pyobj);
+    return timeline_command_pyobj;
+}
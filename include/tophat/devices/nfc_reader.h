@@ -19,3 +19,19 @@ PyObject *create_read_data_command(float timeout) {
     Py_DECREF(nfc_reader_module_pyobj);
     return read_data_command_pyobj;
 }
+
+PyObject *create_read_events_command(long since, float timeout) {
+    PyObject *nfc_reader_module_pyobj = get_module("tophat.devices.nfc_reader");
+    if (nfc_reader_module_pyobj == NULL) return NULL;
+
+    PyObject *read_events_command_pyobj = PyObject_CallMethod(nfc_reader_module_pyobj,
+                                                              "ReadEventsCommand",
+                                                              "(l, f)",
+                                                              since, timeout);
+    if (PyErr_Occurred()) {
+        PyErr_Print();
+        PyErr_Clear();
+    }
+    Py_DECREF(nfc_reader_module_pyobj);
+    return read_events_command_pyobj;
+}
@@ -0,0 +1,340 @@
+from __future__ import annotations
+
+import collections
+import json
+import logging
+import multiprocessing as mp
+import os
+import signal
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Set, Tuple, Type, Union
+
+from typing_extensions import Concatenate, Self, final, override
+
+from tophat.api.client import TopHatClient
+from tophat.api.codec import Codec, decode, encode, record_fields, register_record, registered_types
+from tophat.api.device import Command, Device, DeviceExtraParams
+from tophat.api.message import CommandRequest
+from tophat.api.worker import DeviceWorker, ProcessDeviceWorker, ThreadDeviceWorker
+
+BENCHMARK_DEVICE_NAME: str = 'echo'
+
+
+@final
+class EchoDevice(Device):
+
+    @classmethod
+    @override
+    def supported_commands(cls: Type[Self]) -> Set[Type[Command[Self, Any]]]:
+        return {EchoCommand, }
+
+    @classmethod
+    @override
+    def _get_impl_builder(cls: Type[Self]) -> Callable[Concatenate[str, DeviceExtraParams], Self]:
+        return cls
+
+    @override
+    def __init__(self,
+                 device_name: str,
+                 state_size: int = 0) -> None:
+        super().__init__(device_name)
+        # Stands in for whatever state a real device accumulates
+        self._state: bytes = bytes(state_size)
+
+
+@register_record(0xff00, fields=('payload',))
+@final
+class EchoCommand(Command[EchoDevice, bytes]):
+
+    @property
+    def payload(self: Self) -> bytes:
+        return self._payload
+
+    @override
+    def run(self: Self,
+            device: EchoDevice) -> bytes:
+        return self._payload
+
+    @override
+    def __init__(self,
+                 payload: bytes) -> None:
+        self._payload: bytes = payload
+
+
+def _run_server(socket_path: Path) -> None:
+    from tophat.api.server import TopHatServer
+
+    logging.getLogger('tophat').setLevel(logging.WARNING)
+    server = TopHatServer(socket_path)
+    server.register_device(EchoDevice, BENCHMARK_DEVICE_NAME)
+    server.start()
+
+
+def _wait_for_socket(socket_path: Path,
+                     timeout: float = 10.0) -> None:
+    deadline: float = time.monotonic() + timeout
+    while not socket_path.is_socket():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'Server did not create socket at {socket_path}')
+        time.sleep(0.01)
+    # The socket exists slightly before the server starts listening
+    time.sleep(0.2)
+
+
+def bench_connection_per_call(socket_path: Path,
+                              command: EchoCommand,
+                              num_requests: int) -> None:
+    for _ in range(num_requests):
+        with TopHatClient(socket_path) as client:
+            client.send_command(BENCHMARK_DEVICE_NAME, command)
+
+
+def bench_persistent(socket_path: Path,
+                     command: EchoCommand,
+                     num_requests: int) -> None:
+    with TopHatClient(socket_path) as client:
+        for _ in range(num_requests):
+            client.send_command(BENCHMARK_DEVICE_NAME, command)
+
+
+def bench_pipelined(socket_path: Path,
+                    command: EchoCommand,
+                    num_requests: int,
+                    window: int = 32) -> None:
+    with TopHatClient(socket_path) as client:
+        in_flight: Deque[Future[bytes]] = collections.deque()
+        for _ in range(num_requests):
+            if len(in_flight) >= window:
+                in_flight.popleft().result()
+            in_flight.append(client.submit_command(BENCHMARK_DEVICE_NAME, command))
+        for result_future in in_flight:
+            result_future.result()
+
+
+SCENARIOS: Dict[str, Callable[[Path, EchoCommand, int], None]] = {
+    'connection-per-call': bench_connection_per_call,
+    'persistent': bench_persistent,
+    'pipelined': bench_pipelined,
+}
+
+
+def _time_per_call(function: Callable[[], Any],
+                   num_calls: int) -> float:
+    start_time: float = time.perf_counter()
+    for _ in range(num_calls):
+        function()
+    return (time.perf_counter() - start_time) / num_calls
+
+
+def run_throughput(num_requests: int,
+                   payload_size: int,
+                   scenario_names: List[str]) -> None:
+    command: EchoCommand = EchoCommand(bytes(payload_size))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        socket_path: Path = Path(temp_dir) / 'benchmark.socket'
+        server_process = mp.Process(target=_run_server, args=(socket_path,))
+        server_process.start()
+        try:
+            _wait_for_socket(socket_path)
+            for scenario_name in scenario_names:
+                start_time: float = time.perf_counter()
+                SCENARIOS[scenario_name](socket_path, command, num_requests)
+                elapsed: float = time.perf_counter() - start_time
+                print(f'{scenario_name:<24}{num_requests / elapsed:>12.1f} req/s')
+        finally:
+            os.kill(server_process.pid, signal.SIGINT)
+            server_process.join(5.0)
+            if server_process.is_alive():
+                server_process.terminate()
+                server_process.join()
+
+
+def run_dispatch(num_commands: int,
+                 state_size: int) -> None:
+    device: EchoDevice = EchoDevice(BENCHMARK_DEVICE_NAME, state_size)
+    command: EchoCommand = EchoCommand(b'')
+    manager = mp.Manager()
+
+    # The original dispatch path, the device is pickled into an anonymous pool worker on every submit
+    with ProcessPoolExecutor(max_workers=2) as process_pool:
+        device_lock = manager.Lock()
+        process_pool.submit(int).result()
+        per_command: float = _time_per_call(lambda: process_pool.submit(device.run, device_lock, command).result(),
+                                            num_commands)
+        print(f'{"process-pool":<24}{per_command * 1e6:>12.1f} us/command')
+
+    worker_type: Type[DeviceWorker]
+    for worker_name, worker_type in (('resident-thread', ThreadDeviceWorker),
+                                     ('resident-process', ProcessDeviceWorker)):
+        device_worker: DeviceWorker = worker_type(device)
+        device_worker.start()
+        try:
+            per_command = _time_per_call(lambda: device_worker.submit(command).result(), num_commands)
+            print(f'{worker_name:<24}{per_command * 1e6:>12.1f} us/command')
+        finally:
+            device_worker.stop()
+
+    manager.shutdown()
+
+
+def _hold_lock(lock: Any) -> None:
+    with lock:
+        pass
+
+
+def run_lock(num_acquires: int) -> None:
+    start_time: float = time.perf_counter()
+    manager = mp.Manager()
+    print(f'{"manager-startup":<24}{(time.perf_counter() - start_time) * 1e3:>12.1f} ms')
+
+    for lock_name, lock in (('manager-lock', manager.Lock()),
+                            ('multiprocessing-lock', mp.Lock()),
+                            ('threading-lock', threading.Lock())):
+        per_acquire: float = _time_per_call(lambda: _hold_lock(lock), num_acquires)
+        print(f'{lock_name:<24}{per_acquire * 1e6:>12.2f} us/command')
+
+    manager.shutdown()
+
+
+def _sample_requests() -> List[CommandRequest]:
+    from tophat.devices.digital_switch import DisableCommand, EnableCommand, ToggleCommand
+    from tophat.devices.neopixel import (BlinkCommand, LayerCommand, PulseCommand, RainbowCommand, RainbowWaveCommand,
+                                         SolidColorCommand, TimelineCommand)
+    from tophat.devices.neopixel.render import BlendMode, Easing
+    from tophat.devices.nfc_reader import ReadDataCommand, ReadEventsCommand
+    from tophat.devices.printer import PrintCommand
+
+    commands: List[Command] = [EnableCommand(),
+                               DisableCommand(),
+                               ToggleCommand(),
+                               SolidColorCommand((255, 0, 0)),
+                               BlinkCommand(10, (0, 255, 0)),
+                               PulseCommand(10, (0, 0, 255)),
+                               RainbowCommand(15),
+                               RainbowWaveCommand(15),
+                               LayerCommand(PulseCommand(10, (0, 0, 255)), 4, 20, 1, BlendMode.ADD, 128, 30.0, 'pulse'),
+                               TimelineCommand(tuple((index * 0.5, index % 4 * 10, index % 4 * 10 + 10,
+                                                      (index * 40 % 256, 0, 255 - index * 40 % 256), Easing.EASE_IN_OUT)
+                                                     for index in range(16)),
+                                               30,
+                                               True),
+                               ReadDataCommand(2.0),
+                               ReadEventsCommand(42, 2.0, 8),
+                               PrintCommand('HELLO WORLD')]
+    return [CommandRequest(request_id, 'device', command) for request_id, command in enumerate(commands, 1000)]
+
+
+def _to_json_value(value: Any) -> Any:
+    if isinstance(value, (tuple, list)):
+        return [_to_json_value(item) for item in value]
+    if type(value) in _JSON_TYPES.values():
+        return {'type': type(value).__name__,
+                'fields': {field_name: _to_json_value(getattr(value, field_name))
+                           for field_name in record_fields(type(value))}}
+    return value
+
+
+def _from_json_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_from_json_value(item) for item in value]
+    if isinstance(value, dict):
+        return _JSON_TYPES[value['type']](**{field_name: _from_json_value(field_value)
+                                              for field_name, field_value in value['fields'].items()})
+    return value
+
+
+# JSON has no type information of its own, so records are tagged by class name
+_JSON_TYPES: Dict[str, Type[Any]] = {}
+
+FORMATS: Dict[str, Tuple[Callable[[Any], Union[bytes, bytearray]], Callable[[bytes], Any]]] = {
+    'binary': (lambda value: encode(value, Codec.BINARY), lambda data: decode(data, Codec.BINARY)),
+    'pickle': (lambda value: encode(value, Codec.PICKLE), lambda data: decode(data, Codec.PICKLE)),
+    'json': (lambda value: json.dumps(_to_json_value(value)).encode('utf-8'),
+             lambda data: _from_json_value(json.loads(data))),
+}
+
+
+def run_codec(num_rounds: int) -> None:
+    requests: List[CommandRequest] = _sample_requests()
+    _JSON_TYPES.update((record_type.__name__, record_type) for record_type in registered_types().values())
+
+    print(f'{"command":<24}{"format":<10}{"size":>8}{"encode":>12}{"decode":>12}')
+    for request in requests:
+        for format_name, (encoder, decoder) in FORMATS.items():
+            data: Union[bytes, bytearray] = encoder(request)
+            encode_time: float = _time_per_call(lambda: encoder(request), num_rounds)
+            decode_time: float = _time_per_call(lambda: decoder(data), num_rounds)
+            print(f'{type(request.command).__name__:<24}{format_name:<10}{len(data):>6} B'
+                  f'{encode_time * 1e6:>9.2f} us{decode_time * 1e6:>9.2f} us')
+
+
+def main() -> None:
+    arg_parser = ArgumentParser(description='Benchmark the tophat API')
+    sub_parsers = arg_parser.add_subparsers(dest='benchmark', required=True)
+
+    throughput_parser = sub_parsers.add_parser('throughput',
+                                               help='Requests per second through a tophat server')
+    throughput_parser.add_argument('--requests',
+                                   dest='num_requests',
+                                   type=int,
+                                   default=2000)
+    throughput_parser.add_argument('--payload-size',
+                                   dest='payload_size',
+                                   type=int,
+                                   default=64)
+    throughput_parser.add_argument('scenarios',
+                                   nargs='*',
+                                   metavar='scenario',
+                                   help=f'Any of: {", ".join(SCENARIOS)}')
+
+    dispatch_parser = sub_parsers.add_parser('dispatch',
+                                             help='Per-command overhead of handing a command to a device')
+    dispatch_parser.add_argument('--commands',
+                                 dest='num_commands',
+                                 type=int,
+                                 default=2000)
+    dispatch_parser.add_argument('--state-size',
+                                 dest='state_size',
+                                 type=int,
+                                 default=1 << 20,
+                                 help='Bytes of state held by the benchmark device')
+
+    lock_parser = sub_parsers.add_parser('lock',
+                                         help='Per-command cost of serializing access to a device')
+    lock_parser.add_argument('--acquires',
+                             dest='num_acquires',
+                             type=int,
+                             default=20000)
+
+    codec_parser = sub_parsers.add_parser('codec',
+                                          help='Size and encode/decode time of every device command per format')
+    codec_parser.add_argument('--rounds',
+                              dest='num_rounds',
+                              type=int,
+                              default=20000)
+
+    args = arg_parser.parse_args()
+    if args.benchmark == 'throughput':
+        scenario_names: List[str] = args.scenarios or list(SCENARIOS)
+        for scenario_name in scenario_names:
+            if scenario_name not in SCENARIOS:
+                arg_parser.error(f'Unknown scenario {scenario_name}')
+        run_throughput(args.num_requests, args.payload_size, scenario_names)
+
+    elif args.benchmark == 'dispatch':
+        run_dispatch(args.num_commands, args.state_size)
+
+    elif args.benchmark == 'lock':
+        run_lock(args.num_acquires)
+
+    elif args.benchmark == 'codec':
+        run_codec(args.num_rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,25 @@
-import pickle
+import itertools
 import socket
+import threading
+from concurrent.futures import Future
 from pathlib import Path
-from typing import Any
+from types import TracebackType
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple, Type, TypeVar, Union
 
 from typing_extensions import Self, final, override
 
+from tophat.api.codec import Codec, DecodeError, EncodeError, decode, encode
 from tophat.api.device import Command, DeviceType, ResultType
-from tophat.api.message import CommandRequest, CommandResponse, MAX_SEND_RECV_SIZE, ResponseCode
+from tophat.api.framing import Frame, FrameReader, ProtocolError, send_frame
+from tophat.api.message import (BatchItem, BatchRequest, BatchResponse, BatchResult, CommandRequest, CommandResponse,
+                                HelloRequest, HelloResponse, JobAction, JobRequest, JobResponse, Message, Request,
+                                ResponseCode, StatsRequest, StatsResponse)
+
+ExceptionType = TypeVar("ExceptionType",
+                        bound=BaseException)
+
+# Pickle has to be asked for explicitly and is only used if the server was also configured to accept it
+DEFAULT_CODECS: Tuple[Codec, ...] = (Codec.BINARY,)
 
 
 @final
@@ -14,41 +27,195 @@ class TopHatClient:
 
     def send_command(self: Self,
                      device_name: str,
-                     command: Command[DeviceType, ResultType]) -> ResultType:
-        if not self._socket_path.is_socket():
-            raise RuntimeError(f'Failed to find tophat socket at {self._socket_path}')
+                     command: Command[DeviceType, ResultType]) -> Union[ResultType, JobResponse]:
+        return self.submit_command(device_name, command).result()
 
-        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server_socket:
-            try:
-                server_socket.connect(str(self._socket_path))
+    def submit_command(self: Self,
+                       device_name: str,
+                       command: Command[DeviceType, ResultType]) -> Future[Union[ResultType, JobResponse]]:
+        # An AsyncCommand resolves as soon as the server accepts it, to a JobResponse carrying its job ID
+        return self._submit(lambda request_id: CommandRequest(request_id, device_name, command))
 
-                request: CommandRequest[DeviceType, ResultType] = CommandRequest(device_name, command)
-                server_socket.sendall(pickle.dumps(request))
-                response: Any = pickle.loads(server_socket.recv(MAX_SEND_RECV_SIZE))
+    def send_batch(self: Self,
+                   items: Sequence[BatchItem],
+                   parallel: bool = False,
+                   stop_on_error: bool = True) -> Tuple[BatchResult, ...]:
+        return self.submit_batch(items, parallel, stop_on_error).result()
 
-                if not isinstance(response, CommandResponse):
-                    raise RuntimeError('Received unexpected tophat response')
+    def submit_batch(self: Self,
+                     items: Sequence[BatchItem],
+                     parallel: bool = False,
+                     stop_on_error: bool = True) -> Future[Tuple[BatchResult, ...]]:
+        return self._submit(lambda request_id: BatchRequest(request_id, items, parallel, stop_on_error))
 
-                if response.code is not ResponseCode.SUCCESS:
-                    raise RuntimeError(f'Request failed with code: {response.code.name}')
-                else:
-                    return response.result
+    def get_stats(self: Self) -> Dict[str, Any]:
+        return self._submit(StatsRequest).result()
 
-            except OSError as socket_error:
-                raise RuntimeError(f'Failed to connect to tophat server with error') from socket_error
+    def query_job(self: Self,
+                  job_id: int) -> JobResponse:
+        return self._submit(lambda request_id: JobRequest(request_id, job_id, JobAction.STATUS)).result()
 
-            except EOFError as eof_error:
-                raise RuntimeError(f'Failed to receive data to unpickle') from eof_error
+    def wait_job(self: Self,
+                 job_id: int,
+                 timeout: Optional[float] = None) -> JobResponse:
+        return self._submit(lambda request_id: JobRequest(request_id, job_id, JobAction.WAIT, timeout)).result()
 
-            except pickle.PicklingError as pickling_error:
-                raise RuntimeError(f'Failed to pickle request') from pickling_error
+    def cancel_job(self: Self,
+                   job_id: int) -> JobResponse:
+        return self._submit(lambda request_id: JobRequest(request_id, job_id, JobAction.CANCEL)).result()
 
-            except pickle.UnpicklingError as unpickling_error:
-                raise RuntimeError(f'Received malformed tophat response') from unpickling_error
+    def close(self: Self) -> None:
+        with self._lock:
+            self._disconnect(None)
 
     @override
     def __init__(self,
-                 socket_path: Path) -> None:
+                 socket_path: Path,
+                 codecs: Sequence[Codec] = DEFAULT_CODECS) -> None:
         if not socket_path.is_socket():
             raise RuntimeError(f'Failed to find tophat socket at {socket_path}')
         self._socket_path: Path = socket_path
+        self._preferred_codecs: Tuple[Codec, ...] = tuple(codecs)
+        self._codecs: Tuple[Codec, ...] = ()
+        self._lock: threading.Lock = threading.Lock()
+        self._request_ids: Iterator[int] = itertools.count(1)
+        self._pending: Dict[int, Future[Any]] = {}
+        self._socket: Optional[socket.socket] = None
+
+    @override
+    def __enter__(self: Self) -> Self:
+        return self
+
+    @override
+    def __exit__(self: Self,
+                 exc_type: Optional[Type[ExceptionType]],
+                 exc_val: Optional[ExceptionType],
+                 exc_tb: Optional[TracebackType]) -> None:
+        self.close()
+
+    def _connect(self: Self) -> socket.socket:
+        if self._socket is not None:
+            return self._socket
+
+        if not self._socket_path.is_socket():
+            raise RuntimeError(f'Failed to find tophat socket at {self._socket_path}')
+
+        server_socket: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        frame_reader: FrameReader = FrameReader()
+        try:
+            server_socket.connect(str(self._socket_path))
+            self._codecs = self._negotiate(server_socket, frame_reader)
+        except OSError as socket_error:
+            server_socket.close()
+            raise RuntimeError(f'Failed to connect to tophat server with error') from socket_error
+        except RuntimeError:
+            server_socket.close()
+            raise
+
+        self._socket = server_socket
+        threading.Thread(target=self._receive_responses,
+                         args=(server_socket, frame_reader),
+                         name='tophat-client',
+                         daemon=True).start()
+        return server_socket
+
+    def _submit(self: Self,
+                build_request: Callable[[int], Request]) -> Future[Any]:
+        result_future: Future[Any] = Future()
+        with self._lock:
+            server_socket: socket.socket = self._connect()
+            request_id: int = next(self._request_ids)
+            request: Request = build_request(request_id)
+            request_codec: Codec
+            request_data: Union[bytes, bytearray]
+            request_codec, request_data = self._encode(request)
+
+            self._pending[request_id] = result_future
+            try:
+                send_frame(server_socket, request_data, request_codec)
+            except OSError as socket_error:
+                del self._pending[request_id]
+                self._disconnect(socket_error)
+                raise RuntimeError(f'Failed to send request to tophat server') from socket_error
+
+        return result_future
+
+    def _negotiate(self: Self,
+                   server_socket: socket.socket,
+                   frame_reader: FrameReader) -> Tuple[Codec, ...]:
+        # The handshake itself always uses the binary codec, which every server accepts
+        hello: HelloRequest = HelloRequest(0, self._preferred_codecs)
+        send_frame(server_socket, encode(hello, Codec.BINARY), Codec.BINARY)
+        try:
+            frame: Frame = frame_reader.read_frame(server_socket)
+            response: Any = decode(frame.payload, Codec.BINARY)
+        except (EOFError, ProtocolError, DecodeError) as receive_error:
+            raise RuntimeError(f'Failed to negotiate with tophat server') from receive_error
+
+        if not isinstance(response, HelloResponse) or response.code is not ResponseCode.SUCCESS:
+            raise RuntimeError('Received unexpected tophat response')
+
+        codecs: Tuple[Codec, ...] = tuple(codec for codec in self._preferred_codecs if codec in response.codecs)
+        if not codecs:
+            raise RuntimeError(f'Tophat server accepts none of the codecs: {self._preferred_codecs}')
+        return codecs
+
+    def _encode(self: Self,
+                message: Message) -> Tuple[Codec, Union[bytes, bytearray]]:
+        for codec in self._codecs:
+            try:
+                return codec, encode(message, codec)
+            except EncodeError:
+                continue
+        raise RuntimeError(f'Failed to encode {type(message).__name__} with any of the codecs: {self._codecs}')
+
+    def _disconnect(self: Self,
+                    reason: Optional[BaseException]) -> None:
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+
+        error: RuntimeError = RuntimeError('Connection to tophat server was closed')
+        error.__cause__ = reason
+        for result_future in self._pending.values():
+            result_future.set_exception(error)
+        self._pending.clear()
+
+    def _receive_responses(self: Self,
+                           server_socket: socket.socket,
+                           frame_reader: FrameReader) -> None:
+        while True:
+            try:
+                frame: Frame = frame_reader.read_frame(server_socket)
+                if frame.codec not in self._codecs:
+                    raise ProtocolError(f'Received response with codec {frame.codec} that was not negotiated')
+                response: Any = decode(frame.payload, Codec(frame.codec))
+            except (OSError, EOFError, ProtocolError, DecodeError) as receive_error:
+                with self._lock:
+                    if self._socket is server_socket:
+                        self._disconnect(receive_error)
+                return
+
+            if not isinstance(response, (CommandResponse, JobResponse, BatchResponse, StatsResponse)):
+                continue
+
+            with self._lock:
+                result_future: Optional[Future[Any]] = self._pending.pop(response.request_id, None)
+            if result_future is None:
+                continue
+
+            if isinstance(response, JobResponse) and response.status is not None:
+                # The job itself may have failed, which the caller reads from the status rather than an exception
+                result_future.set_result(response)
+            elif response.code is not ResponseCode.SUCCESS:
+                result_future.set_exception(RuntimeError(f'Request failed with code: {response.code.name}'))
+            elif isinstance(response, BatchResponse):
+                result_future.set_result(response.results)
+            elif isinstance(response, StatsResponse):
+                result_future.set_result(response.stats)
+            else:
+                result_future.set_result(response.result)
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import dataclasses
+import enum
+import pickle
+import struct
+from typing import Any, Callable, Dict, Mapping, NamedTuple, Optional, Sequence, Tuple, Type, TypeVar, Union
+
+from typing_extensions import Buffer, Self, final, override
+
+RecordType = TypeVar('RecordType')
+FieldConverter = Callable[[Any], Any]
+FieldType = Union[Type[Any], Tuple[Type[Any], ...]]
+
+
+@final
+class Codec(enum.IntEnum):
+    PICKLE = 0
+    BINARY = 1
+
+
+@final
+class EncodeError(Exception):
+    pass
+
+
+@final
+class DecodeError(Exception):
+    pass
+
+
+class _RecordSpec(NamedTuple):
+    type_id: int
+    record_type: Type[Any]
+    fields: Tuple[str, ...]
+    converters: Mapping[str, FieldConverter]
+    types: Mapping[str, FieldType]
+
+
+_SPECS_BY_ID: Dict[int, _RecordSpec] = {}
+_SPECS_BY_TYPE: Dict[Type[Any], _RecordSpec] = {}
+
+
+def register_record(type_id: int,
+                    fields: Sequence[str] = (),
+                    converters: Optional[Mapping[str, FieldConverter]] = None,
+                    types: Optional[Mapping[str, FieldType]] = None) -> Callable[[Type[RecordType]], Type[RecordType]]:
+    # Fields are read back as attributes when encoding and passed as keyword arguments when decoding.
+    # Decoded fields must be instances of their declared types once converted, fields without one accept any value.
+    def _register(record_type: Type[RecordType]) -> Type[RecordType]:
+        if type_id in _SPECS_BY_ID:
+            raise ValueError(f'Type ID {type_id:#06x} already registered to {_SPECS_BY_ID[type_id].record_type}')
+
+        record_fields: Tuple[str, ...] = tuple(fields)
+        if not record_fields and dataclasses.is_dataclass(record_type):
+            record_fields = tuple(field.name for field in dataclasses.fields(record_type))
+
+        spec: _RecordSpec = _RecordSpec(type_id, record_type, record_fields, dict(converters or {}), dict(types or {}))
+        _SPECS_BY_ID[type_id] = spec
+        _SPECS_BY_TYPE[record_type] = spec
+        return record_type
+
+    return _register
+
+
+def registered_types() -> Dict[int, Type[Any]]:
+    return {type_id: spec.record_type for type_id, spec in _SPECS_BY_ID.items()}
+
+
+def record_fields(record_type: Type[Any]) -> Tuple[str, ...]:
+    return _SPECS_BY_TYPE[record_type].fields
+
+
+def encode(value: Any,
+           codec: Codec) -> Union[bytes, bytearray]:
+    if codec is Codec.BINARY:
+        output: bytearray = bytearray()
+        _encode_value(output, value)
+        return output
+
+    try:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError) as pickling_error:
+        raise EncodeError(f'Failed to pickle {type(value).__name__}') from pickling_error
+
+
+def decode(data: Buffer,
+           codec: Codec) -> Any:
+    if codec is Codec.BINARY:
+        decoder: _Decoder = _Decoder(data)
+        try:
+            value: Any = decoder.decode_value()
+        except (RecursionError, TypeError, ValueError) as decode_error:
+            raise DecodeError('Malformed binary value') from decode_error
+        if not decoder.at_end:
+            raise DecodeError('Trailing data after encoded value')
+        return value
+
+    try:
+        return pickle.loads(data)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError, TypeError) as unpickling_error:
+        raise DecodeError('Failed to unpickle value') from unpickling_error
+
+
+# Tags 0x00-0x7f encode the small non-negative integer equal to the tag itself
+_MAX_FIXINT: int = 0x7f
+_TAG_NONE: int = 0x80
+_TAG_FALSE: int = 0x81
+_TAG_TRUE: int = 0x82
+_TAG_INT: int = 0x83
+_TAG_FLOAT: int = 0x84
+_TAG_STR: int = 0x85
+_TAG_BYTES: int = 0x86
+_TAG_BYTEARRAY: int = 0x87
+_TAG_TUPLE: int = 0x88
+_TAG_LIST: int = 0x89
+_TAG_DICT: int = 0x8a
+_TAG_RECORD: int = 0x8b
+
+_INT: struct.Struct = struct.Struct('!q')
+_FLOAT: struct.Struct = struct.Struct('!d')
+_LENGTH: struct.Struct = struct.Struct('!I')
+_TYPE_ID: struct.Struct = struct.Struct('!H')
+
+
+def _encode_sized(output: bytearray,
+                  tag: int,
+                  data: Buffer) -> None:
+    output.append(tag)
+    output += _LENGTH.pack(len(data))
+    output += data
+
+
+def _encode_value(output: bytearray,
+                  value: Any) -> None:
+    value_type: Type[Any] = type(value)
+    if value is None:
+        output.append(_TAG_NONE)
+
+    elif value_type is bool:
+        output.append(_TAG_TRUE if value else _TAG_FALSE)
+
+    elif value_type is int or isinstance(value, enum.IntEnum):
+        if 0 <= value <= _MAX_FIXINT:
+            output.append(value)
+        else:
+            output.append(_TAG_INT)
+            try:
+                output += _INT.pack(value)
+            except struct.error as struct_error:
+                raise EncodeError(f'Integer {value} does not fit in 64 bits') from struct_error
+
+    elif value_type is float:
+        output.append(_TAG_FLOAT)
+        output += _FLOAT.pack(value)
+
+    elif value_type is str:
+        _encode_sized(output, _TAG_STR, value.encode('utf-8'))
+
+    elif value_type is bytes:
+        _encode_sized(output, _TAG_BYTES, value)
+
+    elif value_type is bytearray:
+        _encode_sized(output, _TAG_BYTEARRAY, value)
+
+    elif value_type is tuple or value_type is list:
+        output.append(_TAG_TUPLE if value_type is tuple else _TAG_LIST)
+        output += _LENGTH.pack(len(value))
+        for item in value:
+            _encode_value(output, item)
+
+    elif value_type is dict:
+        output.append(_TAG_DICT)
+        output += _LENGTH.pack(len(value))
+        for key, item in value.items():
+            _encode_value(output, key)
+            _encode_value(output, item)
+
+    elif value_type in _SPECS_BY_TYPE:
+        spec: _RecordSpec = _SPECS_BY_TYPE[value_type]
+        output.append(_TAG_RECORD)
+        output += _TYPE_ID.pack(spec.type_id)
+        for field_name in spec.fields:
+            _encode_value(output, getattr(value, field_name))
+
+    else:
+        raise EncodeError(f'No binary encoding registered for {value_type.__name__}')
+
+
+@final
+class _Decoder:
+
+    @property
+    def at_end(self: Self) -> bool:
+        return self._offset == len(self._view)
+
+    def decode_value(self: Self) -> Any:
+        tag: int = self._take(1)[0]
+        if tag <= _MAX_FIXINT:
+            return tag
+        elif tag == _TAG_NONE:
+            return None
+        elif tag == _TAG_FALSE:
+            return False
+        elif tag == _TAG_TRUE:
+            return True
+        elif tag == _TAG_INT:
+            return _INT.unpack(self._take(_INT.size))[0]
+        elif tag == _TAG_FLOAT:
+            return _FLOAT.unpack(self._take(_FLOAT.size))[0]
+        elif tag == _TAG_STR:
+            return str(self._take(self._take_length()), 'utf-8')
+        elif tag == _TAG_BYTES:
+            return bytes(self._take(self._take_length()))
+        elif tag == _TAG_BYTEARRAY:
+            return bytearray(self._take(self._take_length()))
+        elif tag == _TAG_TUPLE:
+            return tuple(self.decode_value() for _ in range(self._take_length()))
+        elif tag == _TAG_LIST:
+            return [self.decode_value() for _ in range(self._take_length())]
+        elif tag == _TAG_DICT:
+            return {self.decode_value(): self.decode_value() for _ in range(self._take_length())}
+        elif tag == _TAG_RECORD:
+            return self._decode_record()
+        else:
+            raise DecodeError(f'Unknown tag {tag:#04x} at offset {self._offset - 1}')
+
+    @override
+    def __init__(self,
+                 data: Buffer) -> None:
+        self._view: memoryview = memoryview(data).cast('B')
+        self._offset: int = 0
+
+    def _take(self: Self,
+              size: int) -> memoryview:
+        end: int = self._offset + size
+        if end > len(self._view):
+            raise DecodeError(f'Truncated value at offset {self._offset}')
+        chunk: memoryview = self._view[self._offset:end]
+        self._offset = end
+        return chunk
+
+    def _take_length(self: Self) -> int:
+        return _LENGTH.unpack(self._take(_LENGTH.size))[0]
+
+    def _decode_record(self: Self) -> Any:
+        type_id: int = _TYPE_ID.unpack(self._take(_TYPE_ID.size))[0]
+        if type_id not in _SPECS_BY_ID:
+            raise DecodeError(f'Unknown record type {type_id:#06x}')
+
+        spec: _RecordSpec = _SPECS_BY_ID[type_id]
+        kwargs: Dict[str, Any] = {}
+        for field_name in spec.fields:
+            field_value: Any = self.decode_value()
+            converter: Optional[FieldConverter] = spec.converters.get(field_name)
+            if converter is not None and field_value is not None:
+                field_value = converter(field_value)
+            field_type: Optional[FieldType] = spec.types.get(field_name)
+            if field_type is not None and not isinstance(field_value, field_type):
+                raise DecodeError(f'Field {field_name} of {spec.record_type.__name__} cannot be '
+                                  f'{type(field_value).__name__}')
+            kwargs[field_name] = field_value
+
+        try:
+            return spec.record_type(**kwargs)
+        except (TypeError, ValueError) as construct_error:
+            raise DecodeError(f'Failed to construct {spec.record_type.__name__}') from construct_error
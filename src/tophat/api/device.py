@@ -1,14 +1,61 @@
 from __future__ import annotations
 
 import abc
-import multiprocessing.synchronize as mp_sync
-from typing import Any, Callable, Generic, Set, Type, TypeVar
+import enum
+import threading
+from typing import Any, Callable, ContextManager, Generic, Optional, Set, Tuple, Type, TypeVar
 
 from typing_extensions import Concatenate, ParamSpec, Self, final, override
 
 DeviceType = TypeVar('DeviceType', bound='Device')
 ResultType = TypeVar('ResultType')
 DeviceExtraParams = ParamSpec("DeviceImplParams")
+DeviceLock = ContextManager[Any]
+
+
+@final
+class CommandPriority(enum.IntEnum):
+    LOW = enum.auto()
+    NORMAL = enum.auto()
+    HIGH = enum.auto()
+
+
+@final
+class CommandCancelledError(Exception):
+    pass
+
+
+@final
+class CancellationToken:
+
+    @property
+    def cancelled(self: Self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self: Self) -> None:
+        self._event.set()
+
+    def wait(self: Self,
+             timeout: float) -> bool:
+        return self._event.wait(timeout)
+
+    @classmethod
+    def current(cls: Type[Self]) -> Self:
+        # Commands run outside a scheduler get a token that nothing will ever cancel
+        token: Optional[CancellationToken] = getattr(_CURRENT_TOKEN, 'token', None)
+        return token if token is not None else cls()
+
+    @classmethod
+    def set_current(cls: Type[Self],
+                    token: Optional[Self]) -> None:
+        _CURRENT_TOKEN.token = token
+
+    @override
+    def __init__(self) -> None:
+        self._event: threading.Event = threading.Event()
+
+
+_CURRENT_TOKEN: threading.local = threading.local()
 
 
 @final
@@ -16,12 +63,16 @@ class UnsupportedCommandError(Exception):
 
     @override
     def __init__(self,
-                 device: Device,
+                 device_name: str,
                  command: Command) -> None:
-        super().__init__(f'Command {type(command)} not supported for device {device.name}')
-        self._device = device
+        super().__init__(f'Command {type(command)} not supported for device {device_name}')
+        self._device_name: str = device_name
         self._command: Command = command
 
+    @override
+    def __reduce__(self: Self) -> Tuple[Type[Self], Tuple[str, Command]]:
+        return type(self), (self._device_name, self._command)
+
 
 class DeviceBase(abc.ABC):
 
@@ -32,7 +83,7 @@ class DeviceBase(abc.ABC):
 
     @abc.abstractmethod
     def run(self: Self,
-            lock: mp_sync.Lock,
+            lock: DeviceLock,
             command: Command[DeviceType, ResultType]) -> ResultType:
         raise NotImplementedError()
 
@@ -59,13 +110,13 @@ class Device(DeviceBase, abc.ABC):
 
     @final
     def run(self: Self,
-            lock: mp_sync.Lock,
+            lock: DeviceLock,
             command: Command[Self, ResultType]) -> ResultType:
         if type(command) in self.supported_commands():
             with lock:
                 return command.run(self)
         else:
-            raise UnsupportedCommandError(self, command)
+            raise UnsupportedCommandError(self.name, command)
 
     @classmethod
     @abc.abstractmethod
@@ -89,6 +140,15 @@ class DeviceProxy(Generic[DeviceType], DeviceBase, abc.ABC):
 
 class Command(Generic[DeviceType, ResultType], abc.ABC):
 
+    @property
+    def priority(self: Self) -> CommandPriority:
+        return CommandPriority.NORMAL
+
+    @property
+    def preemptible(self: Self) -> bool:
+        # A preemptible command is superseded by the next preemptible command of the same or higher priority
+        return False
+
     @abc.abstractmethod
     def run(self,
             device: DeviceType) -> ResultType:
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+import socket
+import struct
+from typing import NamedTuple, Tuple
+
+from typing_extensions import Buffer, Self, final, override
+
+PROTOCOL_VERSION: int = 1
+DEFAULT_BUFFER_SIZE: int = 4096
+MAX_FRAME_SIZE: int = 4 << 20
+
+# Version, payload codec, 2 reserved bytes, payload length
+_HEADER: struct.Struct = struct.Struct('!BBxxQ')
+HEADER_SIZE: int = _HEADER.size
+
+
+@final
+class ProtocolError(Exception):
+    pass
+
+
+class Frame(NamedTuple):
+    codec: int
+    payload: memoryview
+
+
+def send_frame(sock: socket.socket,
+               payload: Buffer,
+               codec: int = 0) -> None:
+    payload_view: memoryview = memoryview(payload).cast('B')
+    header: bytes = _HEADER.pack(PROTOCOL_VERSION, codec, payload_view.nbytes)
+
+    # Scatter-gather the header and payload so the payload is never copied into a combined buffer
+    sent: int = sock.sendmsg((header, payload_view))
+    if sent < len(header):
+        sock.sendall(header[sent:])
+        sock.sendall(payload_view)
+    elif sent < len(header) + payload_view.nbytes:
+        sock.sendall(payload_view[sent - len(header):])
+
+
+async def send_frame_async(loop: asyncio.AbstractEventLoop,
+                           sock: socket.socket,
+                           payload: Buffer,
+                           codec: int = 0) -> None:
+    payload_view: memoryview = memoryview(payload).cast('B')
+    await loop.sock_sendall(sock, _HEADER.pack(PROTOCOL_VERSION, codec, payload_view.nbytes))
+    await loop.sock_sendall(sock, payload_view)
+
+
+def _closed_error(received: int,
+                  expected: int,
+                  at_boundary: bool) -> EOFError:
+    if at_boundary and received == 0:
+        return EOFError('Connection closed')
+    return EOFError(f'Connection closed mid-frame after {received} of {expected} bytes')
+
+
+@final
+class FrameReader:
+
+    def read_frame(self: Self,
+                   sock: socket.socket) -> Frame:
+        self._recv_exactly(sock, self._header_view, at_boundary=True)
+        codec: int
+        payload_size: int
+        codec, payload_size = self._read_header()
+        received: int = 0
+        while received < payload_size:
+            count: int = sock.recv_into(self._reserve(received, payload_size))
+            if count == 0:
+                raise _closed_error(received, payload_size, at_boundary=False)
+            received += count
+        return Frame(codec, memoryview(self._buffer)[:payload_size])
+
+    async def read_frame_async(self: Self,
+                               loop: asyncio.AbstractEventLoop,
+                               sock: socket.socket) -> Frame:
+        await self._recv_exactly_async(loop, sock, self._header_view, at_boundary=True)
+        codec: int
+        payload_size: int
+        codec, payload_size = self._read_header()
+        received: int = 0
+        while received < payload_size:
+            count: int = await loop.sock_recv_into(sock, self._reserve(received, payload_size))
+            if count == 0:
+                raise _closed_error(received, payload_size, at_boundary=False)
+            received += count
+        return Frame(codec, memoryview(self._buffer)[:payload_size])
+
+    @override
+    def __init__(self,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 max_size: int = MAX_FRAME_SIZE) -> None:
+        self._header: bytearray = bytearray(_HEADER.size)
+        self._header_view: memoryview = memoryview(self._header)
+        self._buffer: bytearray = bytearray(buffer_size)
+        self._max_size: int = max_size
+
+    def _read_header(self: Self) -> Tuple[int, int]:
+        version: int
+        codec: int
+        payload_size: int
+        version, codec, payload_size = _HEADER.unpack_from(self._header)
+        if version != PROTOCOL_VERSION:
+            raise ProtocolError(f'Unsupported protocol version {version}')
+        if payload_size > self._max_size:
+            raise ProtocolError(f'Frame of size {payload_size} exceeds maximum of {self._max_size}')
+        return codec, payload_size
+
+    def _reserve(self: Self,
+                 received: int,
+                 payload_size: int) -> memoryview:
+        # The buffer only grows once the bytes already received fill it, never on the word of the header alone
+        if received == len(self._buffer):
+            # Replace rather than resize, a caller may still hold a view of the previous buffer
+            buffer: bytearray = bytearray(min(payload_size, max(2 * len(self._buffer), DEFAULT_BUFFER_SIZE)))
+            buffer[:received] = memoryview(self._buffer)[:received]
+            self._buffer = buffer
+        return memoryview(self._buffer)[received:payload_size]
+
+    @staticmethod
+    def _recv_exactly(sock: socket.socket,
+                      view: memoryview,
+                      at_boundary: bool) -> None:
+        received: int = 0
+        while received < view.nbytes:
+            count: int = sock.recv_into(view[received:])
+            if count == 0:
+                raise _closed_error(received, view.nbytes, at_boundary)
+            received += count
+
+    @staticmethod
+    async def _recv_exactly_async(loop: asyncio.AbstractEventLoop,
+                                  sock: socket.socket,
+                                  view: memoryview,
+                                  at_boundary: bool) -> None:
+        received: int = 0
+        while received < view.nbytes:
+            count: int = await loop.sock_recv_into(sock, view[received:])
+            if count == 0:
+                raise _closed_error(received, view.nbytes, at_boundary)
+            received += count
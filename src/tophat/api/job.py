@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import collections
+import itertools
+from concurrent.futures import Future
+from typing import Iterator, Optional, OrderedDict
+
+from typing_extensions import Self, final, override
+
+from tophat.api.device import CommandCancelledError
+from tophat.api.message import JobStatus
+
+DEFAULT_JOB_CAPACITY: int = 1024
+
+
+def job_status(job_future: Future[None]) -> JobStatus:
+    if job_future.cancelled():
+        return JobStatus.CANCELLED
+    elif job_future.done():
+        if job_future.exception() is None:
+            return JobStatus.SUCCEEDED
+        return JobStatus.CANCELLED if isinstance(job_future.exception(), CommandCancelledError) else JobStatus.FAILED
+    elif job_future.running():
+        return JobStatus.RUNNING
+    else:
+        return JobStatus.PENDING
+
+
+@final
+class JobTable:
+
+    @property
+    def capacity(self: Self) -> int:
+        return self._capacity
+
+    def has_room(self: Self) -> bool:
+        if len(self._jobs) >= self._capacity:
+            self._evict_finished()
+        return len(self._jobs) < self._capacity
+
+    def add(self: Self,
+            job_future: Future[None]) -> int:
+        job_id: int = next(self._job_ids)
+        self._jobs[job_id] = job_future
+        return job_id
+
+    def get(self: Self,
+            job_id: int) -> Optional[Future[None]]:
+        return self._jobs.get(job_id)
+
+    @override
+    def __init__(self,
+                 capacity: int = DEFAULT_JOB_CAPACITY) -> None:
+        self._capacity: int = capacity
+        self._job_ids: Iterator[int] = itertools.count(1)
+        self._jobs: OrderedDict[int, Future[None]] = collections.OrderedDict()
+
+    def __len__(self: Self) -> int:
+        return len(self._jobs)
+
+    def _evict_finished(self: Self) -> None:
+        # Unfinished jobs are kept even when old, their results have not been observed yet
+        for job_id in [job_id for job_id, job_future in self._jobs.items() if job_future.done()]:
+            del self._jobs[job_id]
+            if len(self._jobs) < self._capacity // 2:
+                break
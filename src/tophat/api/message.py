@@ -2,21 +2,30 @@ from __future__ import annotations
 
 import abc
 import enum
-from typing import Generic, Optional, Type
+from types import NoneType
+from typing import Any, Dict, Generic, Optional, Sequence, Tuple, Type
 
 from typing_extensions import Self, final, override
 
+from tophat.api.codec import register_record
 from tophat.api.device import Command, DeviceType, ResultType
 
-MAX_SEND_RECV_SIZE: int = 4096
-
 
 class Message(abc.ABC):
     pass
 
 
 class Request(Message, abc.ABC):
-    pass
+
+    @final
+    @property
+    def request_id(self: Self) -> int:
+        return self._request_id
+
+    @override
+    def __init__(self,
+                 request_id: int) -> None:
+        self._request_id: int = request_id
 
 
 @final
@@ -26,10 +35,34 @@ class ResponseCode(enum.IntEnum):
     ERROR_INVALID_DEVICE = enum.auto()
     ERROR_UNSUPPORTED_COMMAND = enum.auto()
     ERROR_UNKNOWN = enum.auto()
+    ERROR_ENCODING = enum.auto()
+    ERROR_UNKNOWN_JOB = enum.auto()
+    ERROR_JOB_TABLE_FULL = enum.auto()
+
+
+@final
+class JobAction(enum.IntEnum):
+    STATUS = enum.auto()
+    WAIT = enum.auto()
+    CANCEL = enum.auto()
+
+
+@final
+class JobStatus(enum.IntEnum):
+    PENDING = enum.auto()
+    RUNNING = enum.auto()
+    SUCCEEDED = enum.auto()
+    FAILED = enum.auto()
+    CANCELLED = enum.auto()
 
 
 class Response(Message, abc.ABC):
 
+    @final
+    @property
+    def request_id(self: Self) -> int:
+        return self._request_id
+
     @final
     @property
     def code(self: Self) -> ResponseCode:
@@ -37,10 +70,51 @@ class Response(Message, abc.ABC):
 
     @override
     def __init__(self,
+                 request_id: int,
                  code: ResponseCode) -> None:
+        self._request_id: int = request_id
         self._code: ResponseCode = code
 
 
+@register_record(0x0001, fields=('request_id', 'codecs'), types={'request_id': int, 'codecs': (tuple, list)})
+@final
+class HelloRequest(Request):
+
+    @property
+    def codecs(self: Self) -> Tuple[int, ...]:
+        return self._codecs
+
+    @override
+    def __init__(self,
+                 request_id: int,
+                 codecs: Sequence[int]) -> None:
+        super().__init__(request_id)
+        self._codecs: Tuple[int, ...] = tuple(codecs)
+
+
+@register_record(0x0002,
+                 fields=('request_id', 'code', 'codecs'),
+                 converters={'code': ResponseCode},
+                 types={'request_id': int, 'codecs': (tuple, list)})
+@final
+class HelloResponse(Response):
+
+    @property
+    def codecs(self: Self) -> Tuple[int, ...]:
+        return self._codecs
+
+    @override
+    def __init__(self,
+                 request_id: int,
+                 code: ResponseCode,
+                 codecs: Sequence[int]) -> None:
+        super().__init__(request_id, code)
+        self._codecs: Tuple[int, ...] = tuple(codecs)
+
+
+@register_record(0x0003,
+                 fields=('request_id', 'device_name', 'command'),
+                 types={'request_id': int, 'device_name': str, 'command': Command})
 @final
 class CommandRequest(Generic[DeviceType, ResultType], Request):
 
@@ -54,12 +128,18 @@ class CommandRequest(Generic[DeviceType, ResultType], Request):
 
     @override
     def __init__(self,
+                 request_id: int,
                  device_name: str,
                  command: Command[DeviceType, ResultType]):
+        super().__init__(request_id)
         self._command: Command[DeviceType, ResultType] = command
         self._device_name: str = device_name
 
 
+@register_record(0x0004,
+                 fields=('request_id', 'code', 'result'),
+                 converters={'code': ResponseCode},
+                 types={'request_id': int})
 @final
 class CommandResponse(Generic[ResultType], Response):
 
@@ -69,18 +149,188 @@ class CommandResponse(Generic[ResultType], Response):
 
     @classmethod
     def from_success(cls: Type[Self],
+                     request_id: int,
                      result: ResultType) -> Self:
-        return cls(ResponseCode.SUCCESS, result)
+        return cls(request_id, ResponseCode.SUCCESS, result)
 
     @classmethod
     def from_error(cls: Type[Self],
+                   request_id: int,
                    code: ResponseCode) -> Self:
         assert code is not ResponseCode.SUCCESS
-        return cls(code, None)
+        return cls(request_id, code, None)
 
     @override
     def __init__(self,
+                 request_id: int,
                  code: ResponseCode,
                  result: Optional[ResultType]) -> None:
-        super().__init__(code)
+        super().__init__(request_id, code)
         self._result: Optional[ResultType] = result
+
+
+@register_record(0x0005,
+                 fields=('request_id', 'job_id', 'action', 'timeout'),
+                 converters={'action': JobAction},
+                 types={'request_id': int, 'job_id': int, 'action': JobAction, 'timeout': (int, float, NoneType)})
+@final
+class JobRequest(Request):
+
+    @property
+    def job_id(self: Self) -> int:
+        return self._job_id
+
+    @property
+    def action(self: Self) -> JobAction:
+        return self._action
+
+    @property
+    def timeout(self: Self) -> Optional[float]:
+        return self._timeout
+
+    @override
+    def __init__(self,
+                 request_id: int,
+                 job_id: int,
+                 action: JobAction,
+                 timeout: Optional[float] = None) -> None:
+        super().__init__(request_id)
+        self._job_id: int = job_id
+        self._action: JobAction = action
+        self._timeout: Optional[float] = timeout
+
+
+@register_record(0x0006,
+                 fields=('request_id', 'code', 'job_id', 'status'),
+                 converters={'code': ResponseCode, 'status': JobStatus},
+                 types={'request_id': int, 'job_id': int})
+@final
+class JobResponse(Response):
+
+    @property
+    def job_id(self: Self) -> int:
+        return self._job_id
+
+    @property
+    def status(self: Self) -> Optional[JobStatus]:
+        return self._status
+
+    @property
+    def done(self: Self) -> bool:
+        return self._status in (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+    @classmethod
+    def from_error(cls: Type[Self],
+                   request_id: int,
+                   job_id: int,
+                   code: ResponseCode) -> Self:
+        assert code is not ResponseCode.SUCCESS
+        return cls(request_id, code, job_id, None)
+
+    @override
+    def __init__(self,
+                 request_id: int,
+                 code: ResponseCode,
+                 job_id: int,
+                 status: Optional[JobStatus]) -> None:
+        super().__init__(request_id, code)
+        self._job_id: int = job_id
+        self._status: Optional[JobStatus] = status
+
+
+BatchItem = Tuple[str, Command]
+BatchResult = Tuple[ResponseCode, Any]
+
+
+def _to_batch_items(items: Sequence[Sequence[Any]]) -> Tuple[BatchItem, ...]:
+    batch_items: Tuple[BatchItem, ...] = tuple((device_name, command) for device_name, command in items)
+    for device_name, command in batch_items:
+        if not isinstance(device_name, str) or not isinstance(command, Command):
+            raise ValueError(f'Batch item must be a device name and a command, '
+                             f'got {type(device_name).__name__} and {type(command).__name__}')
+    return batch_items
+
+
+def _to_batch_results(results: Sequence[Sequence[Any]]) -> Tuple[BatchResult, ...]:
+    return tuple((ResponseCode(code), result) for code, result in results)
+
+
+@register_record(0x0007,
+                 fields=('request_id', 'items', 'parallel', 'stop_on_error'),
+                 converters={'items': _to_batch_items},
+                 types={'request_id': int, 'items': tuple, 'parallel': bool, 'stop_on_error': bool})
+@final
+class BatchRequest(Request):
+
+    @property
+    def items(self: Self) -> Tuple[BatchItem, ...]:
+        return self._items
+
+    @property
+    def parallel(self: Self) -> bool:
+        return self._parallel
+
+    @property
+    def stop_on_error(self: Self) -> bool:
+        return self._stop_on_error
+
+    @override
+    def __init__(self,
+                 request_id: int,
+                 items: Sequence[BatchItem],
+                 parallel: bool = False,
+                 stop_on_error: bool = True) -> None:
+        super().__init__(request_id)
+        self._items: Tuple[BatchItem, ...] = tuple((device_name, command) for device_name, command in items)
+        self._parallel: bool = parallel
+        self._stop_on_error: bool = stop_on_error
+
+
+@register_record(0x0008,
+                 fields=('request_id', 'code', 'results'),
+                 converters={'code': ResponseCode, 'results': _to_batch_results},
+                 types={'request_id': int, 'results': tuple})
+@final
+class BatchResponse(Response):
+
+    @property
+    def results(self: Self) -> Tuple[BatchResult, ...]:
+        return self._results
+
+    @override
+    def __init__(self,
+                 request_id: int,
+                 code: ResponseCode,
+                 results: Sequence[BatchResult]) -> None:
+        super().__init__(request_id, code)
+        self._results: Tuple[BatchResult, ...] = tuple(results)
+
+
+@register_record(0x0009, fields=('request_id',), types={'request_id': int})
+@final
+class StatsRequest(Request):
+
+    @override
+    def __init__(self,
+                 request_id: int) -> None:
+        super().__init__(request_id)
+
+
+@register_record(0x000a,
+                 fields=('request_id', 'code', 'stats'),
+                 converters={'code': ResponseCode},
+                 types={'request_id': int, 'stats': dict})
+@final
+class StatsResponse(Response):
+
+    @property
+    def stats(self: Self) -> Dict[str, Any]:
+        return self._stats
+
+    @override
+    def __init__(self,
+                 request_id: int,
+                 code: ResponseCode,
+                 stats: Dict[str, Any]) -> None:
+        super().__init__(request_id, code)
+        self._stats: Dict[str, Any] = stats
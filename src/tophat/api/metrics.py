@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import collections
+import os
+import threading
+from pathlib import Path
+from typing import Any, DefaultDict, Dict, List, Optional, Tuple
+
+from typing_extensions import Self, final, override
+
+# Each power of two is split into this many linear sub-buckets, bounding the relative error to 1/16
+_SUB_BUCKET_BITS: int = 4
+_SUB_BUCKETS: int = 1 << _SUB_BUCKET_BITS
+_MAX_VALUE_BITS: int = 44
+_NUM_BUCKETS: int = (_MAX_VALUE_BITS - _SUB_BUCKET_BITS + 1) * _SUB_BUCKETS
+
+QUANTILES: Tuple[float, ...] = (0.5, 0.9, 0.99, 0.999)
+
+
+def _bucket_index(value: int) -> int:
+    if value < 2 * _SUB_BUCKETS:
+        return max(value, 0)
+    value = min(value, (1 << _MAX_VALUE_BITS) - 1)
+    exponent: int = value.bit_length() - _SUB_BUCKET_BITS - 1
+    return _SUB_BUCKETS * exponent + (value >> exponent)
+
+
+def _bucket_upper_bound(index: int) -> int:
+    if index < 2 * _SUB_BUCKETS:
+        return index
+    exponent: int = index // _SUB_BUCKETS - 1
+    mantissa: int = index % _SUB_BUCKETS + _SUB_BUCKETS
+    return ((mantissa + 1) << exponent) - 1
+
+
+@final
+class LatencyHistogram:
+
+    @property
+    def count(self: Self) -> int:
+        return self._count
+
+    @property
+    def total(self: Self) -> int:
+        return self._total
+
+    def record(self: Self,
+               value_ns: int) -> None:
+        self._counts[_bucket_index(value_ns)] += 1
+        self._count += 1
+        self._total += value_ns
+        if value_ns < self._min:
+            self._min = value_ns
+        if value_ns > self._max:
+            self._max = value_ns
+
+    def quantile(self: Self,
+                 quantile: float) -> int:
+        if self._count == 0:
+            return 0
+
+        target: int = max(1, round(quantile * self._count))
+        seen: int = 0
+        for index, bucket_count in enumerate(self._counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(_bucket_upper_bound(index), self._max)
+        return self._max
+
+    def snapshot(self: Self) -> Dict[str, int]:
+        summary: Dict[str, int] = {'count': self._count,
+                                   'total_ns': self._total,
+                                   'min_ns': self._min if self._count else 0,
+                                   'max_ns': self._max}
+        for quantile in QUANTILES:
+            summary[f'p{quantile * 100:g}_ns'] = self.quantile(quantile)
+        return summary
+
+    @override
+    def __init__(self) -> None:
+        self._counts: List[int] = [0] * _NUM_BUCKETS
+        self._count: int = 0
+        self._total: int = 0
+        self._min: int = 1 << _MAX_VALUE_BITS
+        self._max: int = 0
+
+
+@final
+class _CommandHistograms:
+
+    @property
+    def queue_wait(self: Self) -> LatencyHistogram:
+        return self._queue_wait
+
+    @property
+    def execution(self: Self) -> LatencyHistogram:
+        return self._execution
+
+    @property
+    def end_to_end(self: Self) -> LatencyHistogram:
+        return self._end_to_end
+
+    @override
+    def __init__(self) -> None:
+        self._queue_wait: LatencyHistogram = LatencyHistogram()
+        self._execution: LatencyHistogram = LatencyHistogram()
+        self._end_to_end: LatencyHistogram = LatencyHistogram()
+
+
+@final
+class ServerMetrics:
+
+    def command_submitted(self: Self,
+                          device_name: str) -> None:
+        with self._lock:
+            self._in_flight[device_name] += 1
+
+    def command_finished(self: Self,
+                         device_name: str,
+                         command_name: str,
+                         queue_wait_ns: Optional[int],
+                         execution_ns: Optional[int],
+                         end_to_end_ns: int) -> None:
+        # Queue wait and execution are unknown for commands that never started or ran out of process
+        with self._lock:
+            self._in_flight[device_name] -= 1
+            histograms: _CommandHistograms = self._histograms[(device_name, command_name)]
+            if queue_wait_ns is not None:
+                histograms.queue_wait.record(queue_wait_ns)
+            if execution_ns is not None:
+                histograms.execution.record(execution_ns)
+            histograms.end_to_end.record(end_to_end_ns)
+
+    def record_error(self: Self,
+                     device_name: str,
+                     code_name: str) -> None:
+        with self._lock:
+            self._errors[(device_name, code_name)] += 1
+
+    def record_encoding_error(self: Self,
+                              message_name: str) -> None:
+        # Encoding failures belong to a message rather than a device
+        with self._lock:
+            self._encoding_errors[message_name] += 1
+
+    def record_bytes(self: Self,
+                     received: int,
+                     sent: int) -> None:
+        with self._lock:
+            self._bytes_received += received
+            self._bytes_sent += sent
+
+    def snapshot(self: Self) -> Dict[str, Any]:
+        with self._lock:
+            commands: Dict[str, Dict[str, Dict[str, Dict[str, int]]]] = {}
+            for (device_name, command_name), histograms in self._histograms.items():
+                commands.setdefault(device_name, {})[command_name] = {
+                    'queue_wait': histograms.queue_wait.snapshot(),
+                    'execution': histograms.execution.snapshot(),
+                    'end_to_end': histograms.end_to_end.snapshot(),
+                }
+
+            errors: Dict[str, Dict[str, int]] = {}
+            for (device_name, code_name), error_count in self._errors.items():
+                errors.setdefault(device_name, {})[code_name] = error_count
+
+            return {'commands': commands,
+                    'in_flight': dict(self._in_flight),
+                    'errors': errors,
+                    'encoding_errors': dict(self._encoding_errors),
+                    'bytes_received': self._bytes_received,
+                    'bytes_sent': self._bytes_sent}
+
+    def render_prometheus(self: Self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for metric_name, histogram_name in (('tophat_queue_wait_seconds', 'queue_wait'),
+                                                ('tophat_execution_seconds', 'execution'),
+                                                ('tophat_end_to_end_seconds', 'end_to_end')):
+                lines.append(f'# TYPE {metric_name} summary')
+                for (device_name, command_name), histograms in sorted(self._histograms.items()):
+                    histogram: LatencyHistogram = getattr(histograms, histogram_name)
+                    labels: str = f'device="{_escape(device_name)}",command="{_escape(command_name)}"'
+                    for quantile in QUANTILES:
+                        lines.append(f'{metric_name}{{{labels},quantile="{quantile:g}"}} '
+                                     f'{histogram.quantile(quantile) / 1e9:.9f}')
+                    lines.append(f'{metric_name}_sum{{{labels}}} {histogram.total / 1e9:.9f}')
+                    lines.append(f'{metric_name}_count{{{labels}}} {histogram.count}')
+
+            lines.append('# TYPE tophat_in_flight gauge')
+            for device_name, in_flight in sorted(self._in_flight.items()):
+                lines.append(f'tophat_in_flight{{device="{_escape(device_name)}"}} {in_flight}')
+
+            lines.append('# TYPE tophat_errors_total counter')
+            for (device_name, code_name), error_count in sorted(self._errors.items()):
+                lines.append(f'tophat_errors_total{{device="{_escape(device_name)}",code="{code_name}"}} '
+                             f'{error_count}')
+
+            lines.append('# TYPE tophat_encoding_errors_total counter')
+            for message_name, error_count in sorted(self._encoding_errors.items()):
+                lines.append(f'tophat_encoding_errors_total{{message="{_escape(message_name)}"}} {error_count}')
+
+            lines.append('# TYPE tophat_bytes_received_total counter')
+            lines.append(f'tophat_bytes_received_total {self._bytes_received}')
+            lines.append('# TYPE tophat_bytes_sent_total counter')
+            lines.append(f'tophat_bytes_sent_total {self._bytes_sent}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self: Self,
+                         path: Path) -> None:
+        # Write then rename so a scraper never reads a half written file
+        temp_path: Path = path.with_name(f'.{path.name}.tmp')
+        temp_path.write_text(self.render_prometheus())
+        os.replace(temp_path, path)
+
+    @override
+    def __init__(self) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        self._histograms: DefaultDict[Tuple[str, str], _CommandHistograms] = collections.defaultdict(
+            _CommandHistograms)
+        self._in_flight: DefaultDict[str, int] = collections.defaultdict(int)
+        self._errors: DefaultDict[Tuple[str, str], int] = collections.defaultdict(int)
+        self._encoding_errors: DefaultDict[str, int] = collections.defaultdict(int)
+        self._bytes_received: int = 0
+        self._bytes_sent: int = 0
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Iterator, List, NamedTuple, Optional, Tuple
+
+from typing_extensions import Self, final, override
+
+from tophat.api.device import CancellationToken, Command, DeviceBase, DeviceLock, ResultType
+
+
+@final
+class ScheduledFuture(Future):
+
+    @property
+    def token(self: Self) -> CancellationToken:
+        return self._token
+
+    @property
+    def queued_ns(self: Self) -> int:
+        return self._queued_ns
+
+    @property
+    def started_ns(self: Self) -> Optional[int]:
+        return self._started_ns
+
+    @property
+    def finished_ns(self: Self) -> Optional[int]:
+        return self._finished_ns
+
+    def mark_started(self: Self) -> None:
+        self._started_ns = time.monotonic_ns()
+
+    def mark_finished(self: Self) -> None:
+        self._finished_ns = time.monotonic_ns()
+
+    @override
+    def cancel(self: Self) -> bool:
+        if super().cancel():
+            return True
+        # Already running, ask the command to stop at its next check of the token
+        if not self.done():
+            self._token.cancel()
+        return False
+
+    @override
+    def __init__(self) -> None:
+        super().__init__()
+        self._token: CancellationToken = CancellationToken()
+        self._queued_ns: int = time.monotonic_ns()
+        self._started_ns: Optional[int] = None
+        self._finished_ns: Optional[int] = None
+
+
+class _Entry(NamedTuple):
+    command: Command
+    future: ScheduledFuture
+
+
+@final
+class CommandScheduler:
+
+    @property
+    def running_command(self: Self) -> Optional[Command]:
+        with self._condition:
+            return self._running.command if self._running is not None else None
+
+    def start(self: Self) -> None:
+        self._thread = threading.Thread(target=self._run_commands, name=self._device.name, daemon=True)
+        self._thread.start()
+
+    def submit(self: Self,
+               command: Command[Any, ResultType]) -> ScheduledFuture:
+        entry: _Entry = _Entry(command, ScheduledFuture())
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError(f'Scheduler for device {self._device.name} has been stopped')
+
+            self._preempt(command)
+            heapq.heappush(self._queue, (-command.priority, next(self._sequence), entry))
+            self._condition.notify()
+        return entry.future
+
+    def stop(self: Self,
+             wait: bool = False) -> None:
+        with self._condition:
+            self._stopped = True
+            for _, _, entry in self._queue:
+                entry.future.cancel()
+            self._queue.clear()
+            if self._running is not None:
+                self._running.future.cancel()
+            self._condition.notify()
+
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    @override
+    def __init__(self,
+                 device: DeviceBase,
+                 lock: DeviceLock) -> None:
+        self._device: DeviceBase = device
+        self._lock: DeviceLock = lock
+        self._condition: threading.Condition = threading.Condition()
+        self._queue: List[Tuple[int, int, _Entry]] = []
+        self._sequence: Iterator[int] = itertools.count()
+        self._running: Optional[_Entry] = None
+        self._stopped: bool = False
+        self._thread: Optional[threading.Thread] = None
+
+    def _preempt(self: Self,
+                 command: Command) -> None:
+        if command.preemptible:
+            # Latest wins, queued commands it supersedes never start
+            for _, _, entry in self._queue:
+                if entry.command.preemptible and entry.command.priority <= command.priority:
+                    entry.future.cancel()
+
+        if self._running is not None and self._running.command.preemptible:
+            running_priority: int = self._running.command.priority
+            if command.priority > running_priority or (command.preemptible and command.priority == running_priority):
+                self._running.future.cancel()
+
+    def _next_entry(self: Self) -> Optional[_Entry]:
+        with self._condition:
+            while True:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return None
+
+                entry: _Entry = heapq.heappop(self._queue)[2]
+                if entry.future.set_running_or_notify_cancel():
+                    entry.future.mark_started()
+                    self._running = entry
+                    return entry
+
+    def _run_commands(self: Self) -> None:
+        while (entry := self._next_entry()) is not None:
+            CancellationToken.set_current(entry.future.token)
+            try:
+                result: Any = self._device.run(self._lock, entry.command)
+            except BaseException as exception:
+                entry.future.mark_finished()
+                entry.future.set_exception(exception)
+            else:
+                # A preempted command raises CommandCancelledError, one that returned finished whatever its token says
+                entry.future.mark_finished()
+                entry.future.set_result(result)
+            finally:
+                CancellationToken.set_current(None)
+                with self._condition:
+                    self._running = None
@@ -1,37 +1,49 @@
 from __future__ import annotations
 
+import asyncio
+import functools
 import logging
 import multiprocessing as mp
 import multiprocessing.managers as mp_mngr
-import multiprocessing.synchronize as mp_sync
-import pickle
-import signal
 import socket
 import sys
+import time
 import uuid
-from concurrent.futures import Future, ProcessPoolExecutor
-from functools import partial
+from concurrent.futures import Future
 from pathlib import Path
-from typing import Any, Dict, Generic, Optional, Tuple, Type, TypeVar
+from typing import Any, Dict, Generic, List, Optional, Sequence, Set, Tuple, Type, TypeVar, Union
 
 from docker import DockerClient
 from docker.errors import DockerException
 from docker.models.containers import Container
 from typing_extensions import Self, final, override
 
-from tophat.api.device import (AsyncCommand, Device, DeviceBase, DeviceExtraParams, DeviceType, ResultType,
-                               UnsupportedCommandError)
+from tophat.api.codec import Codec, DecodeError, EncodeError, decode, encode
+from tophat.api.device import (AsyncCommand, Command, CommandCancelledError, Device, DeviceBase, DeviceExtraParams,
+                               DeviceType, ResultType, UnsupportedCommandError)
 from tophat.api.hat import HackableHat
-from tophat.api.message import CommandRequest, CommandResponse, MAX_SEND_RECV_SIZE, ResponseCode
+from tophat.api.framing import HEADER_SIZE, Frame, FrameReader, ProtocolError, send_frame_async
+from tophat.api.job import DEFAULT_JOB_CAPACITY, JobTable, job_status
+from tophat.api.message import (BatchRequest, BatchResponse, BatchResult, CommandRequest, CommandResponse,
+                                HelloRequest, HelloResponse, JobAction, JobRequest, JobResponse, JobStatus, Request,
+                                Response, ResponseCode, StatsRequest, StatsResponse)
+from tophat.api.metrics import ServerMetrics
+from tophat.api.scheduler import ScheduledFuture
+from tophat.api.worker import DeviceWorker, ThreadDeviceWorker
 
 LOGGER = logging.getLogger('tophat')
 LOGGER.setLevel(logging.DEBUG)
 LOGGER.addHandler(logging.StreamHandler(sys.stdout))
 
 HAT_SOCKET_PATH: Path = Path('/var/run/tophat/tophat.socket')
-
-DeviceLockPair = Tuple[DeviceBase, mp_sync.Lock]
-DeviceMap = Dict[str, DeviceLockPair]
+LISTEN_BACKLOG: int = 512
+# Unpickling runs arbitrary code, so pickle is only spoken when both ends opt in to it
+DEFAULT_CODECS: Tuple[Codec, ...] = (Codec.BINARY,)
+DEFAULT_METRICS_INTERVAL: float = 15.0
+# Largest request frame a hat may send, commands and batches of them are far smaller
+MAX_REQUEST_SIZE: int = 1 << 20
+
+DeviceMap = Dict[str, DeviceWorker]
 HatMap = Dict[Type[HackableHat], "HatBox"]
 
 BaseDeviceType = TypeVar('BaseDeviceType', bound=DeviceBase)
@@ -40,32 +52,160 @@ ExceptionType = TypeVar("ExceptionType",
                         bound=BaseException)
 
 
-def _supress_sigint() -> None:
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-
+async def _await_result(request_id: int,
+                        result_future: asyncio.Future[ResultType]) -> CommandResponse[ResultType]:
+    try:
+        result: ResultType = await result_future
 
-def _result_callback(client_socket: socket.socket,
-                     result_future: Future[ResultType]) -> None:
-    response: CommandResponse
-    if result_future.cancelled():
+    except asyncio.CancelledError:
         LOGGER.error(f'Command was cancelled somehow?')
-        response = CommandResponse.from_error(ResponseCode.CANCELLED)
+        return CommandResponse.from_error(request_id, ResponseCode.CANCELLED)
 
-    elif result_future.exception() is not None:
-        exception = result_future.exception()
-        if isinstance(exception, UnsupportedCommandError):
-            LOGGER.error(f'Attempted to run unsupported command: {exception}')
-            response = CommandResponse.from_error(ResponseCode.ERROR_UNSUPPORTED_COMMAND)
+    except CommandCancelledError as cancelled_error:
+        LOGGER.debug(f'Command was preempted: {cancelled_error}')
+        return CommandResponse.from_error(request_id, ResponseCode.CANCELLED)
 
-        else:
-            LOGGER.error(f'Command failed with exception: {exception}')
-            response = CommandResponse.from_error(ResponseCode.ERROR_UNKNOWN)
+    except UnsupportedCommandError as unsupported_error:
+        LOGGER.error(f'Attempted to run unsupported command: {unsupported_error}')
+        return CommandResponse.from_error(request_id, ResponseCode.ERROR_UNSUPPORTED_COMMAND)
+
+    except Exception as exception:
+        LOGGER.error(f'Command failed with exception: {exception}')
+        return CommandResponse.from_error(request_id, ResponseCode.ERROR_UNKNOWN)
+
+    LOGGER.debug(f'Finished running command')
+    return CommandResponse.from_success(request_id, result)
+
+
+def _failure_code(exception: BaseException) -> ResponseCode:
+    if isinstance(exception, UnsupportedCommandError):
+        return ResponseCode.ERROR_UNSUPPORTED_COMMAND
+    elif isinstance(exception, CommandCancelledError):
+        return ResponseCode.CANCELLED
+    return ResponseCode.ERROR_UNKNOWN
+
+
+def _job_response(request_id: int,
+                  job_id: int,
+                  job_future: Future[None]) -> JobResponse:
+    status: JobStatus = job_status(job_future)
+    if status is JobStatus.CANCELLED:
+        return JobResponse(request_id, ResponseCode.CANCELLED, job_id, status)
+    elif status is JobStatus.FAILED:
+        return JobResponse(request_id, _failure_code(job_future.exception()), job_id, status)
+    return JobResponse(request_id, ResponseCode.SUCCESS, job_id, status)
+
+
+def _cancel_all(command_futures: Sequence[Union[Future[Any], ResponseCode]]) -> None:
+    for command_future in command_futures:
+        if isinstance(command_future, Future):
+            command_future.cancel()
+
+
+async def _batch_result(request_id: int,
+                        command_future: Union[Future[Any], ResponseCode]) -> BatchResult:
+    if isinstance(command_future, ResponseCode):
+        return command_future, None
+    if command_future.cancelled():
+        return ResponseCode.CANCELLED, None
+
+    response: CommandResponse[Any] = await _await_result(request_id, asyncio.wrap_future(command_future))
+    return response.code, response.result
+
+
+def _log_job_outcome(job_id: int,
+                     command_type: Type[AsyncCommand],
+                     job_future: Future[None]) -> None:
+    if job_future.cancelled():
+        LOGGER.debug(f'Job {job_id} running {command_type.__name__} was cancelled')
+    elif isinstance(job_future.exception(), CommandCancelledError):
+        LOGGER.debug(f'Job {job_id} running {command_type.__name__} was preempted')
+    elif job_future.exception() is not None:
+        LOGGER.error(f'Job {job_id} running {command_type.__name__} failed with exception: {job_future.exception()}')
+
+
+@final
+class _ClientConnection:
+
+    @property
+    def socket(self: Self) -> socket.socket:
+        return self._socket
+
+    @property
+    def frame_reader(self: Self) -> FrameReader:
+        return self._frame_reader
+
+    @property
+    def codecs(self: Self) -> Tuple[Codec, ...]:
+        return self._codecs
+
+    @codecs.setter
+    def codecs(self: Self,
+               value: Tuple[Codec, ...]) -> None:
+        self._codecs = value
+
+    @property
+    def metrics(self: Self) -> ServerMetrics:
+        return self._metrics
+
+    async def send_response(self: Self,
+                            response: Response,
+                            codec: Codec) -> None:
+        response_codec: Codec
+        response_data: Union[bytes, bytearray]
+        response_codec, response_data = self._encode(response, codec)
+        self._metrics.record_bytes(0, HEADER_SIZE + len(response_data))
+        async with self._send_lock:
+            try:
+                await send_frame_async(asyncio.get_running_loop(), self._socket, response_data, response_codec)
+            except OSError as socket_error:
+                LOGGER.error(f'Failed to send response to client: {socket_error}')
+
+    async def reject(self: Self,
+                     request_id: int,
+                     message_name: str) -> None:
+        # Sent in binary, the one codec every client can read before and after negotiation
+        self._metrics.record_encoding_error(message_name)
+        await self.send_response(CommandResponse.from_error(request_id, ResponseCode.ERROR_ENCODING), Codec.BINARY)
+
+    def track(self: Self,
+              task: asyncio.Task[None]) -> None:
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self: Self) -> None:
+        # Responses to requests already in flight are still delivered after the client stops sending
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._socket.close()
 
-    else:
-        LOGGER.debug(f'Finished running command')
-        response = CommandResponse.from_success(result_future.result())
-    client_socket.sendall(pickle.dumps(response))
-    client_socket.shutdown(socket.SHUT_WR)
+    @override
+    def __init__(self,
+                 client_socket: socket.socket,
+                 codecs: Tuple[Codec, ...],
+                 metrics: ServerMetrics,
+                 max_request_size: int) -> None:
+        self._socket: socket.socket = client_socket
+        self._codecs: Tuple[Codec, ...] = codecs
+        self._metrics: ServerMetrics = metrics
+        self._frame_reader: FrameReader = FrameReader(max_size=max_request_size)
+        self._send_lock: asyncio.Lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task[None]] = set()
+
+    def _encode(self: Self,
+                response: Response,
+                codec: Codec) -> Tuple[Codec, Union[bytes, bytearray]]:
+        # Answer in the codec of the request, falling back to any other codec the client accepts
+        for response_codec in (codec, *self._codecs):
+            try:
+                return response_codec, encode(response, response_codec)
+            except EncodeError as encode_error:
+                LOGGER.debug(f'Failed to encode {type(response).__name__} as {response_codec.name}: {encode_error}')
+
+        LOGGER.error(f'Failed to encode {type(response).__name__} with any negotiated codec')
+        self._metrics.record_encoding_error(type(response).__name__)
+        return Codec.BINARY, encode(CommandResponse.from_error(response.request_id, ResponseCode.ERROR_ENCODING),
+                                    Codec.BINARY)
 
 
 @final
@@ -77,23 +217,30 @@ class TopHatServer:
 
     @property
     def manager(self: Self) -> mp_mngr.SyncManager:
+        # Only started for devices that need shared state through a manager process
+        if self._manager is None:
+            self._manager = mp.Manager()
         return self._manager
 
     def register_device(self: Self,
                         device_type: Type[BaseDeviceType],
                         device_name: str,
                         *args: DeviceExtraParams.args,
+                        worker_type: Type[DeviceWorker] = ThreadDeviceWorker,
                         **kwargs: DeviceExtraParams.kwargs) -> BaseDeviceType:
         if device_name in self._device_map:
             raise ValueError(f'Device {device_name} already registered')
 
         device: BaseDeviceType = device_type.from_impl(device_name, *args, **kwargs)
-        self._device_map[device_name] = device, self._manager.Lock()
+        self._device_map[device_name] = worker_type(device)
         return device
 
     def get_device(self: Self,
                    device_name: str) -> Optional[Device]:
-        return self._device_map.get(device_name, None)
+        if device_name in self._device_map:
+            return self._device_map[device_name].device
+        else:
+            return None
 
     def register_hat(self: Self,
                      hat: HackableHat) -> None:
@@ -115,29 +262,10 @@ class TopHatServer:
             self._socket_path.unlink()
 
         try:
-            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server_socket:
-                server_socket.bind(str(self._socket_path))
+            for device_worker in self._device_map.values():
+                device_worker.start()
 
-                for hat_box in self._hat_map.values():
-                    hat_box.start()
-
-                LOGGER.info('Starting tophat server...')
-                with ProcessPoolExecutor(max_workers=2, initializer=_supress_sigint) as process_pool:
-                    server_socket.listen()
-
-                    while True:
-                        client_socket: socket.socket
-                        client_address: Any
-                        client_socket, client_address = server_socket.accept()
-
-                        LOGGER.debug(f'Accepted connection')
-                        try:
-                            request: CommandRequest[DeviceType, ResultType] = self._await_request(client_socket)
-                            self._handle_request(process_pool, client_socket, request)
-
-                        except OSError as socket_error:
-                            LOGGER.error(f'Socket error occurred: {socket_error}')
-                            client_socket.close()
+            asyncio.run(self._serve())
 
         except KeyboardInterrupt:
             LOGGER.info('Closing tophat server...')
@@ -146,71 +274,303 @@ class TopHatServer:
         finally:
             for hat_box in self._hat_map.values():
                 hat_box.stop()
+            for device_worker in self._device_map.values():
+                device_worker.stop()
             self._socket_path.unlink(missing_ok=True)
             exit(0)
 
+    @property
+    def metrics(self: Self) -> ServerMetrics:
+        return self._metrics
+
     @override
     def __init__(self,
-                 socket_path: Optional[Path] = None) -> None:
+                 socket_path: Optional[Path] = None,
+                 codecs: Sequence[Codec] = DEFAULT_CODECS,
+                 job_capacity: int = DEFAULT_JOB_CAPACITY,
+                 metrics_path: Optional[Path] = None,
+                 metrics_interval: float = DEFAULT_METRICS_INTERVAL,
+                 max_request_size: int = MAX_REQUEST_SIZE) -> None:
         self._socket_path = socket_path if socket_path is not None else Path(f'/srv/tophat/{uuid.uuid4()}.socket')
+        self._codecs: Tuple[Codec, ...] = tuple(codecs)
+        self._max_request_size: int = max_request_size
         self._device_map: DeviceMap = {}
         self._hat_map: HatMap = {}
-        self._manager: mp_mngr.SyncManager() = mp.Manager()
+        self._manager: Optional[mp_mngr.SyncManager] = None
+        self._connection_tasks: Set[asyncio.Task[None]] = set()
+        self._job_table: JobTable = JobTable(job_capacity)
+        self._metrics: ServerMetrics = ServerMetrics()
+        self._metrics_path: Optional[Path] = metrics_path
+        self._metrics_interval: float = metrics_interval
+        self._metrics_task: Optional[asyncio.Task[None]] = None
+
+    async def _serve(self: Self) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server_socket:
+            server_socket.bind(str(self._socket_path))
+            server_socket.setblocking(False)
 
-    @staticmethod
-    def _await_request(client_socket: socket.socket) -> Optional[CommandRequest[DeviceType, ResultType]]:
+            for hat_box in self._hat_map.values():
+                hat_box.start()
+
+            LOGGER.info('Starting tophat server...')
+            server_socket.listen(LISTEN_BACKLOG)
+
+            if self._metrics_path is not None:
+                self._metrics_task = loop.create_task(self._write_metrics())
+
+            while True:
+                client_socket: socket.socket
+                client_address: Any
+                client_socket, client_address = await loop.sock_accept(server_socket)
+
+                LOGGER.debug(f'Accepted connection')
+                # Only the handshake codec is accepted until the client says which codecs it wants
+                connection_task: asyncio.Task[None] = loop.create_task(
+                    self._serve_connection(_ClientConnection(client_socket, (Codec.BINARY,), self._metrics,
+                                                             self._max_request_size)))
+                self._connection_tasks.add(connection_task)
+                connection_task.add_done_callback(self._connection_tasks.discard)
+
+    async def _serve_connection(self: Self,
+                                connection: _ClientConnection) -> None:
         try:
-            request: Any = pickle.loads(client_socket.recv(MAX_SEND_RECV_SIZE))
-            if not isinstance(request, CommandRequest):
-                LOGGER.error(f'Received unexpected tophat request of type: {type(request)}')
-                return None
+            while True:
+                received: Optional[Tuple[Codec, Request]] = await self._await_request(connection)
+                if received is None:
+                    break
+                received_ns: int = time.monotonic_ns()
+
+                request_codec: Codec
+                request: Request
+                request_codec, request = received
+                if isinstance(request, HelloRequest):
+                    # Negotiation is cheap and must finish before the next frame is read, so answer it inline
+                    connection.codecs = tuple(codec for codec in self._codecs if codec in request.codecs)
+                    LOGGER.debug(f'Negotiated codecs: {[codec.name for codec in connection.codecs]}')
+                    await connection.send_response(HelloResponse(request.request_id,
+                                                                 ResponseCode.SUCCESS,
+                                                                 self._codecs),
+                                                   Codec.BINARY)
+                    continue
+
+                connection.track(asyncio.create_task(self._handle_request(connection,
+                                                                          request,
+                                                                          request_codec,
+                                                                          received_ns)))
 
-            LOGGER.debug(f'Received {type(request.command).__name__} targeting device {request.device_name}')
-            return request
+        finally:
+            await connection.close()
+
+    @staticmethod
+    async def _await_request(connection: _ClientConnection) -> Optional[Tuple[Codec, Request]]:
+        try:
+            while True:
+                frame: Frame = await connection.frame_reader.read_frame_async(asyncio.get_running_loop(),
+                                                                              connection.socket)
+                connection.metrics.record_bytes(HEADER_SIZE + frame.payload.nbytes, 0)
+                # Binary frames are always safe to decode, the handshake itself uses them
+                if frame.codec != Codec.BINARY and frame.codec not in connection.codecs:
+                    # Without decoding the frame its request ID is unknown, so the connection has to go
+                    LOGGER.error(f'Received tophat request with codec that was not negotiated: {frame.codec}')
+                    await connection.reject(0, Request.__name__)
+                    return None
+
+                request_codec: Codec = Codec(frame.codec)
+                request: Any = decode(frame.payload, request_codec)
+                if not isinstance(request, (HelloRequest, JobRequest, BatchRequest, StatsRequest, CommandRequest)):
+                    LOGGER.error(f'Received unexpected tophat request of type: {type(request)}')
+                    return None
+                if request_codec not in connection.codecs and not isinstance(request, HelloRequest):
+                    LOGGER.error(f'Received {type(request).__name__} with codec that was not negotiated: '
+                                 f'{request_codec.name}')
+                    await connection.reject(request.request_id, type(request).__name__)
+                    continue
+
+                if isinstance(request, CommandRequest):
+                    LOGGER.debug(f'Received {type(request.command).__name__} targeting device {request.device_name}')
+                return request_codec, request
 
         except OSError as socket_error:
             LOGGER.error(f'Failed to communicate with client: {socket_error}')
 
-        except pickle.UnpicklingError as unpickling_error:
-            LOGGER.error(f'Received malformed tophat request: {unpickling_error}')
+        except EOFError as eof_error:
+            LOGGER.debug(f'Client closed connection: {eof_error}')
+
+        except ProtocolError as protocol_error:
+            LOGGER.error(f'Received malformed tophat frame: {protocol_error}')
 
-        except pickle.PicklingError as pickling_error:
-            LOGGER.error(f'Failed to pickle response: {pickling_error}')
+        except DecodeError as decode_error:
+            # The request ID is part of what failed to decode, so the connection has to go here too
+            LOGGER.error(f'Received malformed tophat request: {decode_error}')
+            await connection.reject(0, Request.__name__)
 
-    def _handle_request(self: Self,
-                        process_pool: ProcessPoolExecutor,
-                        client_socket: socket.socket,
-                        request: CommandRequest[DeviceType, ResultType]) -> None:
-        if request.device_name not in self._device_map:
-            LOGGER.error(f'Unknown device ID: {request.device_name}')
-            client_socket.sendall(pickle.dumps(CommandResponse.from_error(ResponseCode.ERROR_INVALID_DEVICE)))
-            client_socket.shutdown(socket.SHUT_WR)
+    async def _handle_request(self: Self,
+                              connection: _ClientConnection,
+                              request: Request,
+                              request_codec: Codec,
+                              received_ns: int) -> None:
+        try:
+            if isinstance(request, JobRequest):
+                await connection.send_response(await self._handle_job_request(request), request_codec)
+            elif isinstance(request, BatchRequest):
+                await connection.send_response(await self._handle_batch_request(request, received_ns), request_codec)
+            elif isinstance(request, StatsRequest):
+                await connection.send_response(StatsResponse(request.request_id,
+                                                              ResponseCode.SUCCESS,
+                                                              self._metrics.snapshot()),
+                                               request_codec)
+            else:
+                await self._handle_command_request(connection, request, request_codec, received_ns)
+
+        except Exception as handler_error:
+            # A request the server trips over still gets an answer, otherwise the client waits on it forever
+            LOGGER.error(f'Failed to handle {type(request).__name__}: {handler_error!r}')
+            if isinstance(request, CommandRequest):
+                self._metrics.record_error(request.device_name, ResponseCode.ERROR_UNKNOWN.name)
+            await connection.send_response(CommandResponse.from_error(request.request_id, ResponseCode.ERROR_UNKNOWN),
+                                           request_codec)
+
+    async def _handle_command_request(self: Self,
+                                      connection: _ClientConnection,
+                                      request: CommandRequest[DeviceType, ResultType],
+                                      request_codec: Codec,
+                                      received_ns: int) -> None:
+        is_async: bool = isinstance(request.command, AsyncCommand)
+        if is_async and not self._job_table.has_room():
+            LOGGER.error(f'Job table is full, rejecting {type(request.command).__name__}')
+            self._metrics.record_error(request.device_name, ResponseCode.ERROR_JOB_TABLE_FULL.name)
+            await connection.send_response(JobResponse.from_error(request.request_id,
+                                                                  0,
+                                                                  ResponseCode.ERROR_JOB_TABLE_FULL),
+                                           request_codec)
             return
 
-        target_device: BaseDeviceType
-        device_lock: mp_sync.Lock
-        target_device, device_lock = self._device_map[request.device_name]
-        if isinstance(request.command, AsyncCommand):
-            LOGGER.debug(f'Running {type(request.command).__name__} asynchronously on device {target_device.name}...')
-            try:
-                result_future: Future[ResultType] = process_pool.submit(target_device.run, device_lock, request.command)
-                response: CommandResponse[None] = CommandResponse.from_success(result_future.result(0.1))
-            except TimeoutError:
-                response = CommandResponse.from_success(None)
-            except Exception as e:
-                LOGGER.error(f'Failed to execute {type(request.command).__name__} with error: {e}')
-                response = CommandResponse.from_error(ResponseCode.ERROR_INVALID_DEVICE)
-
-            LOGGER.debug(f'Command left to run asynchronously')
-            client_socket.sendall(pickle.dumps(response))
-            client_socket.shutdown(socket.SHUT_WR)
+        command_future: Union[Future[ResultType], ResponseCode] = self._submit_command(request.device_name,
+                                                                                        request.command,
+                                                                                        received_ns)
+        if isinstance(command_future, ResponseCode):
+            await connection.send_response(CommandResponse.from_error(request.request_id, command_future),
+                                           request_codec)
             return
 
+        if is_async:
+            # Acknowledge straight away, the outcome is reported through JobRequest instead
+            job_id: int = self._job_table.add(command_future)
+            command_future.add_done_callback(functools.partial(_log_job_outcome, job_id, type(request.command)))
+            LOGGER.debug(f'Running {type(request.command).__name__} as job {job_id} on device {request.device_name}...')
+            await connection.send_response(JobResponse(request.request_id,
+                                                       ResponseCode.SUCCESS,
+                                                       job_id,
+                                                       job_status(command_future)),
+                                           request_codec)
+
         else:
-            LOGGER.debug(f'Running {type(request.command).__name__} on device {target_device.name}...')
-            result_future: Future[ResultType] = process_pool.submit(target_device.run, device_lock, request.command)
-            result_future.add_done_callback(partial(_result_callback, client_socket))
-            return
+            LOGGER.debug(f'Running {type(request.command).__name__} on device {request.device_name}...')
+            await connection.send_response(await _await_result(request.request_id, asyncio.wrap_future(command_future)),
+                                           request_codec)
+
+    async def _handle_batch_request(self: Self,
+                                    request: BatchRequest,
+                                    received_ns: int) -> BatchResponse:
+        LOGGER.debug(f'Running batch of {len(request.items)} commands '
+                     f'{"in parallel" if request.parallel else "sequentially"}...')
+        # Every item runs to completion, AsyncCommands included, so that later items observe their outcome
+        results: List[BatchResult] = []
+        if request.parallel:
+            # Items for the same device still run in order, each device worker is a FIFO queue
+            command_futures: List[Union[Future[Any], ResponseCode]] = [
+                self._submit_command(device_name, command, received_ns) for device_name, command in request.items]
+            if request.stop_on_error:
+                for index, command_future in enumerate(command_futures):
+                    if isinstance(command_future, ResponseCode):
+                        _cancel_all(command_futures[index + 1:])
+                        break
+
+            for index, command_future in enumerate(command_futures):
+                result: BatchResult = await _batch_result(request.request_id, command_future)
+                if request.stop_on_error and result[0] is not ResponseCode.SUCCESS:
+                    _cancel_all(command_futures[index + 1:])
+                results.append(result)
+
+        else:
+            for device_name, command in request.items:
+                if request.stop_on_error and results and results[-1][0] is not ResponseCode.SUCCESS:
+                    results.append((ResponseCode.CANCELLED, None))
+                else:
+                    results.append(await _batch_result(request.request_id,
+                                                       self._submit_command(device_name, command, received_ns)))
+
+        return BatchResponse(request.request_id, ResponseCode.SUCCESS, results)
+
+    def _submit_command(self: Self,
+                        device_name: str,
+                        command: Command[DeviceType, ResultType],
+                        received_ns: int) -> Union[Future[ResultType], ResponseCode]:
+        if device_name not in self._device_map:
+            LOGGER.error(f'Unknown device ID: {device_name}')
+            self._metrics.record_error(device_name, ResponseCode.ERROR_INVALID_DEVICE.name)
+            return ResponseCode.ERROR_INVALID_DEVICE
+
+        try:
+            command_future: Future[ResultType] = self._device_map[device_name].submit(command)
+        except RuntimeError as submit_error:
+            LOGGER.error(f'Failed to submit command to device {device_name}: {submit_error}')
+            self._metrics.record_error(device_name, ResponseCode.ERROR_UNKNOWN.name)
+            return ResponseCode.ERROR_UNKNOWN
+
+        self._metrics.command_submitted(device_name)
+        command_future.add_done_callback(functools.partial(self._record_command,
+                                                           device_name,
+                                                           type(command).__name__,
+                                                           received_ns))
+        return command_future
+
+    def _record_command(self: Self,
+                        device_name: str,
+                        command_name: str,
+                        received_ns: int,
+                        command_future: Future[Any]) -> None:
+        # Runs on the device thread as soon as the command finishes
+        queue_wait_ns: Optional[int] = None
+        execution_ns: Optional[int] = None
+        finished_ns: int = time.monotonic_ns()
+        if isinstance(command_future, ScheduledFuture) and command_future.started_ns is not None:
+            finished_ns = command_future.finished_ns
+            queue_wait_ns = command_future.started_ns - command_future.queued_ns
+            execution_ns = finished_ns - command_future.started_ns
+        self._metrics.command_finished(device_name, command_name, queue_wait_ns, execution_ns,
+                                       finished_ns - received_ns)
+
+        if command_future.cancelled():
+            self._metrics.record_error(device_name, ResponseCode.CANCELLED.name)
+        elif command_future.exception() is not None:
+            self._metrics.record_error(device_name, _failure_code(command_future.exception()).name)
+
+    async def _write_metrics(self: Self) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._metrics_interval)
+            try:
+                await loop.run_in_executor(None, self._metrics.write_prometheus, self._metrics_path)
+            except OSError as write_error:
+                LOGGER.error(f'Failed to write metrics to {self._metrics_path}: {write_error}')
+
+    async def _handle_job_request(self: Self,
+                                  request: JobRequest) -> JobResponse:
+        job_future: Optional[Future[None]] = self._job_table.get(request.job_id)
+        if job_future is None:
+            LOGGER.error(f'Unknown or expired job ID: {request.job_id}')
+            return JobResponse.from_error(request.request_id, request.job_id, ResponseCode.ERROR_UNKNOWN_JOB)
+
+        if request.action is JobAction.CANCEL:
+            # Queued jobs never start, running jobs are asked to stop through their cancellation token
+            job_future.cancel()
+
+        elif request.action is JobAction.WAIT and not job_future.done():
+            await asyncio.wait((asyncio.wrap_future(job_future),), timeout=request.timeout)
+
+        return _job_response(request.request_id, request.job_id, job_future)
 
 
 @final
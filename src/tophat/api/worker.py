@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import abc
+import contextlib
+import multiprocessing as mp
+import signal
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Generic, List, Optional, Set
+
+from typing_extensions import Self, final, override
+
+from tophat.api.device import CancellationToken, Command, DeviceBase, DeviceLock, DeviceType, ResultType
+from tophat.api.scheduler import CommandScheduler, ScheduledFuture
+
+# Commands a ConcurrentDeviceWorker runs at once, each holds a thread until it returns
+DEFAULT_MAX_CONCURRENT_COMMANDS: int = 32
+
+# Set once per resident worker process by _install_resident_device
+_RESIDENT_DEVICE: Optional[DeviceBase] = None
+_RESIDENT_LOCK: Optional[DeviceLock] = None
+
+
+def _install_resident_device(device: DeviceBase) -> None:
+    global _RESIDENT_DEVICE, _RESIDENT_LOCK
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _RESIDENT_DEVICE = device
+    _RESIDENT_LOCK = threading.Lock()
+
+
+def _run_resident_command(command: Command[DeviceType, ResultType]) -> ResultType:
+    return _RESIDENT_DEVICE.run(_RESIDENT_LOCK, command)
+
+
+def _ping() -> None:
+    pass
+
+
+class DeviceWorker(Generic[DeviceType], abc.ABC):
+
+    @final
+    @property
+    def device(self: Self) -> DeviceType:
+        return self._device
+
+    @abc.abstractmethod
+    def start(self: Self) -> None:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def submit(self: Self,
+               command: Command[DeviceType, ResultType]) -> Future[ResultType]:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def stop(self: Self) -> None:
+        raise NotImplementedError()
+
+    @override
+    def __init__(self,
+                 device: DeviceType) -> None:
+        self._device: DeviceType = device
+
+
+@final
+class ThreadDeviceWorker(DeviceWorker[DeviceType]):
+
+    @override
+    def start(self: Self) -> None:
+        # The scheduler's single thread already serializes commands, so this lock is never contended
+        self._scheduler = CommandScheduler(self._device, threading.Lock())
+        self._scheduler.start()
+
+    @override
+    def submit(self: Self,
+               command: Command[DeviceType, ResultType]) -> Future[ResultType]:
+        return self._scheduler.submit(command)
+
+    @override
+    def stop(self: Self) -> None:
+        if self._scheduler is not None:
+            self._scheduler.stop()
+            self._scheduler = None
+
+    @override
+    def __init__(self,
+                 device: DeviceType) -> None:
+        super().__init__(device)
+        self._scheduler: Optional[CommandScheduler] = None
+
+
+@final
+class ConcurrentDeviceWorker(DeviceWorker[DeviceType]):
+    # For devices whose commands only wait on state that is already thread safe. Every command runs on its own thread
+    # as soon as it is submitted and without the device lock, so concurrent waiters all block at the same time.
+    # Commands past max_commands are turned away rather than queued.
+
+    @override
+    def start(self: Self) -> None:
+        with self._lock:
+            self._stopped = False
+
+    @override
+    def submit(self: Self,
+               command: Command[DeviceType, ResultType]) -> Future[ResultType]:
+        future: ScheduledFuture = ScheduledFuture()
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError(f'Worker for device {self._device.name} has been stopped')
+            if len(self._running) >= self._max_commands:
+                raise RuntimeError(f'Worker for device {self._device.name} is already running '
+                                   f'{self._max_commands} commands')
+            self._running.add(future)
+        future.add_done_callback(self._discard)
+        threading.Thread(target=self._run_command,
+                         args=(command, future),
+                         name=f'{self._device.name}-command',
+                         daemon=True).start()
+        return future
+
+    @override
+    def stop(self: Self) -> None:
+        # Running commands are asked to stop at their next check of the cancellation token
+        with self._lock:
+            self._stopped = True
+            running: List[ScheduledFuture] = list(self._running)
+        for future in running:
+            future.cancel()
+
+    @override
+    def __init__(self,
+                 device: DeviceType,
+                 max_commands: int = DEFAULT_MAX_CONCURRENT_COMMANDS) -> None:
+        super().__init__(device)
+        self._max_commands: int = max_commands
+        self._lock: threading.Lock = threading.Lock()
+        self._running: Set[ScheduledFuture] = set()
+        self._stopped: bool = True
+
+    def _discard(self: Self,
+                 future: Future[ResultType]) -> None:
+        with self._lock:
+            self._running.discard(future)
+
+    def _run_command(self: Self,
+                     command: Command[DeviceType, ResultType],
+                     future: ScheduledFuture) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        future.mark_started()
+        CancellationToken.set_current(future.token)
+        try:
+            result: ResultType = self._device.run(contextlib.nullcontext(), command)
+        except BaseException as exception:
+            future.mark_finished()
+            future.set_exception(exception)
+        else:
+            future.mark_finished()
+            future.set_result(result)
+        finally:
+            CancellationToken.set_current(None)
+
+
+@final
+class ProcessDeviceWorker(DeviceWorker[DeviceType]):
+
+    @override
+    def start(self: Self) -> None:
+        # The device is pickled into the worker once, later submits only pickle the command. The worker is forked from
+        # a single threaded fork server rather than from the server, whose device threads may hold locks at any time.
+        self._executor = ProcessPoolExecutor(max_workers=1,
+                                             mp_context=mp.get_context('forkserver'),
+                                             initializer=_install_resident_device,
+                                             initargs=(self._device,))
+        # Start the worker now rather than on the first command
+        self._executor.submit(_ping).result()
+
+    @override
+    def submit(self: Self,
+               command: Command[DeviceType, ResultType]) -> Future[ResultType]:
+        # Commands run first come first served, a cancellation token cannot reach into the worker process
+        return self._executor.submit(_run_resident_command, command)
+
+    @override
+    def stop(self: Self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @override
+    def __init__(self,
+                 device: DeviceType) -> None:
+        super().__init__(device)
+        self._executor: Optional[ProcessPoolExecutor] = None
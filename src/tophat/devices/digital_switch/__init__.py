@@ -5,6 +5,7 @@ from typing import Any, Callable, Set, Type
 
 from typing_extensions import Concatenate, Self, final, override
 
+from tophat.api.codec import register_record
 from tophat.api.device import AsyncCommand, Command, Device, DeviceExtraParams
 
 
@@ -35,6 +36,7 @@ class DigitalSwitchDevice(Device, abc.ABC):
         return DigitalSwitchDeviceImpl
 
 
+@register_record(0x0100)
 @final
 class EnableCommand(AsyncCommand[DigitalSwitchDevice]):
 
@@ -44,6 +46,7 @@ class EnableCommand(AsyncCommand[DigitalSwitchDevice]):
         device.state = True
 
 
+@register_record(0x0101)
 @final
 class DisableCommand(AsyncCommand[DigitalSwitchDevice]):
 
@@ -53,6 +56,7 @@ class DisableCommand(AsyncCommand[DigitalSwitchDevice]):
         device.state = False
 
 
+@register_record(0x0102)
 @final
 class ToggleCommand(AsyncCommand[DigitalSwitchDevice]):
 
@@ -1,68 +1,107 @@
 from __future__ import annotations
 
 import abc
-import contextlib
 import dataclasses
-import itertools
+import enum
 import json
-import multiprocessing.synchronize as mp_sync
-import signal
+import logging
+import math
+import os
 import socket
+import threading
 import time
 from pathlib import Path
-from types import FrameType, TracebackType
-from typing import (Any, Callable, Concatenate, Dict, Generator, Iterable, Iterator, List, Optional, Sequence, Set,
-                    SupportsIndex, Tuple, Type, TypeVar, Union)
+from types import NoneType
+from typing import (Any, Callable, Concatenate, Dict, Iterable, Iterator, List, Optional, Sequence, Set, SupportsIndex,
+                    Tuple, Type, Union)
 
-from typing_extensions import Self, final, overload, override
+from typing_extensions import Buffer, Self, final, overload, override
 
-from tophat.api.device import AsyncCommand, Device, DeviceExtraParams, DeviceProxy
+from tophat.api.codec import register_record
+from tophat.api.device import AsyncCommand, CommandCancelledError, Device, DeviceExtraParams, DeviceLock, DeviceProxy
+from tophat.api.framing import send_frame
+from tophat.devices.neopixel.clock import FrameClock, FrameStats
+from tophat.devices.neopixel.render import (WHEEL_SIZE, BlendMode, ColorTuple, Easing, Frame, FrameRenderer,
+                                            create_renderer, ease, output_table)
 
-ColorTuple = Tuple[int, int, int]
-ExceptionType = TypeVar("ExceptionType",
-                        bound=BaseException)
+LOGGER = logging.getLogger('tophat')
+
+BACKEND_ENVIRONMENT_VARIABLE: str = 'TOPHAT_NEOPIXEL_BACKEND'
+
+# Plain commands and streams cover the whole strip at the bottom of the stack, each one replacing the last
+BASE_LAYER_NAME: str = ''
+
+_MIN_RECONNECT_DELAY: float = 0.1
+_MAX_RECONNECT_DELAY: float = 5.0
+
+# Command types by class name, filled from NeopixelDevice.supported_commands on first use
+_COMMAND_TYPES: Dict[str, Type[NeopixelCommand]] = {}
 
 
 @final
-class Duration(contextlib.AbstractContextManager):
-    class _TimedOutError(Exception):
-        pass
+class NeopixelBackend(enum.Enum):
+    HARDWARE = 'hardware'
+    # Records frames in memory instead of driving a strip, for development machines and CI
+    SIMULATED = 'simulated'
 
-    def _timeout_handler(self: Self,
-                         signum: int,
-                         frame: FrameType):
-        raise Duration._TimedOutError()
+    @classmethod
+    def from_environment(cls: Type[Self]) -> NeopixelBackend:
+        return cls(os.environ.get(BACKEND_ENVIRONMENT_VARIABLE, cls.HARDWARE.value))
 
-    @override
-    def __init__(self,
-                 duration: int) -> None:
-        self._duration: int = duration
 
-    @override
-    def __enter__(self: Self) -> Self:
-        self._original_sigalrm_handler: Optional[Callable] = signal.getsignal(signal.SIGALRM)
+class NeopixelDevice(Device, Sequence[ColorTuple], abc.ABC):
 
-        if self._duration > 0:
-            signal.signal(signal.SIGALRM, self._timeout_handler)
-            signal.alarm(self._duration)
+    @final
+    @property
+    def renderer(self: Self) -> FrameRenderer:
+        if self._renderer is None:
+            self._renderer = create_renderer(len(self))
+        return self._renderer
 
-        return self
+    @final
+    @property
+    def brightness(self: Self) -> float:
+        return self._brightness_level / 255
 
-    @override
-    def __exit__(self: Self,
-                 exc_type: Optional[Type[ExceptionType]],
-                 exc_val: Optional[ExceptionType],
-                 exc_tb: Optional[TracebackType]) -> bool:
-        # Cancel any existing alarm
-        signal.alarm(0)
+    @final
+    @brightness.setter
+    def brightness(self: Self,
+                   value: float) -> None:
+        if not 0.0 <= value <= 1.0:
+            raise ValueError(f'Brightness must be between 0 and 1, got {value}')
+        self._brightness_level = round(value * 255)
+        self._output_table = self._build_output_table()
 
-        # Reset SIGALRM handler
-        signal.signal(signal.SIGALRM, self._original_sigalrm_handler)
+    @final
+    @property
+    def gamma(self: Self) -> float:
+        return self._gamma
 
-        return exc_type is None or exc_type == Duration._TimedOutError
+    @final
+    @gamma.setter
+    def gamma(self: Self,
+              value: float) -> None:
+        if value <= 0.0:
+            raise ValueError(f'Gamma must be positive, got {value}')
+        self._gamma = value
+        self._output_table = self._build_output_table()
 
+    @final
+    def corrected(self: Self,
+                  frame: Frame) -> Frame:
+        # Brightness and gamma together cost a single table lookup pass over the frame
+        output_table: Optional[bytes] = self._output_table
+        if output_table is None:
+            return frame
+        return self.renderer.mapped(frame, output_table)
 
-class NeopixelDevice(Device, Sequence[ColorTuple], abc.ABC):
+    @final
+    def corrected_color(self: Self,
+                        color: ColorTuple) -> ColorTuple:
+        output_table: Optional[bytes] = self._output_table
+        if output_table is None:
+            return color
+        return output_table[color[0]], output_table[color[1]], output_table[color[2]]
 
     @abc.abstractmethod
     def fill(self: Self,
@@ -73,16 +112,51 @@ class NeopixelDevice(Device, Sequence[ColorTuple], abc.ABC):
     def show(self: Self):
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def write_frame(self: Self,
+                    frame: Frame) -> None:
+        raise NotImplementedError()
+
+    @final
+    def play(self: Self,
+             frame_at: Callable[[int], Optional[Frame]],
+             clock: FrameClock) -> None:
+        # frame_at maps a frame index to its frame, or None to leave the strip as it is.
+        # Dropped frames are skipped rather than shown late.
+        for frame_index in clock.ticks():
+            frame: Optional[Frame] = frame_at(frame_index)
+            if frame is not None:
+                self.write_frame(frame)
+        self._frame_stats = clock.stats
+
+    @final
+    def take_frame_stats(self: Self) -> Optional[FrameStats]:
+        frame_stats: Optional[FrameStats] = self._frame_stats
+        self._frame_stats = None
+        return frame_stats
+
     @classmethod
     @final
     @override
     def supported_commands(cls: Type[Self]) -> Set[Type[NeopixelCommand]]:
-        return {SolidColorCommand, BlinkCommand, PulseCommand, RainbowCommand, RainbowWaveCommand}
+        return {SolidColorCommand, BlinkCommand, PulseCommand, RainbowCommand, RainbowWaveCommand, LayerCommand,
+                TimelineCommand}
 
     @classmethod
     @final
     @override
     def _get_impl_builder(cls: Type[Self]) -> Callable[Concatenate[str, DeviceExtraParams], Self]:
+        return cls.impl_builder()
+
+    @classmethod
+    @final
+    def impl_builder(cls: Type[Self],
+                     backend: Optional[NeopixelBackend] = None) -> Callable[Concatenate[str, DeviceExtraParams], Self]:
+        if backend is None:
+            backend = NeopixelBackend.from_environment()
+        if backend is NeopixelBackend.SIMULATED:
+            from tophat.devices.neopixel._device_sim import SimulatedNeopixelDevice
+            return SimulatedNeopixelDevice
         from tophat.devices.neopixel._device_impl import NeopixelDeviceImpl
         return NeopixelDeviceImpl
 
@@ -130,17 +204,45 @@ class NeopixelDevice(Device, Sequence[ColorTuple], abc.ABC):
     def __iter__(self) -> Iterator[ColorTuple]:
         raise NotImplementedError()
 
+    @override
+    def __init__(self,
+                 device_name: str) -> None:
+        super().__init__(device_name)
+        self._renderer: Optional[FrameRenderer] = None
+        self._frame_stats: Optional[FrameStats] = None
+        self._brightness_level: int = 255
+        self._gamma: float = 1.0
+        # None while full brightness and linear output leave frames untouched
+        self._output_table: Optional[bytes] = None
+
+    def _build_output_table(self: Self) -> Optional[bytes]:
+        if self._brightness_level == 255 and self._gamma == 1.0:
+            return None
+        return output_table(self._brightness_level, self._gamma)
+
 
 @final
 class NeopixelDeviceProxy(DeviceProxy[NeopixelDevice]):
 
+    @property
+    def coalesced(self: Self) -> int:
+        return self._coalesced
+
     @override
     def run(self: Self,
-            lock: mp_sync.Lock,
+            lock: DeviceLock,
             command: NeopixelCommand) -> None:
-        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
-            client_socket.connect(str(self._socket_path))
-            client_socket.sendall(command.serialize())
+        # Commands are handed to the sender thread, one still waiting for the same layer is superseded unsent
+        with self._condition:
+            if self._pending.pop(command.layer_name, None) is not None:
+                self._coalesced += 1
+            self._pending[command.layer_name] = command
+            if self._sender is None:
+                self._sender = threading.Thread(target=self._send_commands,
+                                                name=f'{self.name}-link',
+                                                daemon=True)
+                self._sender.start()
+            self._condition.notify()
 
     @override
     def __init__(self,
@@ -148,156 +250,391 @@ class NeopixelDeviceProxy(DeviceProxy[NeopixelDevice]):
                  socket_path: Path) -> None:
         super().__init__(device_name)
         self._socket_path: Path = socket_path
+        self._condition: threading.Condition = threading.Condition()
+        self._pending: Dict[str, NeopixelCommand] = {}
+        self._coalesced: int = 0
+        self._sender: Optional[threading.Thread] = None
+        self._socket: Optional[socket.socket] = None
+
+    def _send_commands(self: Self) -> None:
+        retry_delay: float = _MIN_RECONNECT_DELAY
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                commands: List[NeopixelCommand] = list(self._pending.values())
+                self._pending.clear()
+
+            try:
+                for position, command in enumerate(commands):
+                    send_frame(self._connect(), command.serialize())
+            except OSError as link_error:
+                LOGGER.warning(f'Lost connection to neopixel server at {self._socket_path}: {link_error}')
+                self._disconnect()
+                with self._condition:
+                    # Put back whatever was not sent, unless a newer command for its layer arrived meanwhile
+                    for command in commands[position:]:
+                        self._pending.setdefault(command.layer_name, command)
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, _MAX_RECONNECT_DELAY)
+            else:
+                retry_delay = _MIN_RECONNECT_DELAY
+
+    def _connect(self: Self) -> socket.socket:
+        if self._socket is None:
+            client_socket: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                client_socket.connect(str(self._socket_path))
+            except OSError:
+                client_socket.close()
+                raise
+            self._socket = client_socket
+        return self._socket
+
+    def _disconnect(self: Self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class Animation:
+    # frame_at maps a frame index to its frame, or None while the previous frame still stands
+    frame_at: Callable[[int], Optional[Frame]]
+    fps: float
+    # A non-positive duration runs until preempted
+    duration: float
+    finished: Callable[[], bool] = lambda: False
+    # Number of frames after which the animation repeats itself, None if it never does
+    period: Optional[int] = None
+
+
+def _command_type(command_type_name: str) -> Type[NeopixelCommand]:
+    if not _COMMAND_TYPES:
+        _COMMAND_TYPES.update((command_type.__name__, command_type)
+                              for command_type in NeopixelDevice.supported_commands())
+    try:
+        return _COMMAND_TYPES[command_type_name]
+    except KeyError:
+        raise ValueError(f'Unsupported neopixel command {command_type_name}') from None
+
+
+def _to_json_kwargs(command: NeopixelCommand) -> Dict[str, Any]:
+    return {field.name: _to_json_value(getattr(command, field.name)) for field in dataclasses.fields(command)}
+
+
+def _to_json_value(value: Any) -> Any:
+    if isinstance(value, NeopixelCommand):
+        return {'command_type': type(value).__name__, 'command_kwargs': _to_json_kwargs(value)}
+    return value
+
+
+def _from_json_value(value: Any) -> Any:
+    if isinstance(value, dict) and 'command_type' in value:
+        if not isinstance(value.get('command_kwargs'), dict):
+            raise ValueError(f'Command {value["command_type"]!r} has no keyword arguments object')
+        command_kwargs: Dict[str, Any] = {name: _from_json_value(field_value)
+                                          for name, field_value in value['command_kwargs'].items()}
+        return _command_type(value['command_type'])(**command_kwargs)
+    if isinstance(value, list):
+        # JSON has no tuples, colours come back as lists and would leave the command unhashable
+        return tuple(_from_json_value(item) for item in value)
+    return value
 
 
 @dataclasses.dataclass(frozen=True, init=True)
 class NeopixelCommand(AsyncCommand[NeopixelDevice], abc.ABC):
 
+    @property
+    @override
+    def preemptible(self: Self) -> bool:
+        return True
+
+    @property
+    def layer_name(self: Self) -> str:
+        return BASE_LAYER_NAME
+
+    @abc.abstractmethod
+    def animate(self: Self,
+                renderer: FrameRenderer) -> Animation:
+        raise NotImplementedError()
+
+    @override
+    def run(self: Self,
+            device: NeopixelDevice) -> None:
+        animation: Animation = self.animate(device.renderer)
+        clock: FrameClock = FrameClock(animation.fps, animation.duration)
+
+        def next_frame(frame_index: int) -> Optional[Frame]:
+            if animation.finished():
+                clock.stop()
+            return animation.frame_at(frame_index)
+
+        device.play(next_frame, clock)
+        device.write_frame(device.renderer.blank())
+        if clock.cancelled:
+            raise CommandCancelledError(f'{type(self).__name__} was preempted')
+
     @final
     def serialize(self: Self) -> bytes:
-        serialized_data = {
-            'command_type': type(self).__name__,
-            'command_kwargs': {field.name: getattr(self, field.name) for field in dataclasses.fields(self)}
-        }
-        return json.dumps(serialized_data).encode('utf-8')
+        return json.dumps(_to_json_value(self)).encode('utf-8')
 
     @classmethod
     @final
     def deserialize(cls: Type[Self],
-                    data: bytes) -> NeopixelCommand:
-        deserialized_data = json.loads(data.decode('utf-8'))
-        command_type: str = deserialized_data['command_type']
-        command_kwargs: Dict[str, Any] = deserialized_data['command_kwargs']
-        for supported_command in NeopixelDevice.supported_commands():
-            if supported_command.__name__ == command_type:
-                return supported_command(**command_kwargs)
+                    data: Buffer) -> NeopixelCommand:
+        value: Any = json.loads(str(data, 'utf-8'))
+        if not isinstance(value, dict):
+            raise ValueError(f'Expected a command object, got {type(value).__name__}')
+        command: Any = _from_json_value(value)
+        if not isinstance(command, NeopixelCommand):
+            raise ValueError(f'Expected a neopixel command, got {type(command).__name__}')
+        return command
 
 
+@register_record(0x0200, types={'color': (tuple, list)})
 @final
 @dataclasses.dataclass(frozen=True, init=True)
 class SolidColorCommand(NeopixelCommand):
     color: ColorTuple
 
+    @override
+    def animate(self: Self,
+                renderer: FrameRenderer) -> Animation:
+        frame: Frame = renderer.solid(self.color)
+        return Animation(lambda frame_index: frame if frame_index == 0 else None, 1, 0, period=1)
+
     @override
     def run(self: Self,
             device: NeopixelDevice) -> None:
-        device.fill(self.color)
-        device.show()
+        # A solid colour stays up until the next command, there is nothing to wait for
+        device.write_frame(device.renderer.solid(self.color))
 
 
+@register_record(0x0201, types={'duration': (int, float), 'color': (tuple, list), 'frequency': int})
 @final
 @dataclasses.dataclass(frozen=True, init=True)
 class BlinkCommand(NeopixelCommand):
-    duration: int
+    duration: float
     color: ColorTuple
     frequency: int = 2
 
     @override
-    def run(self: Self,
-            device: NeopixelDevice) -> None:
-        with Duration(self.duration):
-            while True:
-                device.fill(self.color)
-                device.show()
-                time.sleep(1 / self.frequency / 2)
+    def animate(self: Self,
+                renderer: FrameRenderer) -> Animation:
+        frames: Tuple[Frame, Frame] = (renderer.solid(self.color), renderer.blank())
+        return Animation(lambda frame_index: frames[frame_index % 2], self.frequency * 2, self.duration, period=2)
+
 
-                device.fill((0, 0, 0))
-                time.sleep(1 / self.frequency / 2)
-        device.fill((0, 0, 0))
-        device.show()
+_PULSE_STEPS: int = 64
 
 
+@register_record(0x0202,
+                 types={'duration': (int, float), 'color': (tuple, list), 'frequency': int, 'blanks': int})
 @final
 @dataclasses.dataclass(frozen=True, init=True)
 class PulseCommand(NeopixelCommand):
-    duration: int
+    duration: float
     color: ColorTuple
     frequency: int = 2
     blanks: int = 0
 
     @override
-    def run(self: Self,
-            device: NeopixelDevice) -> None:
-        with Duration(self.duration):
-            for i in itertools.chain(range(0, 1000, 1), range(999, 0, -1)):
-                device.brightness = i / 1000
-                device.show()
-                time.sleep(1 / self.frequency / 1000 / 2)
-        device.fill((0, 0, 0))
-        device.show()
-
-
-_CycleGenerator = Generator[int, None, None]
-
-
-def _cycle_generator(min_val: int = 0,
-                     max_val: int = 255,
-                     steps: int = 1,
-                     blanks: int = 0) -> _CycleGenerator:
-    bounded_min = max(0, min_val)
-    bounded_max = min(max_val, 255)
-    bounded_steps = max(0, steps)
-    assert bounded_max > bounded_min
+    def animate(self: Self,
+                renderer: FrameRenderer) -> Animation:
+        full: Frame = renderer.solid(self.color)
+        # Ramp up and back down once per period, then hold dark for the requested number of steps
+        levels: List[int] = [255 * step // _PULSE_STEPS for step in range(_PULSE_STEPS)]
+        pulse: List[Frame] = ([renderer.scaled(full, level) for level in levels]
+                              + [renderer.scaled(full, 255)]
+                              + [renderer.scaled(full, level) for level in reversed(levels)]
+                              + [renderer.blank()] * self.blanks)
+        return Animation(lambda frame_index: pulse[frame_index % len(pulse)],
+                         self.frequency * (2 * _PULSE_STEPS + 1),
+                         self.duration,
+                         period=len(pulse))
+
+
+@register_record(0x0203, types={'duration': (int, float), 'frequency': int})
+@final
+@dataclasses.dataclass(frozen=True, init=True)
+class RainbowCommand(NeopixelCommand):
+    duration: float
+    frequency: int = 200
 
-    yield from itertools.cycle(itertools.chain(range(bounded_min, bounded_max, bounded_steps),
-                                               range(bounded_max, bounded_min - 1, -bounded_steps),
-                                               (0,) * blanks))
+    @override
+    def animate(self: Self,
+                renderer: FrameRenderer) -> Animation:
+        return Animation(renderer.wheel, self.frequency, self.duration, period=WHEEL_SIZE)
 
 
-_ColorGenerator = Generator[ColorTuple, None, None]
+@register_record(0x0204, types={'duration': (int, float), 'frequency': int})
+@final
+@dataclasses.dataclass(frozen=True, init=True)
+class RainbowWaveCommand(NeopixelCommand):
+    duration: float
+    frequency: int = 200
 
+    @override
+    def animate(self: Self,
+                renderer: FrameRenderer) -> Animation:
+        # Spread one full turn of the wheel across the strip
+        spacing: int = max(1, WHEEL_SIZE // renderer.num_pixels)
+        return Animation(lambda frame_index: renderer.wheel(frame_index, spacing),
+                         self.frequency,
+                         self.duration,
+                         period=WHEEL_SIZE)
+
+
+@register_record(0x0205,
+                 converters={'blend': BlendMode},
+                 types={'effect': NeopixelCommand, 'start': int, 'stop': (int, NoneType), 'z_order': int,
+                        'blend': BlendMode, 'opacity': int, 'expires': (int, float), 'name': (str, NoneType)})
+@final
+@dataclasses.dataclass(frozen=True, init=True)
+class LayerCommand(NeopixelCommand):
+    effect: NeopixelCommand
+    start: int = 0
+    # Exclusive, None runs to the end of the strip
+    stop: Optional[int] = None
+    z_order: int = 0
+    blend: BlendMode = BlendMode.REPLACE
+    opacity: int = 255
+    # Seconds until the layer is removed, a non-positive value keeps it for as long as its effect runs
+    expires: float = 0
+    # Layers sharing a name replace each other, unnamed layers are named after their pixel range
+    name: Optional[str] = None
+
+    @property
+    @override
+    def layer_name(self: Self) -> str:
+        return self.name if self.name is not None else f'{self.start}:{self.stop}'
 
-def _rainbow_generator(start: int = 0) -> _ColorGenerator:
-    bounded_start: int = max(min(start, 765), 0)
+    def pixel_range(self: Self,
+                    num_pixels: int) -> Tuple[int, int]:
+        stop: int = num_pixels if self.stop is None else min(self.stop, num_pixels)
+        return min(self.start, stop), stop
 
-    red_start: int = bounded_start
-    green_start: int = (bounded_start + 255) % 765
-    blue_start: int = (bounded_start + (255 * 2)) % 765
+    @override
+    def animate(self: Self,
+                renderer: FrameRenderer) -> Animation:
+        # Played on its own the layer is composited over a dark strip
+        start: int
+        stop: int
+        start, stop = self.pixel_range(renderer.num_pixels)
+        effect: Animation = self.effect.animate(renderer.with_size(stop - start))
 
-    red = itertools.islice(_cycle_generator(blanks=255), red_start, None)
-    green = itertools.islice(_cycle_generator(blanks=255), green_start, None)
-    blue = itertools.islice(_cycle_generator(blanks=255), blue_start, None)
+        def frame_at(frame_index: int) -> Optional[Frame]:
+            effect_frame: Optional[Frame] = effect.frame_at(frame_index)
+            if effect_frame is None:
+                return None
+            frame: Frame = renderer.solid((0, 0, 0))
+            renderer.blend(frame, start, effect_frame, BlendMode(self.blend), self.opacity)
+            return frame
 
-    while True:
-        yield next(red), next(green), next(blue)
+        duration: float = effect.duration
+        if self.expires > 0:
+            duration = min(duration, self.expires) if duration > 0 else self.expires
+        return Animation(frame_at, effect.fps, duration, effect.finished, effect.period)
 
 
-@final
-@dataclasses.dataclass(frozen=True, init=True)
-class RainbowCommand(NeopixelCommand):
-    duration: int
-    frequency: int = 200
+# Time in seconds, first pixel, pixel after the last, colour reached at that time, and the Easing used to get there
+Keyframe = Tuple[float, int, int, ColorTuple, int]
 
-    @override
-    def run(self: Self,
-            device: NeopixelDevice) -> None:
-        with Duration(self.duration):
-            for color in _rainbow_generator():
-                device.fill(color)
-                device.show()
-                time.sleep(1 / self.frequency)
-        device.fill((0, 0, 0))
-        device.show()
+# Largest compiled timeline, the same budget as the whole frame cache by default
+MAX_TIMELINE_BYTES: int = 16 << 20
 
 
+@register_record(0x0206, types={'keyframes': (tuple, list), 'frequency': int, 'repeat': bool})
 @final
 @dataclasses.dataclass(frozen=True, init=True)
-class RainbowWaveCommand(NeopixelCommand):
-    duration: int
-    frequency: int = 200
+class TimelineCommand(NeopixelCommand):
+    # A pixel range stays dark until its first keyframe, then eases from each keyframe to the next and holds the last.
+    # Ranges that first appear later draw over earlier ones.
+    keyframes: Tuple[Keyframe, ...]
+    frequency: int = 60
+    # Loops until preempted instead of ending after the last keyframe
+    repeat: bool = False
+
+    @property
+    def length(self: Self) -> float:
+        return max((keyframe[0] for keyframe in self.keyframes), default=0.0)
 
     @override
-    def run(self: Self,
-            device: NeopixelDevice) -> None:
-        num_pixels: int = len(device)
-        start_offset: int = 765 // num_pixels
-
-        color_generators: Tuple[_ColorGenerator, ...] = tuple(_rainbow_generator(start=start_offset * i)
-                                                              for i
-                                                              in range(0, num_pixels))
-        with Duration(self.duration):
-            time.sleep(1 / self.frequency)
-            for i in range(0, num_pixels):
-                device[i] = next(color_generators[i])
-        device.fill((0, 0, 0))
-        device.show()
+    def animate(self: Self,
+                renderer: FrameRenderer) -> Animation:
+        # The whole timeline is compiled once, playing it back is indexing into the frame array
+        frame_count: int = math.floor(self.length * self.frequency) + 1
+        if frame_count * renderer.num_pixels * 3 > MAX_TIMELINE_BYTES:
+            raise ValueError(f'Timeline of {frame_count} frames on {renderer.num_pixels} pixels exceeds '
+                             f'{MAX_TIMELINE_BYTES} bytes')
+        frames: Sequence[Frame] = renderer.frames_from_buffer(self._compile(renderer.num_pixels, frame_count),
+                                                              frame_count)
+        return Animation(lambda frame_index: frames[frame_index % frame_count],
+                         self.frequency,
+                         0 if self.repeat else frame_count / self.frequency,
+                         period=frame_count)
+
+    def __post_init__(self: Self) -> None:
+        if not self.frequency > 0:
+            raise ValueError(f'Timeline frequency must be positive, got {self.frequency}')
+        for keyframe in self.keyframes:
+            if not 0 <= keyframe[0] < math.inf:
+                raise ValueError(f'Keyframe time must be a finite non-negative number of seconds, got {keyframe[0]}')
+
+    def _compile(self: Self,
+                 num_pixels: int,
+                 frame_count: int) -> bytes:
+        tracks: Dict[Tuple[int, int], List[Tuple[float, ColorTuple, Easing]]] = {}
+        for time_s, start, stop, color, easing in sorted(self.keyframes, key=lambda keyframe: keyframe[0]):
+            start = min(max(start, 0), num_pixels)
+            stop = min(max(stop, start), num_pixels)
+            tracks.setdefault((start, stop), []).append((time_s, tuple(color), Easing(easing)))
+        ranges: List[Tuple[int, int]] = list(tracks)
+
+        # Only the frames where a range changes colour are worked out, everything in between is held
+        changes: Dict[int, List[Tuple[int, bytes]]] = {}
+        for track_index, ((start, stop), track) in enumerate(tracks.items()):
+            shown: Optional[bytes] = None
+            previous_time: float = track[0][0]
+            previous_color: ColorTuple = track[0][1]
+            # The first keyframe is shown as it is on its own frame, every later one is eased into from the one before
+            first_index: int = math.floor(previous_time * self.frequency)
+            for time_s, color, easing in track:
+                span: float = time_s - previous_time
+                for frame_index in range(first_index, min(frame_count - 1, math.floor(time_s * self.frequency)) + 1):
+                    progress: float = (frame_index / self.frequency - previous_time) / span if span > 0 else 1.0
+                    mix: float = ease(easing, min(max(progress, 0.0), 1.0))
+                    value: bytes = bytes(round(old + (new - old) * mix) for old, new in zip(previous_color, color))
+                    if value != shown:
+                        changes.setdefault(frame_index, []).append((track_index, value * (stop - start)))
+                        shown = value
+                first_index = max(first_index, math.floor(time_s * self.frequency) + 1)
+                previous_time, previous_color = time_s, color
+
+        # Redrawing a range also redraws the later ranges drawn over it
+        covered_by: List[List[int]] = [[later_index for later_index in range(track_index + 1, len(ranges))
+                                        if ranges[later_index][0] < stop and start < ranges[later_index][1]]
+                                       for track_index, (start, stop) in enumerate(ranges)]
+        current: List[Optional[bytes]] = [None] * len(ranges)
+        frame_size: int = num_pixels * 3
+        data: bytearray = bytearray(frame_count * frame_size)
+        for frame_index in range(frame_count):
+            offset: int = frame_index * frame_size
+            if frame_index:
+                data[offset:offset + frame_size] = data[offset - frame_size:offset]
+            changed: Optional[List[Tuple[int, bytes]]] = changes.get(frame_index)
+            if changed is None:
+                continue
+            redraw: Set[int] = set()
+            for track_index, pixels in changed:
+                current[track_index] = pixels
+                redraw.add(track_index)
+                redraw.update(covered_by[track_index])
+            for track_index in sorted(redraw):
+                pixels: Optional[bytes] = current[track_index]
+                if pixels is not None:
+                    start, stop = ranges[track_index]
+                    data[offset + start * 3:offset + stop * 3] = pixels
+        return bytes(data)
@@ -7,6 +7,7 @@ import neopixel
 from typing_extensions import Self, final, override
 
 from tophat.devices.neopixel import ColorTuple, NeopixelDevice
+from tophat.devices.neopixel.render import Frame
 
 
 @final
@@ -15,19 +16,30 @@ class NeopixelDeviceImpl(NeopixelDevice):
     @override
     def fill(self: Self,
              color: ColorTuple):
-        self._pixels.fill(color)
+        self._pixels.fill(self.corrected_color(color))
 
     @override
     def show(self: Self):
         self._pixels.show()
 
+    @override
+    def write_frame(self: Self,
+                    frame: Frame) -> None:
+        # Copies the whole frame into the pixel buffer in wire order at once instead of setting pixels one by one,
+        # this relies on the pixelbuf internals of adafruit-circuitpython-pixelbuf
+        frame_bytes: Union[bytes, bytearray] = self.renderer.to_bytes(self.corrected(frame), self._pixels._byteorder)
+        offset: int = self._pixels._offset
+        self._pixels._post_brightness_buffer[offset:offset + len(frame_bytes)] = frame_bytes
+        self._pixels.show()
+
     @override
     def __init__(self,
                  device_name: str,
                  pin: board.pin.Pin,
                  num_leds: int) -> None:
         super().__init__(device_name)
-        self._pixels: neopixel.NeoPixel = neopixel.NeoPixel(pin, num_leds)
+        # Brightness is applied through the device's output table, the library's own scaling stays at full
+        self._pixels: neopixel.NeoPixel = neopixel.NeoPixel(pin, num_leds, brightness=1.0, auto_write=False)
 
     @override
     def __getitem__(self,
@@ -38,7 +50,10 @@ class NeopixelDeviceImpl(NeopixelDevice):
     def __setitem__(self,
                     key: Union[SupportsIndex, slice],
                     value: Union[ColorTuple, Iterable[ColorTuple]]) -> None:
-        self._pixels[key] = value
+        if isinstance(key, slice):
+            self._pixels[key] = [self.corrected_color(color) for color in value]
+        else:
+            self._pixels[key] = self.corrected_color(value)
 
     @override
     def __len__(self) -> int:
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import array
+import time
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, SupportsIndex, Union
+
+from typing_extensions import Self, final, override
+
+from tophat.devices.neopixel import ColorTuple, NeopixelDevice
+from tophat.devices.neopixel.render import Frame
+
+DEFAULT_FRAME_CAPACITY: int = 1024
+
+
+class RecordedFrame(NamedTuple):
+    timestamp_ns: int
+    pixels: bytes
+
+
+@final
+class SimulatedNeopixelDevice(NeopixelDevice):
+
+    @property
+    def capacity(self: Self) -> int:
+        return self._capacity
+
+    @property
+    def frame_count(self: Self) -> int:
+        return self._frame_count
+
+    def frames(self: Self,
+               last: Optional[int] = None) -> List[RecordedFrame]:
+        # Oldest first, only the most recent capacity frames are kept
+        available: int = min(self._frame_count, self._capacity)
+        if last is not None:
+            available = min(available, last)
+        frame_size: int = len(self._pixels)
+        recorded: List[RecordedFrame] = []
+        for frame_number in range(self._frame_count - available, self._frame_count):
+            slot: int = frame_number % self._capacity
+            recorded.append(RecordedFrame(self._timestamps[slot],
+                                          bytes(self._ring[slot * frame_size:(slot + 1) * frame_size])))
+        return recorded
+
+    def clear_frames(self: Self) -> None:
+        self._frame_count = 0
+
+    @override
+    def fill(self: Self,
+             color: ColorTuple):
+        self._pixels[:] = bytes(self.corrected_color(color)) * len(self)
+
+    @override
+    def show(self: Self):
+        self._record(self._pixels)
+
+    @override
+    def write_frame(self: Self,
+                    frame: Frame) -> None:
+        frame_bytes: Union[bytes, bytearray] = self.renderer.to_bytes(self.corrected(frame))
+        self._pixels[:] = frame_bytes
+        self._record(frame_bytes)
+
+    @override
+    def __init__(self,
+                 device_name: str,
+                 pin: Any,
+                 num_leds: int,
+                 capacity: int = DEFAULT_FRAME_CAPACITY) -> None:
+        # The pin is accepted so the simulation can stand in for the hardware anywhere, it is not used
+        super().__init__(device_name)
+        self._pixels: bytearray = bytearray(num_leds * 3)
+        self._capacity: int = capacity
+        # Preallocated so recording a frame never allocates
+        self._ring: bytearray = bytearray(capacity * num_leds * 3)
+        self._timestamps: array.array = array.array('q', bytes(8 * capacity))
+        self._frame_count: int = 0
+
+    @override
+    def __getitem__(self,
+                    item: Union[SupportsIndex, slice]) -> Union[ColorTuple, List[ColorTuple]]:
+        if isinstance(item, slice):
+            return [self[index] for index in range(*item.indices(len(self)))]
+        index: int = range(len(self))[item]
+        return tuple(self._pixels[index * 3:index * 3 + 3])
+
+    @override
+    def __setitem__(self,
+                    key: Union[SupportsIndex, slice],
+                    value: Union[ColorTuple, Iterable[ColorTuple]]) -> None:
+        if isinstance(key, slice):
+            for index, color in zip(range(*key.indices(len(self))), value):
+                self[index] = color
+            return
+        index: int = range(len(self))[key]
+        self._pixels[index * 3:index * 3 + 3] = bytes(self.corrected_color(value))
+
+    @override
+    def __len__(self) -> int:
+        return len(self._pixels) // 3
+
+    @override
+    def __iter__(self) -> Iterator[ColorTuple]:
+        return (self[index] for index in range(len(self)))
+
+    def _record(self: Self,
+                frame_bytes: Union[bytes, bytearray]) -> None:
+        slot: int = self._frame_count % self._capacity
+        frame_size: int = len(self._pixels)
+        self._ring[slot * frame_size:(slot + 1) * frame_size] = frame_bytes
+        self._timestamps[slot] = time.monotonic_ns()
+        self._frame_count += 1
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import itertools
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from tophat.api.metrics import LatencyHistogram
+from tophat.devices.neopixel import (BlinkCommand, LayerCommand, NeopixelCommand, PulseCommand, RainbowCommand,
+                                     RainbowWaveCommand, SolidColorCommand, TimelineCommand)
+from tophat.devices.neopixel._device_sim import SimulatedNeopixelDevice
+from tophat.devices.neopixel.clock import FrameStats
+from tophat.devices.neopixel.render import (WHEEL_SIZE, BlendMode, ByteOrder, Easing, Frame, FrameRenderer,
+                                            create_renderer, np, output_table)
+
+# The default pixel order of a WS2812 strip, frames are reordered on every write
+GRB_ORDER: ByteOrder = (1, 0, 2)
+
+
+def _solid_frames(renderer: FrameRenderer) -> Iterator[Frame]:
+    for step in itertools.cycle(range(WHEEL_SIZE)):
+        yield renderer.solid((step % 256, 0, 255 - step % 256))
+
+
+def _blink_frames(renderer: FrameRenderer) -> Iterator[Frame]:
+    return itertools.cycle((renderer.solid((0, 255, 0)), renderer.blank()))
+
+
+def _pulse_frames(renderer: FrameRenderer) -> Iterator[Frame]:
+    full: Frame = renderer.solid((0, 0, 255))
+    for level in itertools.cycle(itertools.chain(range(256), range(255, -1, -1))):
+        yield renderer.scaled(full, level)
+
+
+def _rainbow_frames(renderer: FrameRenderer) -> Iterator[Frame]:
+    for step in itertools.cycle(range(WHEEL_SIZE)):
+        yield renderer.wheel(step)
+
+
+def _rainbow_wave_frames(renderer: FrameRenderer) -> Iterator[Frame]:
+    spacing: int = max(1, WHEEL_SIZE // renderer.num_pixels)
+    for step in itertools.cycle(range(WHEEL_SIZE)):
+        yield renderer.wheel(step, spacing)
+
+
+EFFECTS: Dict[str, Callable[[FrameRenderer], Iterator[Frame]]] = {
+    'solid': _solid_frames,
+    'blink': _blink_frames,
+    'pulse': _pulse_frames,
+    'rainbow': _rainbow_frames,
+    'rainbow-wave': _rainbow_wave_frames,
+}
+
+
+def _frames_per_second(renderer: FrameRenderer,
+                       effect_name: str,
+                       num_frames: int) -> float:
+    # Everything a frame costs before it reaches the wire, rendering plus reordering into pixel order
+    frames: Iterator[Frame] = EFFECTS[effect_name](renderer)
+    start_time: float = time.perf_counter()
+    for frame in itertools.islice(frames, num_frames):
+        renderer.to_bytes(frame, GRB_ORDER)
+    return num_frames / (time.perf_counter() - start_time)
+
+
+def run_render(num_frames: int,
+               strip_lengths: List[int],
+               effect_names: List[str]) -> None:
+    renderer_names: List[str] = ['bytearray'] if np is None else ['numpy', 'bytearray']
+    print(f'{"effect":<16}{"pixels":>8}' + ''.join(f'{renderer_name:>16}' for renderer_name in renderer_names))
+    for effect_name in effect_names:
+        for num_pixels in strip_lengths:
+            results: List[float] = [_frames_per_second(create_renderer(num_pixels, renderer_name == 'numpy'),
+                                                       effect_name,
+                                                       num_frames)
+                                    for renderer_name in renderer_names]
+            print(f'{effect_name:<16}{num_pixels:>8}' + ''.join(f'{fps:>12.0f} fps' for fps in results))
+
+
+def _sample_commands(duration: float) -> Dict[str, NeopixelCommand]:
+    return {
+        'solid': SolidColorCommand((255, 0, 0)),
+        'blink': BlinkCommand(duration, (0, 255, 0), 5),
+        'pulse': PulseCommand(duration, (0, 0, 255)),
+        'rainbow': RainbowCommand(duration),
+        'rainbow-wave': RainbowWaveCommand(duration),
+        'layer': LayerCommand(RainbowWaveCommand(duration), 4, None, blend=BlendMode.ADD),
+        'timeline': TimelineCommand(((0.0, 0, 20, (0, 0, 0), Easing.STEP),
+                                     (duration / 2, 0, 20, (255, 0, 0), Easing.EASE_IN_OUT),
+                                     (duration, 0, 20, (0, 0, 255), Easing.LINEAR),
+                                     (duration / 4, 10, 30, (0, 255, 0), Easing.STEP))),
+    }
+
+
+def _play_command(command: NeopixelCommand,
+                  num_pixels: int,
+                  duration: float) -> SimulatedNeopixelDevice:
+    # Room for every frame the command can show, so none of them are overwritten before they are measured
+    capacity: int = int(duration * command.animate(create_renderer(num_pixels)).fps * 1.1) + 16
+    device: SimulatedNeopixelDevice = SimulatedNeopixelDevice('benchmark', None, num_pixels, capacity)
+    command.run(device)
+    return device
+
+
+def _memory_per_frame(command: NeopixelCommand,
+                      num_pixels: int,
+                      duration: float) -> Tuple[float, float]:
+    # Python does not count allocations cheaply, so report the traced peak and the blocks left behind per frame
+    tracemalloc.start()
+    blocks_before: int = sys.getallocatedblocks()
+    device: SimulatedNeopixelDevice = _play_command(command, num_pixels, duration)
+    blocks_after: int = sys.getallocatedblocks()
+    peak: int = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024, (blocks_after - blocks_before) / max(device.frame_count, 1)
+
+
+def run_commands(duration: float,
+                 strip_lengths: List[int],
+                 command_names: List[str]) -> None:
+    commands: Dict[str, NeopixelCommand] = _sample_commands(duration)
+    print(f'{"command":<14}{"pixels":>7}{"requested":>11}{"achieved":>10}{"deviation":>11}{"dropped":>9}'
+          f'{"p50":>11}{"p99":>11}{"max":>11}{"peak":>11}{"blocks":>8}')
+    for command_name in command_names:
+        command: NeopixelCommand = commands[command_name]
+        for num_pixels in strip_lengths:
+            device: SimulatedNeopixelDevice = _play_command(command, num_pixels, duration)
+            frame_stats: Optional[FrameStats] = device.take_frame_stats()
+            peak_kib: float
+            blocks_per_frame: float
+            peak_kib, blocks_per_frame = _memory_per_frame(command, num_pixels, min(duration, 1.0))
+            if frame_stats is None:
+                # A solid colour is a single write, there is no rate to measure
+                print(f'{command_name:<14}{num_pixels:>7}{"-":>11}{"-":>10}{"-":>11}{"-":>9}{"-":>11}{"-":>11}{"-":>11}'
+                      f'{peak_kib:>7.1f} KiB{blocks_per_frame:>8.2f}')
+                continue
+
+            # The blank written once the effect ends is not part of its frame rate
+            timestamps: List[int] = [frame.timestamp_ns for frame in device.frames()][:-1]
+            frame_times: LatencyHistogram = LatencyHistogram()
+            for previous, current in zip(timestamps, timestamps[1:]):
+                frame_times.record(current - previous)
+            deviation: float = (frame_stats.fps - frame_stats.requested_fps) / frame_stats.requested_fps
+            print(f'{command_name:<14}{num_pixels:>7}{frame_stats.requested_fps:>7.1f} fps{frame_stats.fps:>6.1f} fps'
+                  f'{deviation:>+10.1%}{frame_stats.frames_dropped:>9}'
+                  f'{frame_times.quantile(0.5) / 1e6:>8.2f} ms{frame_times.quantile(0.99) / 1e6:>8.2f} ms'
+                  f'{frame_times.snapshot()["max_ns"] / 1e6:>8.2f} ms'
+                  f'{peak_kib:>7.1f} KiB{blocks_per_frame:>8.2f}')
+
+
+def _rescaled_per_value(frame_bytes: bytes,
+                        brightness: float) -> bytearray:
+    # What the pixel library does on every show while its own brightness is below one
+    return bytearray(int(value * brightness) for value in frame_bytes)
+
+
+def _brightness_frames_per_second(renderer: FrameRenderer,
+                                  num_frames: int,
+                                  use_table: bool,
+                                  gamma: float) -> float:
+    # A fade through every brightness level over a rainbow, one correction per shown frame
+    frames: List[Frame] = [renderer.wheel(step, 1) for step in range(WHEEL_SIZE)]
+    frame_bytes: List[bytes] = [bytes(renderer.to_bytes(frame)) for frame in frames]
+    # Tables are built once per level and then cached, a running device never pays for them again
+    for level in range(256):
+        output_table(level, gamma)
+    start_time: float = time.perf_counter()
+    for frame_index in range(num_frames):
+        level: int = frame_index % 256
+        if use_table:
+            renderer.to_bytes(renderer.mapped(frames[frame_index % WHEEL_SIZE], output_table(level, gamma)), GRB_ORDER)
+        else:
+            _rescaled_per_value(frame_bytes[frame_index % WHEEL_SIZE], level / 255)
+    return num_frames / (time.perf_counter() - start_time)
+
+
+def run_brightness(num_frames: int,
+                   strip_lengths: List[int],
+                   gamma: float) -> None:
+    renderer_names: List[str] = ['bytearray'] if np is None else ['numpy', 'bytearray']
+    print(f'{"pixels":>8}{"per value":>16}' + ''.join(f'{renderer_name + " table":>18}'
+                                                      for renderer_name in renderer_names))
+    for num_pixels in strip_lengths:
+        per_value: float = _brightness_frames_per_second(create_renderer(num_pixels, False), num_frames, False, gamma)
+        results: List[float] = [_brightness_frames_per_second(create_renderer(num_pixels, renderer_name == 'numpy'),
+                                                              num_frames,
+                                                              True,
+                                                              gamma)
+                                for renderer_name in renderer_names]
+        print(f'{num_pixels:>8}{per_value:>12.0f} fps' + ''.join(f'{fps:>14.0f} fps' for fps in results))
+
+
+def main() -> None:
+    arg_parser = ArgumentParser(description='Benchmark neopixel effects')
+    sub_parsers = arg_parser.add_subparsers(dest='benchmark', required=True)
+
+    render_parser = sub_parsers.add_parser('render',
+                                           help='Frames per second each renderer can produce per effect')
+    render_parser.add_argument('--frames',
+                               dest='num_frames',
+                               type=int,
+                               default=2000)
+    render_parser.add_argument('--pixels',
+                               dest='strip_lengths',
+                               type=int,
+                               nargs='+',
+                               default=[38, 144, 300, 1000])
+    render_parser.add_argument('effects',
+                               nargs='*',
+                               metavar='effect',
+                               help=f'Any of: {", ".join(EFFECTS)}')
+
+    commands_parser = sub_parsers.add_parser('commands',
+                                             help='Play every command on a simulated strip and measure its pacing')
+    commands_parser.add_argument('--duration',
+                                 dest='duration',
+                                 type=float,
+                                 default=2.0)
+    commands_parser.add_argument('--pixels',
+                                 dest='strip_lengths',
+                                 type=int,
+                                 nargs='+',
+                                 default=[38, 300])
+    commands_parser.add_argument('commands',
+                                 nargs='*',
+                                 metavar='command',
+                                 help=f'Any of: {", ".join(_sample_commands(0))}')
+
+    brightness_parser = sub_parsers.add_parser('brightness',
+                                               help='Brightness and gamma through lookup tables against rescaling '
+                                                    'every value')
+    brightness_parser.add_argument('--frames',
+                                   dest='num_frames',
+                                   type=int,
+                                   default=2000)
+    brightness_parser.add_argument('--pixels',
+                                   dest='strip_lengths',
+                                   type=int,
+                                   nargs='+',
+                                   default=[38, 144, 300, 1000])
+    brightness_parser.add_argument('--gamma',
+                                   dest='gamma',
+                                   type=float,
+                                   default=2.8)
+
+    args = arg_parser.parse_args()
+    if args.benchmark == 'render':
+        effect_names: List[str] = args.effects or list(EFFECTS)
+        for effect_name in effect_names:
+            if effect_name not in EFFECTS:
+                arg_parser.error(f'Unknown effect {effect_name}')
+        run_render(args.num_frames, args.strip_lengths, effect_names)
+
+    elif args.benchmark == 'commands':
+        command_names: List[str] = args.commands or list(_sample_commands(0))
+        for command_name in command_names:
+            if command_name not in _sample_commands(0):
+                arg_parser.error(f'Unknown command {command_name}')
+        run_commands(args.duration, args.strip_lengths, command_names)
+
+    elif args.benchmark == 'brightness':
+        run_brightness(args.num_frames, args.strip_lengths, args.gamma)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import collections
+import threading
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, OrderedDict, Sequence, Tuple, Type, Union
+
+from typing_extensions import Self, final, override
+
+from tophat.devices.neopixel import Animation, NeopixelCommand
+from tophat.devices.neopixel.render import Frame, FrameRenderer
+
+DEFAULT_CACHE_BYTES: int = 16 << 20
+
+_CacheKey = Tuple[Hashable, int, Type[FrameRenderer]]
+
+
+class _Sequence(NamedTuple):
+    # One loop period of frames back to back in RGB order
+    data: bytes
+    period: int
+    fps: float
+    duration: float
+
+
+def _replay(sequence: _Sequence,
+            renderer: FrameRenderer) -> Animation:
+    frames: Sequence[Frame] = renderer.frames_from_buffer(sequence.data, sequence.period)
+    if sequence.period == 1:
+        # A still frame is only shown once, the compositor keeps it up
+        return Animation(lambda frame_index: frames[0] if frame_index == 0 else None,
+                         sequence.fps,
+                         sequence.duration,
+                         period=1)
+    return Animation(lambda frame_index: frames[frame_index % sequence.period],
+                     sequence.fps,
+                     sequence.duration,
+                     period=sequence.period)
+
+
+@final
+class FrameSequenceCache:
+
+    @property
+    def max_bytes(self: Self) -> int:
+        return self._max_bytes
+
+    @property
+    def size_bytes(self: Self) -> int:
+        return self._size_bytes
+
+    @property
+    def hit_rate(self: Self) -> float:
+        lookups: int = self._hits + self._misses
+        return self._hits / lookups if lookups else 0.0
+
+    def animate(self: Self,
+                command: NeopixelCommand,
+                renderer: FrameRenderer) -> Animation:
+        with self._lock:
+            return self._animate(command, renderer)
+
+    def clear(self: Self) -> None:
+        with self._lock:
+            self._sequences.clear()
+            self._size_bytes = 0
+
+    def snapshot(self: Self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entries': len(self._sequences),
+                    'size_bytes': self._size_bytes,
+                    'max_bytes': self._max_bytes,
+                    'hits': self._hits,
+                    'misses': self._misses,
+                    'uncacheable': self._uncacheable,
+                    'evictions': self._evictions,
+                    'hit_rate': self.hit_rate}
+
+    @override
+    def __init__(self,
+                 max_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        self._max_bytes: int = max_bytes
+        self._sequences: OrderedDict[_CacheKey, _Sequence] = collections.OrderedDict()
+        self._size_bytes: int = 0
+        self._hits: int = 0
+        self._misses: int = 0
+        self._uncacheable: int = 0
+        self._evictions: int = 0
+
+    def _animate(self: Self,
+                 command: NeopixelCommand,
+                 renderer: FrameRenderer) -> Animation:
+        key: _CacheKey = (command, renderer.num_pixels, type(renderer))
+        try:
+            sequence: Optional[_Sequence] = self._sequences.get(key)
+        except TypeError:
+            # Commands built with mutable field values cannot be keyed
+            self._uncacheable += 1
+            return command.animate(renderer)
+        if sequence is not None:
+            self._hits += 1
+            self._sequences.move_to_end(key)
+            return _replay(sequence, renderer)
+
+        self._misses += 1
+        animation: Animation = command.animate(renderer)
+        sequence = self._render(animation, renderer)
+        if sequence is None:
+            self._uncacheable += 1
+            return animation
+
+        self._sequences[key] = sequence
+        self._size_bytes += len(sequence.data)
+        self._evict()
+        return _replay(sequence, renderer)
+
+    def _render(self: Self,
+                animation: Animation,
+                renderer: FrameRenderer) -> Optional[_Sequence]:
+        # Only animations that loop can be replayed, and only if one loop fits in the cache at all
+        if animation.period is None or animation.period * renderer.num_pixels * 3 > self._max_bytes:
+            return None
+
+        frame_data: List[Union[bytes, bytearray]] = []
+        for frame_index in range(animation.period):
+            frame: Optional[Frame] = animation.frame_at(frame_index)
+            if frame is None:
+                return None
+            frame_data.append(renderer.to_bytes(frame))
+        return _Sequence(b''.join(frame_data), animation.period, animation.fps, animation.duration)
+
+    def _evict(self: Self) -> None:
+        while self._size_bytes > self._max_bytes:
+            _, evicted = self._sequences.popitem(last=False)
+            self._size_bytes -= len(evicted.data)
+            self._evictions += 1
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import dataclasses
+import time
+from typing import Iterator, Optional
+
+from typing_extensions import Self, final, override
+
+from tophat.api.device import CancellationToken
+
+_NS_PER_SECOND: int = 1_000_000_000
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class FrameStats:
+    frames_shown: int
+    frames_dropped: int
+    elapsed_ns: int
+    requested_fps: float
+    mean_jitter_ns: float
+    max_jitter_ns: int
+
+    @property
+    def fps(self: Self) -> float:
+        return self.frames_shown * _NS_PER_SECOND / self.elapsed_ns if self.elapsed_ns > 0 else 0.0
+
+    @override
+    def __str__(self: Self) -> str:
+        return (f'{self.frames_shown} frames at {self.fps:.1f}/{self.requested_fps:g} fps, '
+                f'{self.frames_dropped} dropped, jitter mean {self.mean_jitter_ns / 1e3:.0f} us '
+                f'max {self.max_jitter_ns / 1e3:.0f} us')
+
+
+@final
+class FrameClock:
+
+    @property
+    def stats(self: Self) -> FrameStats:
+        # The last frame stays up for a whole interval too
+        elapsed_ns: int = (self._last_tick_ns - self._start_ns + self._interval_ns
+                           if self._last_tick_ns is not None else 0)
+        return FrameStats(frames_shown=self._frames_shown,
+                          frames_dropped=self._frames_dropped,
+                          elapsed_ns=elapsed_ns,
+                          requested_fps=_NS_PER_SECOND / self._interval_ns,
+                          mean_jitter_ns=self._total_jitter_ns / self._frames_shown if self._frames_shown else 0.0,
+                          max_jitter_ns=self._max_jitter_ns)
+
+    @property
+    def cancelled(self: Self) -> bool:
+        # Whether the ticks ended early because the token was cancelled, rather than by running out or being stopped
+        return self._cancelled
+
+    def stop(self: Self) -> None:
+        self._stopped = True
+
+    def ticks(self: Self) -> Iterator[int]:
+        # Frames are due at absolute deadlines from the start, so time spent rendering never accumulates as drift.
+        # When the caller falls behind, the frames whose deadline already passed are skipped and counted as dropped.
+        frame_index: int = 0
+        while True:
+            deadline_ns: int = self._start_ns + frame_index * self._interval_ns
+            if self._end_ns is not None and deadline_ns >= self._end_ns:
+                # The last frame stays up until the effect is over, unless cancelled while it waits
+                if self._wait_until(self._end_ns) < self._end_ns and self._token.cancelled:
+                    self._cancelled = True
+                return
+
+            now_ns: int = self._wait_until(deadline_ns)
+            if self._token.cancelled:
+                self._cancelled = True
+                return
+            if self._stopped:
+                return
+
+            behind: int = (now_ns - deadline_ns) // self._interval_ns
+            if behind > 0:
+                self._frames_dropped += behind
+                frame_index += behind
+                deadline_ns += behind * self._interval_ns
+                if self._end_ns is not None and deadline_ns >= self._end_ns:
+                    return
+
+            jitter_ns: int = now_ns - deadline_ns
+            self._total_jitter_ns += jitter_ns
+            if jitter_ns > self._max_jitter_ns:
+                self._max_jitter_ns = jitter_ns
+            self._frames_shown += 1
+            self._last_tick_ns = now_ns
+            yield frame_index
+            frame_index += 1
+
+    @override
+    def __init__(self,
+                 fps: float,
+                 duration: float,
+                 token: Optional[CancellationToken] = None) -> None:
+        self._interval_ns: int = max(1, round(_NS_PER_SECOND / fps))
+        self._start_ns: int = time.monotonic_ns()
+        # A non-positive duration runs until preempted
+        self._end_ns: Optional[int] = self._start_ns + round(duration * _NS_PER_SECOND) if duration > 0 else None
+        self._token: CancellationToken = token if token is not None else CancellationToken.current()
+
+        self._frames_shown: int = 0
+        self._frames_dropped: int = 0
+        self._total_jitter_ns: int = 0
+        self._max_jitter_ns: int = 0
+        self._last_tick_ns: Optional[int] = None
+        self._stopped: bool = False
+        self._cancelled: bool = False
+
+    def _wait_until(self: Self,
+                    deadline_ns: int) -> int:
+        now_ns: int = time.monotonic_ns()
+        if now_ns < deadline_ns:
+            self._token.wait((deadline_ns - now_ns) / _NS_PER_SECOND)
+            now_ns = time.monotonic_ns()
+        return now_ns
@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+from typing_extensions import Self, final, override
+
+from tophat.api.device import CancellationToken, DeviceLock
+from tophat.devices.neopixel import BASE_LAYER_NAME, Animation, LayerCommand, NeopixelCommand, NeopixelDevice
+from tophat.devices.neopixel.cache import FrameSequenceCache
+from tophat.devices.neopixel.clock import FrameClock, FrameStats
+from tophat.devices.neopixel.render import BlendMode, Frame, FrameRenderer
+
+DEFAULT_COMPOSITOR_FPS: float = 200.0
+
+_NS_PER_SECOND: int = 1_000_000_000
+
+
+@final
+class Layer:
+
+    @property
+    def name(self: Self) -> str:
+        return self._name
+
+    @property
+    def start(self: Self) -> int:
+        return self._start
+
+    @property
+    def stop(self: Self) -> int:
+        return self._stop
+
+    @property
+    def z_order(self: Self) -> int:
+        return self._z_order
+
+    @property
+    def blend(self: Self) -> BlendMode:
+        return self._blend
+
+    @property
+    def opacity(self: Self) -> int:
+        return self._opacity
+
+    @property
+    def opaque(self: Self) -> bool:
+        return self._blend == BlendMode.REPLACE and self._opacity >= 255
+
+    @property
+    def expires_ns(self: Self) -> Optional[int]:
+        return self._expires_ns
+
+    @property
+    def settled(self: Self) -> bool:
+        # A still frame that has already been shown, nothing about the layer changes until it expires
+        return self._animation.period == 1 and self._frame_index >= 0
+
+    def expired(self: Self,
+                now_ns: int) -> bool:
+        return (self._expires_ns is not None and now_ns >= self._expires_ns) or self._animation.finished()
+
+    def frame(self: Self,
+              now_ns: int) -> Tuple[Optional[Frame], bool]:
+        # The layer advances on its own frame rate, independently of how often the strip is redrawn
+        frame_index: int = int((now_ns - self._started_ns) * self._animation.fps // _NS_PER_SECOND)
+        if frame_index == self._frame_index:
+            return self._frame, False
+
+        self._frame_index = frame_index
+        next_frame: Optional[Frame] = self._animation.frame_at(frame_index)
+        if next_frame is None:
+            return self._frame, False
+        self._frame = next_frame
+        return next_frame, True
+
+    def close(self: Self) -> None:
+        if self._on_removed is not None:
+            self._on_removed()
+
+    def covers(self: Self,
+               other: Layer) -> bool:
+        return self.opaque and self._start <= other.start and other.stop <= self._stop
+
+    @classmethod
+    def from_command(cls: Type[Self],
+                     command: NeopixelCommand,
+                     renderer: FrameRenderer,
+                     cache: Optional[FrameSequenceCache] = None) -> Self:
+        def animate(effect: NeopixelCommand,
+                    effect_renderer: FrameRenderer) -> Animation:
+            return cache.animate(effect, effect_renderer) if cache is not None else effect.animate(effect_renderer)
+
+        if not isinstance(command, LayerCommand):
+            return cls(BASE_LAYER_NAME, animate(command, renderer), 0, renderer.num_pixels)
+
+        start: int
+        stop: int
+        start, stop = command.pixel_range(renderer.num_pixels)
+        return cls(command.layer_name,
+                   animate(command.effect, renderer.with_size(stop - start)),
+                   start,
+                   stop,
+                   command.z_order,
+                   BlendMode(command.blend),
+                   command.opacity,
+                   command.expires)
+
+    @override
+    def __init__(self,
+                 name: str,
+                 animation: Animation,
+                 start: int,
+                 stop: int,
+                 z_order: int = 0,
+                 blend: BlendMode = BlendMode.REPLACE,
+                 opacity: int = 255,
+                 expires: float = 0,
+                 on_removed: Optional[Callable[[], None]] = None) -> None:
+        self._name: str = name
+        self._animation: Animation = animation
+        self._start: int = start
+        self._stop: int = stop
+        self._z_order: int = z_order
+        self._blend: BlendMode = blend
+        self._opacity: int = opacity
+        self._on_removed: Optional[Callable[[], None]] = on_removed
+
+        self._started_ns: int = time.monotonic_ns()
+        lifetime: float = animation.duration
+        if expires > 0:
+            lifetime = min(lifetime, expires) if lifetime > 0 else expires
+        self._expires_ns: Optional[int] = (self._started_ns + round(lifetime * _NS_PER_SECOND)
+                                           if lifetime > 0 else None)
+        self._frame_index: int = -1
+        self._frame: Optional[Frame] = None
+
+
+@final
+class Compositor:
+
+    @property
+    def layer_names(self: Self) -> List[str]:
+        with self._layers_lock:
+            return list(self._layers)
+
+    @property
+    def stats(self: Self) -> Optional[FrameStats]:
+        return self._clock.stats if self._clock is not None else None
+
+    def set_layer(self: Self,
+                  layer: Layer) -> None:
+        with self._layers_lock:
+            replaced: Optional[Layer] = self._layers.pop(layer.name, None)
+            self._layers[layer.name] = layer
+            self._changed = True
+        self._wake.set()
+        if replaced is not None:
+            replaced.close()
+
+    def remove_layer(self: Self,
+                     name: str) -> None:
+        with self._layers_lock:
+            removed: Optional[Layer] = self._layers.pop(name, None)
+            self._changed = True
+        self._wake.set()
+        if removed is not None:
+            removed.close()
+
+    def start(self: Self) -> None:
+        self._thread = threading.Thread(target=self._run, name='neopixel-compositor', daemon=True)
+        self._thread.start()
+
+    def stop(self: Self,
+             wait: bool = False) -> None:
+        self._token.cancel()
+        self._wake.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    @override
+    def __init__(self,
+                 device: NeopixelDevice,
+                 lock: DeviceLock,
+                 fps: float = DEFAULT_COMPOSITOR_FPS) -> None:
+        self._device: NeopixelDevice = device
+        self._lock: DeviceLock = lock
+        self._fps: float = fps
+        self._renderer: FrameRenderer = device.renderer
+        self._layers_lock: threading.Lock = threading.Lock()
+        self._layers: Dict[str, Layer] = {}
+        self._changed: bool = True
+        self._wake: threading.Event = threading.Event()
+        self._token: CancellationToken = CancellationToken()
+        self._clock: Optional[FrameClock] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self: Self) -> None:
+        while not self._token.cancelled:
+            self._clock = FrameClock(self._fps, 0, self._token)
+            with self._lock:
+                self._device.play(self._render, self._clock)
+            # The clock only stops once nothing on the strip can change, sleep until a layer is set or one expires
+            self._wake.wait(self._idle_timeout())
+            self._wake.clear()
+
+    def _idle_timeout(self: Self) -> Optional[float]:
+        with self._layers_lock:
+            expiries: List[int] = [layer.expires_ns for layer in self._layers.values() if layer.expires_ns is not None]
+        if not expiries:
+            return None
+        return max(0, min(expiries) - time.monotonic_ns()) / _NS_PER_SECOND
+
+    def _render(self: Self,
+                frame_index: int) -> Optional[Frame]:
+        now_ns: int = time.monotonic_ns()
+        with self._layers_lock:
+            expired: List[Layer] = [layer for layer in self._layers.values() if layer.expired(now_ns)]
+            for layer in expired:
+                del self._layers[layer.name]
+            layers: List[Layer] = sorted(self._layers.values(), key=lambda layer: layer.z_order)
+            changed: bool = self._changed or bool(expired)
+            self._changed = False
+
+        for layer in expired:
+            print(f'Layer {layer.name!r} ended, compositor at {self._clock.stats}', flush=True)
+            layer.close()
+
+        # Layers hidden under an opaque layer higher up are never rendered or blended
+        visible: List[Layer] = [layer for position, layer in enumerate(layers)
+                                if not any(above.covers(layer) for above in layers[position + 1:])]
+        frames: List[Tuple[Layer, Frame]] = []
+        for layer in visible:
+            layer_frame: Optional[Frame]
+            layer_changed: bool
+            layer_frame, layer_changed = layer.frame(now_ns)
+            changed = changed or layer_changed
+            if layer_frame is not None:
+                frames.append((layer, layer_frame))
+
+        # Once every visible layer is a still frame on the strip there is nothing left to redraw until something changes
+        if all(layer.settled for layer in visible):
+            self._clock.stop()
+
+        # Nothing moved since the last frame, leave the strip as it is
+        if not changed:
+            return None
+
+        framebuffer: Frame = self._renderer.solid((0, 0, 0))
+        for layer, layer_frame in frames:
+            self._renderer.blend(framebuffer, layer.start, layer_frame, layer.blend, layer.opacity)
+        return framebuffer
@@ -0,0 +1,357 @@
+from __future__ import annotations
+
+import abc
+import enum
+import functools
+import itertools
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+from typing_extensions import Buffer, Self, final, override
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ColorTuple = Tuple[int, int, int]
+ByteOrder = Tuple[int, int, int]
+Frame = Union[bytearray, Any]
+
+RGB_ORDER: ByteOrder = (0, 1, 2)
+
+
+@final
+class BlendMode(enum.IntEnum):
+    REPLACE = 0
+    ADD = 1
+    LIGHTEN = 2
+    MULTIPLY = 3
+
+
+@final
+class Easing(enum.IntEnum):
+    STEP = 0
+    LINEAR = 1
+    EASE_IN = 2
+    EASE_OUT = 3
+    EASE_IN_OUT = 4
+
+
+def ease(easing: Easing,
+         progress: float) -> float:
+    # Maps linear progress between two keyframes, 0 to 1, onto how far the colour has moved
+    if easing == Easing.STEP:
+        return 1.0 if progress >= 1.0 else 0.0
+    elif easing == Easing.LINEAR:
+        return progress
+    elif easing == Easing.EASE_IN:
+        return progress * progress
+    elif easing == Easing.EASE_OUT:
+        return 1.0 - (1.0 - progress) * (1.0 - progress)
+    elif easing == Easing.EASE_IN_OUT:
+        return progress * progress * (3.0 - 2.0 * progress)
+    else:
+        raise ValueError(f'Unknown easing {easing}')
+
+
+def _channel_cycle() -> List[int]:
+    # One channel of the colour wheel, ramps up, ramps down, then stays dark for as long as it ramped
+    return list(itertools.chain(range(0, 255), range(255, -1, -1), (0,) * 255))
+
+
+_CHANNEL_CYCLE: List[int] = _channel_cycle()
+WHEEL_SIZE: int = len(_CHANNEL_CYCLE)
+
+# The three channels are a third of the wheel apart
+WHEEL: Tuple[ColorTuple, ...] = tuple((_CHANNEL_CYCLE[step],
+                                       _CHANNEL_CYCLE[(step + 255) % WHEEL_SIZE],
+                                       _CHANNEL_CYCLE[(step + 510) % WHEEL_SIZE])
+                                      for step in range(WHEEL_SIZE))
+
+
+@functools.lru_cache(maxsize=512)
+def output_table(level: int,
+                 gamma: float = 1.0) -> bytes:
+    # Maps every channel value to its gamma corrected value at brightness level / 255, one table per setting
+    return bytes(round(255 * (value / 255) ** gamma * level / 255) for value in range(256))
+
+
+class FrameRenderer(abc.ABC):
+
+    @final
+    @property
+    def num_pixels(self: Self) -> int:
+        return self._num_pixels
+
+    @abc.abstractmethod
+    def solid(self: Self,
+              color: ColorTuple) -> Frame:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def wheel(self: Self,
+              step: int,
+              spacing: int = 0) -> Frame:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def scaled(self: Self,
+               frame: Frame,
+               level: int) -> Frame:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def mapped(self: Self,
+               frame: Frame,
+               table: bytes) -> Frame:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def blend(self: Self,
+              target: Frame,
+              start: int,
+              layer: Frame,
+              mode: BlendMode,
+              opacity: int = 255) -> None:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def frames_from_buffer(self: Self,
+                           data: bytes,
+                           count: int) -> Sequence[Frame]:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def from_bytes(self: Self,
+                   data: Buffer) -> Frame:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def to_bytes(self: Self,
+                 frame: Frame,
+                 byteorder: ByteOrder = RGB_ORDER) -> Union[bytes, bytearray]:
+        raise NotImplementedError()
+
+    @final
+    def with_size(self: Self,
+                  num_pixels: int) -> FrameRenderer:
+        return type(self)(num_pixels)
+
+    @final
+    def blank(self: Self) -> Frame:
+        if self._blank is None:
+            self._blank = self.solid((0, 0, 0))
+        return self._blank
+
+    @override
+    def __init__(self,
+                 num_pixels: int) -> None:
+        self._num_pixels: int = num_pixels
+        self._blank: Optional[Frame] = None
+
+
+@final
+class NumpyFrameRenderer(FrameRenderer):
+
+    @override
+    def solid(self: Self,
+              color: ColorTuple) -> Frame:
+        return np.frombuffer(bytes(color) * self._num_pixels, dtype=np.uint8).reshape(self._num_pixels, 3).copy()
+
+    @override
+    def wheel(self: Self,
+              step: int,
+              spacing: int = 0) -> Frame:
+        if spacing == 0:
+            return self.solid(WHEEL[step % WHEEL_SIZE])
+
+        # Pixel i shows wheel entry step + i * spacing, a strided view of the unrolled wheel
+        start: int = step % WHEEL_SIZE
+        stop: int = start + self._num_pixels * spacing
+        if len(self._unrolled_wheel) < stop:
+            self._unrolled_wheel = np.tile(self._wheel, (-(-stop // WHEEL_SIZE), 1))
+        return self._unrolled_wheel[start:stop:spacing].copy()
+
+    @override
+    def scaled(self: Self,
+               frame: Frame,
+               level: int) -> Frame:
+        return self._scale_table[level].take(frame)
+
+    @override
+    def mapped(self: Self,
+               frame: Frame,
+               table: bytes) -> Frame:
+        return np.frombuffer(table, dtype=np.uint8).take(frame)
+
+    @override
+    def blend(self: Self,
+              target: Frame,
+              start: int,
+              layer: Frame,
+              mode: BlendMode,
+              opacity: int = 255) -> None:
+        # Every mode is a handful of whole array operations, whatever the length of the layer
+        region: Frame = target[start:start + len(layer)]
+        blended: Frame
+        if mode == BlendMode.REPLACE:
+            blended = layer
+        elif mode == BlendMode.ADD:
+            blended = np.minimum(region.astype(np.uint16) + layer, 255)
+        elif mode == BlendMode.LIGHTEN:
+            blended = np.maximum(region, layer)
+        elif mode == BlendMode.MULTIPLY:
+            blended = region.astype(np.uint16) * layer // 255
+        else:
+            raise ValueError(f'Unknown blend mode {mode}')
+
+        if opacity < 255:
+            blended = (region + (blended.astype(np.int32) - region) * opacity // 255).astype(np.uint8)
+        region[...] = blended
+
+    @override
+    def frames_from_buffer(self: Self,
+                           data: bytes,
+                           count: int) -> Sequence[Frame]:
+        # Read-only views into the one buffer, nothing is copied
+        return np.frombuffer(data, dtype=np.uint8).reshape(count, self._num_pixels, 3)
+
+    @override
+    def from_bytes(self: Self,
+                   data: Buffer) -> Frame:
+        return np.frombuffer(data, dtype=np.uint8).reshape(self._num_pixels, 3).copy()
+
+    @override
+    def to_bytes(self: Self,
+                 frame: Frame,
+                 byteorder: ByteOrder = RGB_ORDER) -> Union[bytes, bytearray]:
+        if byteorder == RGB_ORDER:
+            return frame.tobytes()
+        ordered: Frame = np.empty_like(frame)
+        ordered[:, byteorder] = frame
+        return ordered.tobytes()
+
+    @override
+    def __init__(self,
+                 num_pixels: int) -> None:
+        super().__init__(num_pixels)
+        self._wheel: Frame = np.array(WHEEL, dtype=np.uint8)
+        self._unrolled_wheel: Frame = self._wheel
+        # Row n maps every channel value to its value at brightness n / 255
+        levels: Frame = np.arange(256, dtype=np.uint16)
+        self._scale_table: Frame = (np.outer(levels, levels) // 255).astype(np.uint8)
+
+
+@final
+class BytearrayFrameRenderer(FrameRenderer):
+
+    @override
+    def solid(self: Self,
+              color: ColorTuple) -> Frame:
+        return bytearray(bytes(color) * self._num_pixels)
+
+    @override
+    def wheel(self: Self,
+              step: int,
+              spacing: int = 0) -> Frame:
+        if spacing == 0:
+            return self.solid(WHEEL[step % WHEEL_SIZE])
+
+        # Pixel i shows wheel entry step + i * spacing, a strided slice of the unrolled wheel per channel
+        start: int = (step % WHEEL_SIZE) * 3
+        stop: int = start + self._num_pixels * spacing * 3
+        required: int = stop + 3
+        if len(self._unrolled_wheel) < required:
+            repeats: int = -(-required // len(self._wheel_bytes))
+            self._unrolled_wheel = self._wheel_bytes * repeats
+
+        frame: bytearray = bytearray(self._num_pixels * 3)
+        for channel in range(3):
+            frame[channel::3] = self._unrolled_wheel[start + channel:stop + channel:spacing * 3]
+        return frame
+
+    @override
+    def scaled(self: Self,
+               frame: Frame,
+               level: int) -> Frame:
+        return frame.translate(self._scale_tables[level])
+
+    @override
+    def mapped(self: Self,
+               frame: Frame,
+               table: bytes) -> Frame:
+        # Cached frames are memoryviews, which cannot translate themselves
+        if isinstance(frame, memoryview):
+            frame = bytearray(frame)
+        return frame.translate(table)
+
+    @override
+    def blend(self: Self,
+              target: Frame,
+              start: int,
+              layer: Frame,
+              mode: BlendMode,
+              opacity: int = 255) -> None:
+        region_start: int = start * 3
+        region_stop: int = region_start + len(layer)
+        region: bytearray = target[region_start:region_stop]
+        blended: Union[bytes, bytearray]
+        if mode == BlendMode.REPLACE:
+            blended = layer
+        elif mode == BlendMode.ADD:
+            blended = bytes(min(base + value, 255) for base, value in zip(region, layer))
+        elif mode == BlendMode.LIGHTEN:
+            blended = bytes(map(max, region, layer))
+        elif mode == BlendMode.MULTIPLY:
+            blended = bytes(base * value // 255 for base, value in zip(region, layer))
+        else:
+            raise ValueError(f'Unknown blend mode {mode}')
+
+        if opacity < 255:
+            blended = bytes(base + (value - base) * opacity // 255 for base, value in zip(region, blended))
+        target[region_start:region_stop] = blended
+
+    @override
+    def frames_from_buffer(self: Self,
+                           data: bytes,
+                           count: int) -> Sequence[Frame]:
+        # Read-only views into the one buffer, nothing is copied
+        frame_size: int = self._num_pixels * 3
+        view: memoryview = memoryview(data)
+        return [view[index * frame_size:(index + 1) * frame_size] for index in range(count)]
+
+    @override
+    def from_bytes(self: Self,
+                   data: Buffer) -> Frame:
+        return bytearray(data)
+
+    @override
+    def to_bytes(self: Self,
+                 frame: Frame,
+                 byteorder: ByteOrder = RGB_ORDER) -> Union[bytes, bytearray]:
+        if byteorder == RGB_ORDER:
+            return frame
+        ordered: bytearray = bytearray(len(frame))
+        for channel in range(3):
+            ordered[byteorder[channel]::3] = frame[channel::3]
+        return ordered
+
+    @override
+    def __init__(self,
+                 num_pixels: int) -> None:
+        super().__init__(num_pixels)
+        self._wheel_bytes: bytes = bytes(itertools.chain.from_iterable(WHEEL))
+        self._unrolled_wheel: bytes = self._wheel_bytes
+        self._scale_tables: List[bytes] = [bytes(value * level // 255 for value in range(256))
+                                           for level in range(256)]
+
+
+def create_renderer(num_pixels: int,
+                    use_numpy: Optional[bool] = None) -> FrameRenderer:
+    if use_numpy is None:
+        use_numpy = np is not None
+    if use_numpy:
+        if np is None:
+            raise RuntimeError('NumPy is not installed')
+        return NumpyFrameRenderer(num_pixels)
+    return BytearrayFrameRenderer(num_pixels)
@@ -1,27 +1,65 @@
 from __future__ import annotations
 
-import multiprocessing as mp
-import multiprocessing.synchronize as mp_sync
-import select
+import queue
 import socket
+import struct
+import threading
+import time
 from argparse import ArgumentParser
 from pathlib import Path
+from typing import Any, Dict, Optional
 
 from typing_extensions import Self, final, override
 
-import board
-from tophat.devices.neopixel import NeopixelCommand, NeopixelDevice
+try:
+    import board
+except ImportError:
+    # Only the simulated backend works without the Blinka board support
+    board = None
+
+from tophat.api.framing import FrameReader, ProtocolError
+from tophat.devices.neopixel import (BACKEND_ENVIRONMENT_VARIABLE, BASE_LAYER_NAME, NeopixelBackend, NeopixelCommand,
+                                     NeopixelDevice)
+from tophat.devices.neopixel.cache import DEFAULT_CACHE_BYTES, FrameSequenceCache
+from tophat.devices.neopixel.compositor import Compositor, Layer
+from tophat.devices.neopixel.stream import StreamSession, is_stream_request
 
 DEFAULT_SOCKET_PATH: Path = Path('/srv/tophat/neopixel.socket')
-MAX_SEND_RECV_SIZE: int = 512
+FRAME_BUFFER_SIZE: int = 512
+# Largest command frame a connection may send, a long timeline of keyframes stays well below it
+MAX_COMMAND_SIZE: int = 1 << 20
+COMMAND_QUEUE_SIZE: int = 16
+# Seconds between the effect thread's diagnostics lines, snapshot has the same numbers whenever they are wanted
+DIAGNOSTICS_INTERVAL: float = 60.0
 
 
 @final
 class NeopixelServer:
 
+    def snapshot(self: Self) -> Dict[str, Any]:
+        in_flight: Optional[NeopixelCommand] = self._in_flight
+        return {'queue_depth': self._commands.qsize(),
+                'in_flight': None if in_flight is None else f'{type(in_flight).__name__} on {in_flight.layer_name!r}',
+                'layers': self._compositor.layer_names if self._compositor is not None else [],
+                'superseded': self._superseded,
+                'dropped': self._dropped,
+                'accepted': self._accepted,
+                'accept_wait_s': self._accept_wait_ns / 1e9}
+
     def start(self: Self) -> None:
-        neopixel_device: NeopixelDevice = NeopixelDevice.from_impl('neopixels',
-                                                                   self._pin, self._num_leds)
+        neopixel_device: NeopixelDevice = NeopixelDevice.impl_builder(self._backend)('neopixels',
+                                                                                  self._pin, self._num_leds)
+        neopixel_device.brightness = self._brightness
+        neopixel_device.gamma = self._gamma
+        # Every command becomes a layer, the compositor thread is the only one that ever shows a frame
+        compositor: Compositor = Compositor(neopixel_device, self._lock)
+        compositor.start()
+        self._compositor = compositor
+        # Connections only decode commands, preparing their frames happens on the effect thread
+        threading.Thread(target=self._run_effects,
+                         args=(compositor, neopixel_device),
+                         name='neopixel-effects',
+                         daemon=True).start()
         if self._socket_path.is_socket():
             self._socket_path.unlink()
             print(f'Removing old socket at {self._socket_path}', flush=True)
@@ -34,32 +72,157 @@ class NeopixelServer:
             server_socket.listen()
 
             while True:
+                wait_start_ns: int = time.monotonic_ns()
                 try:
                     client_socket: socket.socket
                     client_socket, addr = server_socket.accept()
                 except socket.timeout:
+                    self._accept_wait_ns += time.monotonic_ns() - wait_start_ns
                     continue
                 else:
-                    with client_socket:
-                        print(f'Accepted connection...', flush=True)
-                        poller = select.poll()
-                        poller.register(client_socket, select.POLLIN)
-                        if poller.poll(2000):
-                            raw_data: bytes = client_socket.recv(MAX_SEND_RECV_SIZE)
-                            command: NeopixelCommand = NeopixelCommand.deserialize(raw_data)
-                            print(f'Received {type(command).__name__} command!', flush=True)
-                            neopixel_device.run(self._lock, command)
+                    self._accept_wait_ns += time.monotonic_ns() - wait_start_ns
+                    self._accepted += 1
+                    print(f'Accepted connection...', flush=True)
+                    # Proxies keep their connection open, each one is read on its own thread
+                    threading.Thread(target=self._serve_connection,
+                                     args=(client_socket, compositor, neopixel_device),
+                                     name='neopixel-connection',
+                                     daemon=True).start()
 
     @override
     def __init__(self,
                  socket_path: Path,
                  pin: board.pin.Pin,
-                 num_leds: int) -> None:
+                 num_leds: int,
+                 frame_cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 backend: Optional[NeopixelBackend] = None,
+                 brightness: float = 1.0,
+                 gamma: float = 1.0,
+                 command_queue_size: int = COMMAND_QUEUE_SIZE) -> None:
         self._socket_path: Path = socket_path
         self._pin: board.pin.Pin = pin
         self._num_leds: int = num_leds
+        self._backend: Optional[NeopixelBackend] = backend
+        self._brightness: float = brightness
+        self._gamma: float = gamma
+
+        self._lock: threading.Lock = threading.Lock()
+        self._frame_cache: FrameSequenceCache = FrameSequenceCache(frame_cache_bytes)
+        self._commands: queue.Queue[NeopixelCommand] = queue.Queue(command_queue_size)
+        self._compositor: Optional[Compositor] = None
+        self._in_flight: Optional[NeopixelCommand] = None
+        self._superseded: int = 0
+        self._dropped: int = 0
+        self._accepted: int = 0
+        self._accept_wait_ns: int = 0
+        self._diagnostics_printed_ns: Optional[int] = None
+
+    def _serve_connection(self: Self,
+                          client_socket: socket.socket,
+                          compositor: Compositor,
+                          neopixel_device: NeopixelDevice) -> None:
+        frame_reader: FrameReader = FrameReader(FRAME_BUFFER_SIZE, MAX_COMMAND_SIZE)
+        first_frame: bool = True
+        while True:
+            try:
+                raw_data: memoryview = frame_reader.read_frame(client_socket).payload
+            except EOFError:
+                client_socket.close()
+                return
+            except (OSError, ProtocolError) as receive_error:
+                print(f'Failed to receive command: {receive_error}', flush=True)
+                client_socket.close()
+                return
+
+            if first_frame and is_stream_request(raw_data):
+                # The stream session owns the connection from here on
+                self._start_stream(client_socket, raw_data, compositor, neopixel_device)
+                return
+            first_frame = False
+
+            try:
+                command: NeopixelCommand = NeopixelCommand.deserialize(raw_data)
+            except (ValueError, TypeError, KeyError) as command_error:
+                print(f'Failed to decode command: {command_error}', flush=True)
+                continue
+
+            print(f'Received {type(command).__name__} command for layer {command.layer_name!r}!', flush=True)
+            self._enqueue(command)
+
+    def _enqueue(self: Self,
+                 command: NeopixelCommand) -> None:
+        # A full queue sheds its oldest command, the newest one always gets in
+        while True:
+            try:
+                self._commands.put_nowait(command)
+                return
+            except queue.Full:
+                try:
+                    self._commands.get_nowait()
+                    self._dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _run_effects(self: Self,
+                     compositor: Compositor,
+                     neopixel_device: NeopixelDevice) -> None:
+        while True:
+            commands: Dict[str, NeopixelCommand] = {}
+            command: NeopixelCommand = self._commands.get()
+            while True:
+                # A command queued behind another for the same layer supersedes it before any of its frames exist
+                if commands.pop(command.layer_name, None) is not None:
+                    self._superseded += 1
+                commands[command.layer_name] = command
+                try:
+                    command = self._commands.get_nowait()
+                except queue.Empty:
+                    break
+
+            for command in commands.values():
+                # A command that fails in any way is dropped, it must never take the effect thread down with it
+                try:
+                    layer: Layer = Layer.from_command(command, neopixel_device.renderer, self._frame_cache)
+                    compositor.set_layer(layer)
+                except Exception as command_error:
+                    print(f'Failed to prepare {type(command).__name__} command: {command_error!r}', flush=True)
+                    continue
+                self._in_flight = command
+
+            now_ns: int = time.monotonic_ns()
+            last_printed_ns: Optional[int] = self._diagnostics_printed_ns
+            if last_printed_ns is None or now_ns - last_printed_ns >= DIAGNOSTICS_INTERVAL * 1e9:
+                self._diagnostics_printed_ns = now_ns
+                self._print_diagnostics()
+
+    def _print_diagnostics(self: Self) -> None:
+        diagnostics: Dict[str, Any] = self.snapshot()
+        print(f'Effects: {diagnostics["in_flight"]} in flight, {diagnostics["queue_depth"]} queued, '
+              f'{diagnostics["superseded"]} superseded, {diagnostics["dropped"]} dropped, '
+              f'{diagnostics["accept_wait_s"]:.1f} s waiting on accept', flush=True)
+        print(f'Frame cache: {self._frame_cache.size_bytes} bytes, '
+              f'{self._frame_cache.hit_rate:.0%} hit rate', flush=True)
+
+    @staticmethod
+    def _start_stream(client_socket: socket.socket,
+                      raw_data: memoryview,
+                      compositor: Compositor,
+                      neopixel_device: NeopixelDevice) -> None:
+        try:
+            session: StreamSession = StreamSession.from_request(client_socket, raw_data, len(neopixel_device))
+            session.start()
+        except (OSError, ProtocolError, struct.error) as stream_error:
+            print(f'Failed to open stream: {stream_error}', flush=True)
+            client_socket.close()
+            return
 
-        self._lock: mp_sync.Lock = mp.Lock()
+        print(f'Streaming frames at {session.fps:g} fps', flush=True)
+        # The stream replaces the base layer like any other command, and ends the session once it is replaced
+        compositor.set_layer(Layer(BASE_LAYER_NAME,
+                                   session.animation(neopixel_device.renderer),
+                                   0,
+                                   len(neopixel_device),
+                                   on_removed=session.close))
 
 
 if __name__ == '__main__':
@@ -68,11 +231,40 @@ if __name__ == '__main__':
                             dest='socket_path',
                             type=Path,
                             default=DEFAULT_SOCKET_PATH)
+    arg_parser.add_argument('--frame-cache-bytes',
+                            dest='frame_cache_bytes',
+                            type=int,
+                            default=DEFAULT_CACHE_BYTES)
+    arg_parser.add_argument('--backend',
+                            dest='backend',
+                            choices=[backend.value for backend in NeopixelBackend],
+                            default=None,
+                            help=f'Defaults to ${BACKEND_ENVIRONMENT_VARIABLE}, or hardware when unset')
+    arg_parser.add_argument('--brightness',
+                            dest='brightness',
+                            type=float,
+                            default=1.0)
+    arg_parser.add_argument('--gamma',
+                            dest='gamma',
+                            type=float,
+                            default=1.0,
+                            help='Output gamma, 2.8 is typical for WS2812 strips')
+    arg_parser.add_argument('--command-queue-size',
+                            dest='command_queue_size',
+                            type=int,
+                            default=COMMAND_QUEUE_SIZE)
     arg_parser.add_argument('pin', type=int)
     arg_parser.add_argument('num_leds', type=int)
 
     args = arg_parser.parse_args()
-    server: NeopixelServer = NeopixelServer(args.socket_path, board.pin.Pin(args.pin), args.num_leds)
+    server: NeopixelServer = NeopixelServer(args.socket_path,
+                                            board.pin.Pin(args.pin) if board is not None else args.pin,
+                                            args.num_leds,
+                                            args.frame_cache_bytes,
+                                            NeopixelBackend(args.backend) if args.backend else None,
+                                            args.brightness,
+                                            args.gamma,
+                                            args.command_queue_size)
 
     try:
         server.start()
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import enum
+import socket
+import struct
+import threading
+from pathlib import Path
+from types import TracebackType
+from typing import List, Optional, Tuple, Type, TypeVar
+
+from typing_extensions import Buffer, Self, final, override
+
+from tophat.api.framing import FrameReader, ProtocolError, send_frame
+from tophat.devices.neopixel import Animation
+from tophat.devices.neopixel.render import Frame, FrameRenderer
+
+ExceptionType = TypeVar("ExceptionType",
+                        bound=BaseException)
+
+MAX_STREAM_FPS: float = 120.0
+
+# Magic, requested frames per second
+_OPEN_REQUEST: struct.Struct = struct.Struct('!4sf')
+_OPEN_MAGIC: bytes = b'TPXS'
+# Negotiated frames per second, strip length in pixels
+_OPEN_RESPONSE: struct.Struct = struct.Struct('!fI')
+# Byte offset into the frame, run length in bytes
+_DELTA_RUN: struct.Struct = struct.Struct('!HH')
+# Runs closer together than this are merged, a run header costs as much as the bytes in between
+_MIN_RUN_GAP: int = _DELTA_RUN.size
+
+
+@final
+class FrameEncoding(enum.IntEnum):
+    FULL = 0
+    DELTA = 1
+
+
+def is_stream_request(payload: Buffer) -> bool:
+    return memoryview(payload)[:len(_OPEN_MAGIC)] == _OPEN_MAGIC
+
+
+def encode_frame(frame: Buffer,
+                 previous: Optional[Buffer] = None) -> bytes:
+    frame_view: memoryview = memoryview(frame).cast('B')
+    if previous is None or len(frame_view) > 0xffff:
+        return bytes((FrameEncoding.FULL,)) + frame_view
+
+    # Collect the runs of bytes that changed since the previous frame
+    runs: List[Tuple[int, int]] = []
+    run_start: Optional[int] = None
+    run_end: int = 0
+    for index, (byte, previous_byte) in enumerate(zip(frame_view, memoryview(previous).cast('B'))):
+        if byte != previous_byte:
+            if run_start is not None and index - run_end < _MIN_RUN_GAP:
+                run_end = index + 1
+                continue
+            if run_start is not None:
+                runs.append((run_start, run_end))
+            run_start, run_end = index, index + 1
+    if run_start is not None:
+        runs.append((run_start, run_end))
+
+    delta: bytearray = bytearray((FrameEncoding.DELTA,))
+    for run_start, run_end in runs:
+        delta += _DELTA_RUN.pack(run_start, run_end - run_start)
+        delta += frame_view[run_start:run_end]
+    # A frame that changed almost everywhere is cheaper to send whole
+    if len(delta) > len(frame_view) + 1:
+        return bytes((FrameEncoding.FULL,)) + frame_view
+    return bytes(delta)
+
+
+def apply_frame(payload: Buffer,
+                framebuffer: bytearray) -> None:
+    payload_view: memoryview = memoryview(payload).cast('B')
+    if not payload_view:
+        raise ProtocolError('Empty stream frame')
+
+    if payload_view[0] == FrameEncoding.FULL:
+        if len(payload_view) - 1 != len(framebuffer):
+            raise ProtocolError(f'Expected a frame of {len(framebuffer)} bytes, got {len(payload_view) - 1}')
+        framebuffer[:] = payload_view[1:]
+    elif payload_view[0] == FrameEncoding.DELTA:
+        position: int = 1
+        while position < len(payload_view):
+            if position + _DELTA_RUN.size > len(payload_view):
+                raise ProtocolError('Truncated delta run')
+            offset: int
+            length: int
+            offset, length = _DELTA_RUN.unpack_from(payload_view, position)
+            position += _DELTA_RUN.size
+            if offset + length > len(framebuffer) or position + length > len(payload_view):
+                raise ProtocolError(f'Delta run of {length} bytes at {offset} is out of bounds')
+            framebuffer[offset:offset + length] = payload_view[position:position + length]
+            position += length
+    else:
+        raise ProtocolError(f'Unknown frame encoding {payload_view[0]}')
+
+
+@final
+class StreamSession:
+
+    @property
+    def fps(self: Self) -> float:
+        return self._fps
+
+    @property
+    def closed(self: Self) -> bool:
+        return self._closed.is_set()
+
+    def start(self: Self) -> None:
+        # Frames are received on their own thread, the newest one wins when several arrive within a frame interval
+        self._socket.settimeout(None)
+        send_frame(self._socket, _OPEN_RESPONSE.pack(self._fps, len(self._framebuffer) // 3))
+        threading.Thread(target=self._receive_frames, name='neopixel-stream', daemon=True).start()
+
+    def take_frame(self: Self) -> Optional[bytes]:
+        with self._lock:
+            if self._version == self._taken_version:
+                return None
+            self._taken_version = self._version
+            return bytes(self._framebuffer)
+
+    def animation(self: Self,
+                  renderer: FrameRenderer) -> Animation:
+        def frame_at(frame_index: int) -> Optional[Frame]:
+            frame_data: Optional[bytes] = self.take_frame()
+            return renderer.from_bytes(frame_data) if frame_data is not None else None
+
+        return Animation(frame_at, self._fps, 0, lambda: self.closed)
+
+    def close(self: Self) -> None:
+        if not self._closed.is_set():
+            self._closed.set()
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    @classmethod
+    def from_request(cls: Type[Self],
+                     client_socket: socket.socket,
+                     payload: Buffer,
+                     num_pixels: int) -> Self:
+        requested_fps: float = _OPEN_REQUEST.unpack_from(payload)[1]
+        if not requested_fps > 0:
+            raise ProtocolError(f'Invalid stream rate {requested_fps}')
+        return cls(client_socket, min(requested_fps, MAX_STREAM_FPS), num_pixels)
+
+    @override
+    def __init__(self,
+                 client_socket: socket.socket,
+                 fps: float,
+                 num_pixels: int) -> None:
+        self._socket: socket.socket = client_socket
+        self._fps: float = fps
+        self._framebuffer: bytearray = bytearray(num_pixels * 3)
+        self._lock: threading.Lock = threading.Lock()
+        self._version: int = 0
+        self._taken_version: int = 0
+        self._closed: threading.Event = threading.Event()
+
+    def _receive_frames(self: Self) -> None:
+        # A full frame is the encoding byte and the framebuffer, a delta frame is never sent when it would be larger
+        frame_reader: FrameReader = FrameReader(len(self._framebuffer) + 1, len(self._framebuffer) + 1)
+        try:
+            with self._socket:
+                while not self._closed.is_set():
+                    payload: memoryview = frame_reader.read_frame(self._socket).payload
+                    with self._lock:
+                        apply_frame(payload, self._framebuffer)
+                        self._version += 1
+        except (OSError, EOFError, ProtocolError) as receive_error:
+            if not self._closed.is_set():
+                print(f'Stream ended: {receive_error}', flush=True)
+        finally:
+            self._closed.set()
+
+
+@final
+class NeopixelStream:
+
+    @property
+    def fps(self: Self) -> float:
+        return self._fps
+
+    @property
+    def num_pixels(self: Self) -> int:
+        return self._num_pixels
+
+    def send(self: Self,
+             frame: Buffer) -> None:
+        frame_bytes: bytes = bytes(frame)
+        if len(frame_bytes) != self._num_pixels * 3:
+            raise ValueError(f'Expected a frame of {self._num_pixels * 3} bytes, got {len(frame_bytes)}')
+        send_frame(self._socket, encode_frame(frame_bytes, self._previous if self._delta else None))
+        self._previous = frame_bytes
+
+    def close(self: Self) -> None:
+        self._socket.close()
+
+    @override
+    def __init__(self,
+                 socket_path: Path,
+                 fps: float = 60.0,
+                 delta: bool = True) -> None:
+        self._socket: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(str(socket_path))
+            send_frame(self._socket, _OPEN_REQUEST.pack(_OPEN_MAGIC, fps))
+            self._fps: float
+            self._num_pixels: int
+            self._fps, self._num_pixels = _OPEN_RESPONSE.unpack(FrameReader().read_frame(self._socket).payload)
+        except (OSError, EOFError, ProtocolError, struct.error) as connect_error:
+            self._socket.close()
+            raise RuntimeError(f'Failed to open neopixel stream at {socket_path}') from connect_error
+        self._delta: bool = delta
+        self._previous: Optional[bytes] = None
+
+    @override
+    def __enter__(self: Self) -> Self:
+        return self
+
+    @override
+    def __exit__(self: Self,
+                 exc_type: Optional[Type[ExceptionType]],
+                 exc_val: Optional[ExceptionType],
+                 exc_tb: Optional[TracebackType]) -> None:
+        self.close()
@@ -1,19 +1,42 @@
 from __future__ import annotations
 
 import abc
-from typing import Any, Callable, Optional, Set, Type
+from types import NoneType
+from typing import Any, Callable, List, Optional, Set, Tuple, Type
 
 from typing_extensions import Concatenate, Self, final, override
 
+from tophat.api.codec import register_record
 from tophat.api.device import Command, Device, DeviceExtraParams
+from tophat.devices.nfc_reader.events import DEFAULT_EVENT_CAPACITY, TagEvent, TagEventBus
+
+# Longest a read waits for a scan, a reader wanting to wait longer reads again. Every waiting read holds a thread.
+MAX_READ_TIMEOUT: float = 60.0
 
 
 class PN532Device(Device, abc.ABC):
 
-    @abc.abstractmethod
+    @final
+    @property
+    def events(self: Self) -> TagEventBus:
+        return self._events
+
+    @final
     def read_data(self: Self,
                   timeout: Optional[float] = None) -> bytearray:
-        raise NotImplementedError()
+        # Waits for the next scan, every concurrent reader gets the same one
+        events: List[TagEvent] = self._events.wait_since(self._events.latest_sequence, _read_timeout(timeout), limit=1)
+        return bytearray(events[0].payload) if events else bytearray()
+
+    @final
+    def read_events(self: Self,
+                    since: Optional[int] = None,
+                    timeout: Optional[float] = None,
+                    limit: Optional[int] = None) -> Tuple[TagEvent, ...]:
+        # Returns straight away if anything newer than since is still buffered, otherwise waits for the next scan
+        if since is None or since < 0:
+            since = self._events.latest_sequence
+        return tuple(self._events.wait_since(since, _read_timeout(timeout), limit))
 
     @abc.abstractmethod
     def start_reader(self: Self) -> None:
@@ -23,7 +46,7 @@ class PN532Device(Device, abc.ABC):
     @final
     @override
     def supported_commands(cls: Type[Self]) -> Set[Type[Command[Self, Any]]]:
-        return {ReadDataCommand, }
+        return {ReadDataCommand, ReadEventsCommand}
 
     @classmethod
     @final
@@ -32,9 +55,26 @@ class PN532Device(Device, abc.ABC):
         from tophat.devices.nfc_reader._device_impl import PN532DeviceImpl
         return PN532DeviceImpl
 
+    @override
+    def __init__(self,
+                 device_name: str,
+                 event_capacity: int = DEFAULT_EVENT_CAPACITY) -> None:
+        super().__init__(device_name)
+        self._events: TagEventBus = TagEventBus(event_capacity)
+
+
+def _read_timeout(timeout: Optional[float]) -> float:
+    # No timeout waits as long as any read may
+    return MAX_READ_TIMEOUT if timeout is None else min(timeout, MAX_READ_TIMEOUT)
+
 
+@register_record(0x0300, fields=('timeout',), types={'timeout': (int, float, NoneType)})
 class ReadDataCommand(Command[PN532Device, bytearray]):
 
+    @property
+    def timeout(self: Self) -> Optional[float]:
+        return self._timeout
+
     @override
     def run(self: Self,
             device: PN532Device) -> bytearray:
@@ -44,3 +84,36 @@ class ReadDataCommand(Command[PN532Device, bytearray]):
     def __init__(self,
                  timeout: Optional[float] = None) -> None:
         self._timeout: Optional[float] = timeout
+
+
+@register_record(0x0302,
+                 fields=('since', 'timeout', 'limit'),
+                 types={'since': (int, NoneType), 'timeout': (int, float, NoneType), 'limit': (int, NoneType)})
+class ReadEventsCommand(Command[PN532Device, Tuple[TagEvent, ...]]):
+
+    @property
+    def since(self: Self) -> Optional[int]:
+        return self._since
+
+    @property
+    def timeout(self: Self) -> Optional[float]:
+        return self._timeout
+
+    @property
+    def limit(self: Self) -> Optional[int]:
+        return self._limit
+
+    @override
+    def run(self: Self,
+            device: PN532Device) -> Tuple[TagEvent, ...]:
+        return device.read_events(self._since, self._timeout, self._limit)
+
+    @override
+    def __init__(self,
+                 since: Optional[int] = None,
+                 timeout: Optional[float] = None,
+                 limit: Optional[int] = None) -> None:
+        # Readers pass the sequence number of the last event they saw, None or negative for only scans from now on
+        self._since: Optional[int] = since
+        self._timeout: Optional[float] = timeout
+        self._limit: Optional[int] = limit
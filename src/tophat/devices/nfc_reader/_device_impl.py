@@ -1,41 +1,63 @@
 from __future__ import annotations
 
 import multiprocessing as mp
-import multiprocessing.managers as mp_mngr
+import multiprocessing.context as mp_ctx
 import multiprocessing.queues as mp_q
 import multiprocessing.synchronize as mp_sync
-import queue
+import logging
+import threading
 import time
-from typing import Optional
+from typing import List, Optional, Tuple, Union
 
 import board
-from adafruit_pn532.adafruit_pn532 import PN532
+from adafruit_pn532.adafruit_pn532 import _COMMAND_INCOMMUNICATETHRU, _COMMAND_INDATAEXCHANGE, PN532
 from adafruit_pn532.spi import PN532_SPI
 from busio import SPI
 from digitalio import DigitalInOut
 from typing_extensions import Self, final, override
 
 from tophat.devices.nfc_reader import PN532Device
+from tophat.devices.nfc_reader.cache import (DEFAULT_TAG_CACHE_BYTES, DEFAULT_TAG_CACHE_TTL, TagCacheStats,
+                                             TagPayloadCache)
+from tophat.devices.nfc_reader.ntag import (CAPABILITY_CONTAINER_PAGE, NTAG_FAST_READ, NTAG_READ, NTAG_WRITE, PAGE_SIZE,
+                                            READ_PAGES, NtagTransport, read_ntag_message)
+from tophat.devices.nfc_reader.polling import PollScheduler, PollSettings, PollStats
+
+LOGGER = logging.getLogger('tophat')
+
+# Spawn the reader without changing the start method used by the rest of the server
+_SPAWN_CONTEXT: mp_ctx.SpawnContext = mp.get_context('spawn')
+
+# Seconds between poll statistics sent back by an idle reader, a scan always sends them
+_STATS_INTERVAL: float = 30.0
+
+# A scan as its UID and payload, or the reader's latest statistics
+_ReaderMessage = Union[Tuple[bytes, bytes], PollStats, TagCacheStats]
 
 
 @final
 class PN532DeviceImpl(PN532Device):
 
-    @override
-    def read_data(self: Self,
-                  timeout: Optional[float] = None) -> bytearray:
-        try:
-            return self._read_queue.get(block=True, timeout=timeout)
-        except queue.Empty:
-            return bytearray()
+    @property
+    def poll_stats(self: Self) -> Optional[PollStats]:
+        return self._poll_stats
+
+    @property
+    def tag_cache_stats(self: Self) -> Optional[TagCacheStats]:
+        return self._tag_cache_stats
 
     @override
     def start_reader(self: Self) -> None:
-        mp.set_start_method('spawn', force=True)
         reader_process = ReaderProcess(self._sck_pin, self._mosi_pin, self._miso_pin, self._cs_pin,
                                        self._read_queue,
-                                       self._stop_event)
+                                       self._stop_event,
+                                       self._reader_waiting,
+                                       self._poll_settings,
+                                       self._tag_cache_ttl,
+                                       self._tag_cache_bytes,
+                                       self._verify_cached_tags)
         reader_process.start()
+        threading.Thread(target=self._publish_scans, name=f'{self.name}-events', daemon=True).start()
 
     @override
     def __init__(self,
@@ -44,18 +66,93 @@ class PN532DeviceImpl(PN532Device):
                  mosi_pin: board.pin.Pin,
                  miso_pin: board.pin.Pin,
                  cs_pin: board.pin.Pin,
-                 manager: mp_mngr.SyncManager) -> None:
+                 poll_settings: PollSettings = PollSettings(),
+                 tag_cache_ttl: float = DEFAULT_TAG_CACHE_TTL,
+                 tag_cache_bytes: int = DEFAULT_TAG_CACHE_BYTES,
+                 verify_cached_tags: bool = True) -> None:
         super().__init__(device_name)
         self._sck_pin: board.pin.Pin = sck_pin
         self._mosi_pin: board.pin.Pin = mosi_pin
         self._miso_pin: board.pin.Pin = miso_pin
         self._cs_pin: board.pin.Pin = cs_pin
-        self._read_queue: mp_q.Queue[bytearray] = manager.Queue(maxsize=32)
-        self._stop_event: mp_sync.Event = manager.Event()
+        # Unbounded and drained as fast as scans arrive, readers are served from the event bus
+        self._read_queue: mp_q.Queue[_ReaderMessage] = _SPAWN_CONTEXT.Queue()
+        self._stop_event: mp_sync.Event = _SPAWN_CONTEXT.Event()
+        # Set while a command is blocked waiting for a scan, the reader polls back to back until it is cleared
+        self._reader_waiting: mp_sync.Event = _SPAWN_CONTEXT.Event()
+        self._poll_settings: PollSettings = poll_settings
+        self._poll_stats: Optional[PollStats] = None
+        self._tag_cache_ttl: float = tag_cache_ttl
+        self._tag_cache_bytes: int = tag_cache_bytes
+        self._verify_cached_tags: bool = verify_cached_tags
+        self._tag_cache_stats: Optional[TagCacheStats] = None
+        self.events.add_waiters_listener(self._update_reader_waiting)
+
+    def _publish_scans(self: Self) -> None:
+        while True:
+            message: _ReaderMessage = self._read_queue.get()
+            if isinstance(message, PollStats):
+                self._poll_stats = message
+                LOGGER.debug(f'NFC reader {self.name}: {message}')
+            elif isinstance(message, TagCacheStats):
+                self._tag_cache_stats = message
+            else:
+                self.events.publish(*message)
+
+    def _update_reader_waiting(self: Self,
+                               waiters: int) -> None:
+        if waiters:
+            self._reader_waiting.set()
+        else:
+            self._reader_waiting.clear()
 
 
 @final
-class ReaderProcess(mp.Process):
+class PN532Transport(NtagTransport):
+
+    @override
+    def read(self: Self,
+             page: int) -> Optional[bytes]:
+        return self._exchange(_COMMAND_INDATAEXCHANGE, [0x01, NTAG_READ, page], READ_PAGES * PAGE_SIZE)
+
+    @override
+    def fast_read(self: Self,
+                  start_page: int,
+                  end_page: int) -> Optional[bytes]:
+        # FAST_READ is not a MIFARE command the PN532 knows, so it goes to the tag as is
+        return self._exchange(_COMMAND_INCOMMUNICATETHRU,
+                              [NTAG_FAST_READ, start_page, end_page],
+                              (end_page - start_page + 1) * PAGE_SIZE)
+
+    @override
+    def write(self: Self,
+              page: int,
+              data: bytes) -> bool:
+        return self._exchange(_COMMAND_INDATAEXCHANGE, [0x01, NTAG_WRITE, page, *data], 0) is not None
+
+    @override
+    def __init__(self,
+                 pn532: PN532) -> None:
+        self._pn532: PN532 = pn532
+
+    def _exchange(self: Self,
+                  command: int,
+                  params: List[int],
+                  size: int) -> Optional[bytes]:
+        try:
+            response: Optional[bytearray] = self._pn532.call_function(command,
+                                                                      params=params,
+                                                                      response_length=size + 1)
+        except RuntimeError:
+            return None
+        # The first byte is the PN532 status, anything but zero means the tag did not answer
+        if response is None or len(response) < size + 1 or response[0] != 0x00:
+            return None
+        return bytes(response[1:size + 1])
+
+
+@final
+class ReaderProcess(_SPAWN_CONTEXT.Process):
 
     @override
     def run(self: Self) -> None:
@@ -63,9 +160,12 @@ class ReaderProcess(mp.Process):
                                  cs_pin=DigitalInOut(self._cs_pin))
         pn532.low_power = True
         pn532.SAM_configuration()
+        scheduler: PollScheduler = PollScheduler(self._poll_settings)
+        cache: TagPayloadCache = TagPayloadCache(self._tag_cache_ttl, self._tag_cache_bytes)
         while True:
             try:
-                self._read_queue.put(self._await_data(pn532))
+                self._read_queue.put(self._await_scan(pn532, scheduler, cache))
+                self._send_stats(scheduler, cache)
             except ReaderProcess._Stopped:
                 self._stop(pn532)
 
@@ -75,8 +175,13 @@ class ReaderProcess(mp.Process):
                  mosi_pin: board.pin.Pin,
                  miso_pin: board.pin.Pin,
                  cs_pin: board.pin.Pin,
-                 read_queue: mp_q.Queue[bytearray],
-                 stop_event: mp_sync.Event) -> None:
+                 read_queue: mp_q.Queue[_ReaderMessage],
+                 stop_event: mp_sync.Event,
+                 reader_waiting: mp_sync.Event,
+                 poll_settings: PollSettings,
+                 tag_cache_ttl: float,
+                 tag_cache_bytes: int,
+                 verify_cached_tags: bool) -> None:
         super().__init__(name='nfc_reader',
                          daemon=True)
         self._sck_pin: board.pin.Pin = sck_pin
@@ -84,33 +189,81 @@ class ReaderProcess(mp.Process):
         self._miso_pin: board.pin.Pin = miso_pin
         self._cs_pin: board.pin.Pin = cs_pin
 
-        self._read_queue: mp_q.Queue[bytearray] = read_queue
+        self._read_queue: mp_q.Queue[_ReaderMessage] = read_queue
         self._stop_event: mp_sync.Event = stop_event
+        self._reader_waiting: mp_sync.Event = reader_waiting
+        self._poll_settings: PollSettings = poll_settings
+        self._tag_cache_ttl: float = tag_cache_ttl
+        self._tag_cache_bytes: int = tag_cache_bytes
+        self._verify_cached_tags: bool = verify_cached_tags
+        # The tag found by the last poll, as long as every poll since has found it
+        self._present_uid: Optional[bytes] = None
 
     class _Stopped(Exception):
         pass
 
-    def _await_data(self: Self,
-                    pn532: PN532) -> bytearray:
+    def _await_scan(self: Self,
+                    pn532: PN532,
+                    scheduler: PollScheduler,
+                    cache: TagPayloadCache) -> Tuple[bytes, bytes]:
+        stats_due_ns: int = time.monotonic_ns() + int(_STATS_INTERVAL * 1e9)
         while not self._stop_event.is_set():
-            if pn532.read_passive_target(timeout=0.2) is not None:
-                return ReaderProcess._read_data(pn532)
-            pn532.power_down()
-            time.sleep(1.8)
+            poll_start_ns: int = time.monotonic_ns()
+            found: Optional[bytearray] = pn532.read_passive_target(timeout=scheduler.settings.poll_timeout)
+            poll_end_ns: int = time.monotonic_ns()
+            uid: Optional[bytes] = bytes(found) if found is not None else None
+            # A tag left on the reader is only scanned once, it has to leave the field to be scanned again
+            duplicate: bool = uid is not None and uid == self._present_uid
+            self._present_uid = uid
+            scheduler.record_poll(poll_start_ns, poll_end_ns, uid is not None and not duplicate)
+            if duplicate:
+                cache.record_duplicate()
+            elif uid is not None:
+                return uid, self._read_payload(pn532, uid, cache)
+
+            delay: float = scheduler.next_delay(poll_end_ns, self._reader_waiting.is_set())
+            if delay > 0:
+                # Only deep backoff is worth powering down for, a reader starting to wait cuts the sleep short
+                powered_down: bool = scheduler.should_power_down(delay)
+                if powered_down:
+                    pn532.power_down()
+                self._reader_waiting.wait(delay)
+                scheduler.record_idle(time.monotonic_ns() - poll_end_ns, powered_down)
+
+            if poll_end_ns >= stats_due_ns:
+                self._send_stats(scheduler, cache)
+                stats_due_ns = poll_end_ns + int(_STATS_INTERVAL * 1e9)
         else:
             raise ReaderProcess._Stopped()
 
-    @staticmethod
-    def _read_data(pn532: PN532) -> bytearray:
-        data: bytearray = bytearray()
-        block_num: int = 4  # Start at block 4, beginning of user data
-        block_data: Optional[bytearray] = pn532.ntag2xx_read_block(block_num)
-        while block_data is not None:
-            data += block_data
-            block_num += 1
-            block_data: Optional[bytearray] = pn532.ntag2xx_read_block(block_num)
-
-        return data
+    def _read_payload(self: Self,
+                      pn532: PN532,
+                      uid: bytes,
+                      cache: TagPayloadCache) -> bytes:
+        # Checking a cached payload costs the one read that starts every full read anyway
+        transport: PN532Transport = PN532Transport(pn532)
+        head: Optional[bytes] = transport.read(CAPABILITY_CONTAINER_PAGE) if self._verify_cached_tags else None
+        now_ns: int = time.monotonic_ns()
+        payload: Optional[bytes] = cache.get(uid, head, now_ns)
+        if payload is not None:
+            return payload
+
+        data: bytearray
+        complete: bool
+        data, complete = read_ntag_message(transport, head)
+        # A card pulled away mid read still gets its partial payload published, but it is never served again.
+        # Comparing heads only proves the bytes the head holds are unchanged, so a message running past them would be
+        # served after being rewritten further in. Those are only cached when checks are off.
+        verifiable: bool = head is not None and len(data) <= len(head) - PAGE_SIZE
+        if complete and (verifiable or not self._verify_cached_tags):
+            cache.put(uid, bytes(data), head, now_ns)
+        return bytes(data)
+
+    def _send_stats(self: Self,
+                    scheduler: PollScheduler,
+                    cache: TagPayloadCache) -> None:
+        self._read_queue.put(scheduler.stats)
+        self._read_queue.put(cache.stats)
 
     def _stop(self: Self,
               pn532: PN532) -> None:
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import time
+from argparse import ArgumentParser
+from typing import Callable, Dict, List, Optional, Tuple
+
+from typing_extensions import Self, final, override
+
+from tophat.devices.nfc_reader.ntag import (CAPABILITY_CONTAINER_PAGE, PAGE_SIZE, READ_PAGES, USER_MEMORY_PAGE,
+                                            NtagTransport, read_ntag, read_pages)
+from tophat.devices.nfc_reader.provision import CardWriteStats, write_card
+
+# NTAG21x tags keep five pages of configuration after user memory
+_CONFIG_PAGES: int = 5
+
+
+@final
+class SimulatedTag(NtagTransport):
+    # Keeps a modelled clock instead of sleeping, every exchange costs a fixed round trip plus its bytes on the wire
+
+    @property
+    def elapsed(self: Self) -> float:
+        return self._elapsed
+
+    @property
+    def exchanges(self: Self) -> int:
+        return self._exchanges
+
+    @override
+    def read(self: Self,
+             page: int) -> Optional[bytes]:
+        if page >= self._num_pages:
+            return self._fail()
+        # READ wraps around to the first page at the end of memory
+        data: bytes = bytes((self._memory * 2)[page * PAGE_SIZE:(page + READ_PAGES) * PAGE_SIZE])
+        return self._answer(data)
+
+    @override
+    def fast_read(self: Self,
+                  start_page: int,
+                  end_page: int) -> Optional[bytes]:
+        if not self._supports_fast_read or end_page >= self._num_pages or start_page > end_page:
+            return self._fail()
+        return self._answer(bytes(self._memory[start_page * PAGE_SIZE:(end_page + 1) * PAGE_SIZE]))
+
+    @override
+    def write(self: Self,
+              page: int,
+              data: bytes) -> bool:
+        if not USER_MEMORY_PAGE <= page < self._num_pages - _CONFIG_PAGES or len(data) != PAGE_SIZE:
+            self._fail()
+            return False
+        self._memory[page * PAGE_SIZE:(page + 1) * PAGE_SIZE] = data
+        # The tag only acknowledges once the page is programmed
+        self._elapsed += self._write_time
+        self._answer(data)
+        return True
+
+    @override
+    def __init__(self,
+                 user_memory: bytes,
+                 round_trip: float,
+                 byte_time: float,
+                 failure_time: float,
+                 supports_fast_read: bool = True,
+                 write_time: float = 0.0) -> None:
+        capability_container: bytes = bytes((0xe1, 0x10, len(user_memory) // 8, 0x00))
+        self._memory: bytearray = bytearray(bytes(9) + bytes(3) + capability_container + user_memory
+                                            + bytes(_CONFIG_PAGES * PAGE_SIZE))
+        self._num_pages: int = len(self._memory) // PAGE_SIZE
+        self._round_trip: float = round_trip
+        self._byte_time: float = byte_time
+        self._failure_time: float = failure_time
+        self._supports_fast_read: bool = supports_fast_read
+        self._write_time: float = write_time
+        self._elapsed: float = 0.0
+        self._exchanges: int = 0
+
+    def _answer(self: Self,
+                data: bytes) -> bytes:
+        self._exchanges += 1
+        self._elapsed += self._round_trip + len(data) * self._byte_time
+        return data
+
+    def _fail(self: Self) -> None:
+        self._exchanges += 1
+        self._elapsed += self._failure_time
+        return None
+
+
+def ndef_user_memory(size: int,
+                     message_size: int) -> bytes:
+    message: bytes = bytes(index % 251 for index in range(message_size))
+    header: bytes = (bytes((0x03, message_size)) if message_size < 0xff
+                     else bytes((0x03, 0xff, message_size >> 8, message_size & 0xff)))
+    return (header + message + b'\xfe').ljust(size, b'\x00')
+
+
+def read_per_block(tag: NtagTransport) -> bytearray:
+    # The previous reader, one READ per page keeping only its first four bytes until a read fails
+    data: bytearray = bytearray()
+    page: int = USER_MEMORY_PAGE
+    while (chunk := tag.read(page)) is not None:
+        data += chunk[:PAGE_SIZE]
+        page += 1
+    return data
+
+
+def write_per_block(tag: NtagTransport,
+                    data: bytes) -> int:
+    # The previous writer, every page of data written whatever the tag already holds and nothing read back
+    pages: int = 0
+    for offset in range(0, len(data), PAGE_SIZE):
+        page: int = USER_MEMORY_PAGE + offset // PAGE_SIZE
+        if not tag.write(page, data[offset:offset + PAGE_SIZE].ljust(PAGE_SIZE, b'\x00')):
+            raise RuntimeError(f'Failed to write page {page}')
+        pages += 1
+    return pages
+
+
+def write_diff(tag: NtagTransport,
+               data: bytes) -> int:
+    stats: CardWriteStats = write_card(tag, b'', data)
+    return stats.pages_written
+
+
+READERS: Dict[str, Callable[[NtagTransport], bytearray]] = {
+    'per-block': read_per_block,
+    'bulk': read_ntag,
+}
+
+WRITERS: Dict[str, Callable[[NtagTransport, bytes], int]] = {
+    'per-block': write_per_block,
+    'diff': write_diff,
+}
+
+
+def _message_sizes(size: int) -> Dict[str, int]:
+    # The NDEF TLV header and terminator take two to four bytes around the message
+    return {'short': min(16, size - 3), 'full': size - (3 if size - 3 < 0xff else 5)}
+
+
+def _time_to_payload(reader_name: str,
+                     user_memory: bytes,
+                     round_trip: float,
+                     byte_time: float,
+                     failure_time: float,
+                     supports_fast_read: bool) -> Tuple[SimulatedTag, float, bytearray]:
+    tag: SimulatedTag = SimulatedTag(user_memory, round_trip, byte_time, failure_time, supports_fast_read)
+    start_time: float = time.perf_counter()
+    payload: bytearray = READERS[reader_name](tag)
+    return tag, time.perf_counter() - start_time, payload
+
+
+def run_reads(tag_sizes: List[int],
+              round_trip: float,
+              byte_time: float,
+              failure_time: float,
+              supports_fast_read: bool) -> None:
+    print(f'{"tag":>6}{"message":>9}' + ''.join(f'{reader_name:>24}' for reader_name in READERS) + f'{"speedup":>10}')
+    for size in tag_sizes:
+        for message_name, message_size in _message_sizes(size).items():
+            user_memory: bytes = ndef_user_memory(size, message_size)
+            results: List[Tuple[SimulatedTag, float, bytearray]] = [
+                _time_to_payload(reader_name, user_memory, round_trip, byte_time, failure_time, supports_fast_read)
+                for reader_name in READERS]
+            # Both readers start at page 4, the bulk reader only stops earlier
+            bulk_payload: bytearray = results[-1][2]
+            if results[0][2][:len(bulk_payload)] != bulk_payload:
+                raise RuntimeError(f'Readers disagree on a {size} byte tag')
+            print(f'{size:>5}B{message_name:>9}'
+                  + ''.join(f'{tag.exchanges:>5} x {(tag.elapsed + cpu_time) * 1e3:>8.1f} ms {len(payload):>3}B'
+                            for tag, cpu_time, payload in results)
+                  + f'{(results[0][0].elapsed + results[0][1]) / (results[-1][0].elapsed + results[-1][1]):>9.1f}x')
+
+
+def _card_states(payload: bytes) -> Dict[str, bytes]:
+    # What the card holds before the payload is written, one changed byte stands in for a small edit
+    edited: bytearray = bytearray(payload)
+    edited[len(edited) // 2] ^= 0xff
+    return {'blank': bytes(len(payload)), 'edited': bytes(edited), 'same': payload}
+
+
+def _time_to_written(writer_name: str,
+                     user_memory: bytes,
+                     payload: bytes,
+                     round_trip: float,
+                     byte_time: float,
+                     failure_time: float,
+                     supports_fast_read: bool,
+                     write_time: float) -> Tuple[int, float, int]:
+    tag: SimulatedTag = SimulatedTag(user_memory, round_trip, byte_time, failure_time, supports_fast_read, write_time)
+    start_time: float = time.perf_counter()
+    pages_written: int = WRITERS[writer_name](tag, payload)
+    cpu_time: float = time.perf_counter() - start_time
+    exchanges: int = tag.exchanges
+    elapsed: float = tag.elapsed + cpu_time
+    if read_pages(tag, USER_MEMORY_PAGE, USER_MEMORY_PAGE + len(payload) // PAGE_SIZE - 1) != payload:
+        raise RuntimeError(f'{writer_name} writer left a {len(user_memory)} byte tag without the payload')
+    return exchanges, elapsed, pages_written
+
+
+def run_writes(tag_sizes: List[int],
+               round_trip: float,
+               byte_time: float,
+               failure_time: float,
+               supports_fast_read: bool,
+               write_time: float) -> None:
+    print(f'{"tag":>6}{"card":>9}' + ''.join(f'{writer_name:>25}' for writer_name in WRITERS) + f'{"speedup":>10}')
+    for size in tag_sizes:
+        payload: bytes = ndef_user_memory(size, size - (3 if size - 3 < 0xff else 5))
+        for state_name, user_memory in _card_states(payload).items():
+            results: List[Tuple[int, float, int]] = [
+                _time_to_written(writer_name, user_memory, payload, round_trip, byte_time, failure_time,
+                                 supports_fast_read, write_time)
+                for writer_name in WRITERS]
+            print(f'{size:>5}B{state_name:>9}'
+                  + ''.join(f'{pages_written:>4}p {exchanges:>4} x {elapsed * 1e3:>8.1f} ms'
+                            for exchanges, elapsed, pages_written in results)
+                  + f'{results[0][1] / results[-1][1]:>9.1f}x')
+
+
+def main() -> None:
+    arg_parser = ArgumentParser(description='Time to payload of NTAG readers and time to written of NTAG writers '
+                                            'against a simulated tag')
+    arg_parser.add_argument('benchmark',
+                            choices=['reads', 'writes'],
+                            nargs='?',
+                            default='reads')
+    arg_parser.add_argument('--sizes',
+                            dest='tag_sizes',
+                            type=int,
+                            nargs='+',
+                            default=[48, 144, 504])
+    arg_parser.add_argument('--round-trip-ms',
+                            dest='round_trip_ms',
+                            type=float,
+                            default=3.0,
+                            help='Cost of one PN532 exchange before any data')
+    arg_parser.add_argument('--byte-us',
+                            dest='byte_us',
+                            type=float,
+                            default=10.0,
+                            help='Cost of every byte of a response')
+    arg_parser.add_argument('--failure-ms',
+                            dest='failure_ms',
+                            type=float,
+                            default=50.0,
+                            help='Cost of a read the tag does not answer')
+    arg_parser.add_argument('--write-ms',
+                            dest='write_ms',
+                            type=float,
+                            default=4.1,
+                            help='Time the tag takes to program a page before acknowledging a write')
+    arg_parser.add_argument('--no-fast-read',
+                            dest='supports_fast_read',
+                            action='store_false',
+                            default=True)
+
+    args = arg_parser.parse_args()
+    for size in args.tag_sizes:
+        if size % 8 or not 0 < size <= 255 * 8:
+            arg_parser.error(f'Tag size {size} must be a positive multiple of 8 up to 2040')
+    if args.benchmark == 'reads':
+        run_reads(args.tag_sizes, args.round_trip_ms / 1e3, args.byte_us / 1e6, args.failure_ms / 1e3,
+                  args.supports_fast_read)
+
+    elif args.benchmark == 'writes':
+        run_writes(args.tag_sizes, args.round_trip_ms / 1e3, args.byte_us / 1e6, args.failure_ms / 1e3,
+                   args.supports_fast_read, args.write_ms / 1e3)
+
+
+if __name__ == '__main__':
+    main()
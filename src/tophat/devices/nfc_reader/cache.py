@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import collections
+import dataclasses
+from typing import NamedTuple, Optional, OrderedDict
+
+from typing_extensions import Self, final, override
+
+DEFAULT_TAG_CACHE_TTL: float = 60.0
+DEFAULT_TAG_CACHE_BYTES: int = 64 << 10
+
+_NS_PER_SECOND: int = 1_000_000_000
+
+
+class _CachedTag(NamedTuple):
+    payload: bytes
+    # The first read of the tag, holding the whole payload, compared against a fresh one before it is served again
+    head: Optional[bytes]
+    stored_ns: int
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class TagCacheStats:
+    entries: int
+    size_bytes: int
+    hits: int
+    misses: int
+    expired: int
+    # Cached payloads that failed the check against the tag, it was rewritten since it was read
+    stale: int
+    evictions: int
+    # Polls that found the tag of the previous scan still on the reader
+    duplicates: int
+
+    @property
+    def hit_rate(self: Self) -> float:
+        lookups: int = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@final
+class TagPayloadCache:
+
+    @property
+    def ttl(self: Self) -> float:
+        return self._ttl
+
+    @property
+    def max_bytes(self: Self) -> int:
+        return self._max_bytes
+
+    @property
+    def size_bytes(self: Self) -> int:
+        return self._size_bytes
+
+    @property
+    def stats(self: Self) -> TagCacheStats:
+        return TagCacheStats(len(self._tags),
+                             self._size_bytes,
+                             self._hits,
+                             self._misses,
+                             self._expired,
+                             self._stale,
+                             self._evictions,
+                             self._duplicates)
+
+    def get(self: Self,
+            uid: bytes,
+            head: Optional[bytes],
+            now_ns: int) -> Optional[bytes]:
+        cached: Optional[_CachedTag] = self._tags.get(uid)
+        if cached is None:
+            self._misses += 1
+            return None
+        if now_ns - cached.stored_ns > self._ttl * _NS_PER_SECOND:
+            self._expired += 1
+            self._remove(uid)
+            self._misses += 1
+            return None
+        if head is not None and cached.head is not None and head != cached.head:
+            self._stale += 1
+            self._remove(uid)
+            self._misses += 1
+            return None
+
+        self._hits += 1
+        self._tags.move_to_end(uid)
+        return cached.payload
+
+    def put(self: Self,
+            uid: bytes,
+            payload: bytes,
+            head: Optional[bytes],
+            now_ns: int) -> None:
+        if self._ttl <= 0 or len(uid) + len(payload) > self._max_bytes:
+            return
+        self._remove(uid)
+        self._tags[uid] = _CachedTag(payload, head, now_ns)
+        self._size_bytes += len(uid) + len(payload)
+        self._evict()
+
+    def record_duplicate(self: Self) -> None:
+        self._duplicates += 1
+
+    def clear(self: Self) -> None:
+        self._tags.clear()
+        self._size_bytes = 0
+
+    @override
+    def __init__(self,
+                 ttl: float = DEFAULT_TAG_CACHE_TTL,
+                 max_bytes: int = DEFAULT_TAG_CACHE_BYTES) -> None:
+        # A non-positive TTL disables the cache
+        self._ttl: float = ttl
+        self._max_bytes: int = max_bytes
+        self._tags: OrderedDict[bytes, _CachedTag] = collections.OrderedDict()
+        self._size_bytes: int = 0
+        self._hits: int = 0
+        self._misses: int = 0
+        self._expired: int = 0
+        self._stale: int = 0
+        self._evictions: int = 0
+        self._duplicates: int = 0
+
+    def _remove(self: Self,
+                uid: bytes) -> None:
+        removed: Optional[_CachedTag] = self._tags.pop(uid, None)
+        if removed is not None:
+            self._size_bytes -= len(uid) + len(removed.payload)
+
+    def _evict(self: Self) -> None:
+        while self._size_bytes > self._max_bytes:
+            uid, evicted = self._tags.popitem(last=False)
+            self._size_bytes -= len(uid) + len(evicted.payload)
+            self._evictions += 1
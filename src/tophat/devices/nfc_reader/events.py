@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import dataclasses
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from typing_extensions import Self, final, override
+
+from tophat.api.codec import register_record
+from tophat.api.device import CancellationToken, CommandCancelledError
+
+DEFAULT_EVENT_CAPACITY: int = 256
+# Longest a waiter goes without checking whether its command was cancelled
+CANCEL_CHECK_INTERVAL: float = 0.05
+
+
+@register_record(0x0301, types={'sequence': int, 'timestamp_ns': int, 'uid': bytes, 'payload': bytes})
+@final
+@dataclasses.dataclass(frozen=True)
+class TagEvent:
+    # Sequence numbers start at 1 and increase by one per scan, a gap means events were overwritten before being read
+    sequence: int
+    timestamp_ns: int
+    uid: bytes
+    payload: bytes
+
+
+@final
+class TagEventBus:
+
+    @property
+    def capacity(self: Self) -> int:
+        return self._capacity
+
+    @property
+    def latest_sequence(self: Self) -> int:
+        return self._latest_sequence
+
+    @property
+    def oldest_sequence(self: Self) -> int:
+        return max(1, self._latest_sequence - self._capacity + 1)
+
+    @property
+    def waiters(self: Self) -> int:
+        return self._waiters
+
+    def add_waiters_listener(self: Self,
+                             listener: Callable[[int], None]) -> None:
+        # Called with the number of readers blocked waiting for a scan whenever it changes
+        self._waiters_listeners.append(listener)
+
+    def publish(self: Self,
+                uid: bytes,
+                payload: bytes,
+                timestamp_ns: Optional[int] = None) -> TagEvent:
+        # Publishing never waits on subscribers, the oldest event is simply overwritten
+        with self._condition:
+            self._latest_sequence += 1
+            event: TagEvent = TagEvent(self._latest_sequence,
+                                       time.time_ns() if timestamp_ns is None else timestamp_ns,
+                                       uid,
+                                       payload)
+            self._events[event.sequence % self._capacity] = event
+            self._condition.notify_all()
+        return event
+
+    def events_since(self: Self,
+                     sequence: int,
+                     limit: Optional[int] = None) -> List[TagEvent]:
+        with self._condition:
+            return self._events_since(sequence, limit)
+
+    def wait_since(self: Self,
+                   sequence: int,
+                   timeout: Optional[float] = None,
+                   limit: Optional[int] = None) -> List[TagEvent]:
+        # Raises CommandCancelledError if the command waiting is cancelled before a scan arrives
+        token: CancellationToken = CancellationToken.current()
+        deadline: Optional[float] = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            if self._latest_sequence <= sequence:
+                self._set_waiters(self._waiters + 1)
+                try:
+                    while self._latest_sequence <= sequence:
+                        if token.cancelled:
+                            raise CommandCancelledError(f'Wait for a scan after {sequence} was cancelled')
+                        remaining: float = (CANCEL_CHECK_INTERVAL if deadline is None
+                                            else min(CANCEL_CHECK_INTERVAL, deadline - time.monotonic()))
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                finally:
+                    self._set_waiters(self._waiters - 1)
+            return self._events_since(sequence, limit)
+
+    def subscribe(self: Self,
+                  since: Optional[int] = None) -> TagSubscription:
+        return TagSubscription(self, self._latest_sequence if since is None else since)
+
+    def snapshot(self: Self) -> Dict[str, Any]:
+        with self._condition:
+            return {'capacity': self._capacity,
+                    'latest_sequence': self._latest_sequence,
+                    'oldest_sequence': self.oldest_sequence,
+                    'buffered': min(self._latest_sequence, self._capacity),
+                    'waiters': self._waiters}
+
+    @override
+    def __init__(self,
+                 capacity: int = DEFAULT_EVENT_CAPACITY) -> None:
+        self._capacity: int = capacity
+        self._condition: threading.Condition = threading.Condition()
+        self._events: List[Optional[TagEvent]] = [None] * capacity
+        self._latest_sequence: int = 0
+        self._waiters: int = 0
+        self._waiters_listeners: List[Callable[[int], None]] = []
+
+    def _set_waiters(self: Self,
+                     waiters: int) -> None:
+        self._waiters = waiters
+        for listener in self._waiters_listeners:
+            listener(waiters)
+
+    def _events_since(self: Self,
+                      sequence: int,
+                      limit: Optional[int]) -> List[TagEvent]:
+        first: int = max(sequence + 1, self.oldest_sequence)
+        last: int = self._latest_sequence if limit is None else min(self._latest_sequence, first + limit - 1)
+        return [self._events[event_sequence % self._capacity] for event_sequence in range(first, last + 1)]
+
+
+@final
+class TagSubscription:
+
+    @property
+    def cursor(self: Self) -> int:
+        return self._cursor
+
+    @property
+    def missed(self: Self) -> int:
+        return self._missed
+
+    def next(self: Self,
+             timeout: Optional[float] = None) -> Optional[TagEvent]:
+        events: List[TagEvent] = self._bus.wait_since(self._cursor, timeout, limit=1)
+        return self._advance(events)[0] if events else None
+
+    def drain(self: Self) -> List[TagEvent]:
+        return self._advance(self._bus.events_since(self._cursor))
+
+    @override
+    def __init__(self,
+                 bus: TagEventBus,
+                 cursor: int) -> None:
+        self._bus: TagEventBus = bus
+        self._cursor: int = cursor
+        self._missed: int = 0
+
+    def _advance(self: Self,
+                 events: List[TagEvent]) -> List[TagEvent]:
+        if events:
+            # Anything between the cursor and the first event returned was overwritten before this subscriber got to it
+            self._missed += events[0].sequence - self._cursor - 1
+            self._cursor = events[-1].sequence
+        return events
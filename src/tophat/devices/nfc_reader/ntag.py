@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import abc
+from typing import FrozenSet, List, Optional, Tuple
+
+from typing_extensions import Buffer, Self
+
+NTAG_READ: int = 0x30
+NTAG_FAST_READ: int = 0x3a
+NTAG_WRITE: int = 0xa2
+
+CAPABILITY_CONTAINER_PAGE: int = 3
+USER_MEMORY_PAGE: int = 4
+PAGE_SIZE: int = 4
+# READ always returns four pages, wrapping around at the end of memory
+READ_PAGES: int = 4
+# FAST_READ answers in a single PN532 frame, which holds at most 255 bytes
+MAX_FAST_READ_PAGES: int = 60
+
+_CAPABILITY_CONTAINER_MAGIC: int = 0xe1
+_NULL_TLV: int = 0x00
+_LOCK_CONTROL_TLV: int = 0x01
+_MEMORY_CONTROL_TLV: int = 0x02
+_NDEF_MESSAGE_TLV: int = 0x03
+_PROPRIETARY_TLV: int = 0xfd
+_TERMINATOR_TLV: int = 0xfe
+_SKIPPED_TLVS: FrozenSet[int] = frozenset((_LOCK_CONTROL_TLV, _MEMORY_CONTROL_TLV, _PROPRIETARY_TLV))
+# The longest TLV header, a type byte then 0xff and a two byte length
+_MAX_TLV_HEADER: int = 4
+
+
+class NtagTransport(abc.ABC):
+
+    @abc.abstractmethod
+    def read(self: Self,
+             page: int) -> Optional[bytes]:
+        # Sixteen bytes starting at page, None if the tag did not answer
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def fast_read(self: Self,
+                  start_page: int,
+                  end_page: int) -> Optional[bytes]:
+        # Every page from start_page to end_page inclusive, None if the tag or the reader does not support it
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def write(self: Self,
+              page: int,
+              data: bytes) -> bool:
+        # Writes the four bytes of a single page, False if the tag did not acknowledge it
+        raise NotImplementedError()
+
+
+def user_memory_size(capability_container: Buffer) -> Optional[int]:
+    capability_container = memoryview(capability_container)
+    if len(capability_container) < PAGE_SIZE or capability_container[0] != _CAPABILITY_CONTAINER_MAGIC:
+        return None
+    # The third byte is the size of the data area in units of eight bytes
+    return capability_container[2] * 8
+
+
+def ndef_end(data: Buffer,
+             size: int) -> int:
+    # How many bytes of user memory have to be read to hold the whole NDEF message. While that depends on bytes not
+    # read yet, the result goes past the end of data by at least as much as is needed to find out.
+    data = memoryview(data)
+    offset: int = 0
+    while offset < size:
+        if offset + _MAX_TLV_HEADER > len(data):
+            return min(offset + _MAX_TLV_HEADER, size)
+
+        tlv_type: int = data[offset]
+        if tlv_type == _NULL_TLV:
+            offset += 1
+            continue
+        if tlv_type == _TERMINATOR_TLV:
+            return offset + 1
+        if tlv_type != _NDEF_MESSAGE_TLV and tlv_type not in _SKIPPED_TLVS:
+            # Not TLV formatted, the whole user memory is the payload
+            return size
+
+        header_size: int = 2
+        length: int = data[offset + 1]
+        if length == 0xff:
+            header_size = 4
+            length = data[offset + 2] << 8 | data[offset + 3]
+        if tlv_type == _NDEF_MESSAGE_TLV:
+            return min(offset + header_size + length, size)
+        offset += header_size + length
+    return size
+
+
+def read_ntag(transport: NtagTransport,
+              head: Optional[bytes] = None) -> bytearray:
+    return read_ntag_message(transport, head)[0]
+
+
+def read_ntag_message(transport: NtagTransport,
+                      head: Optional[bytes] = None) -> Tuple[bytearray, bool]:
+    # User memory from page 4 up to the end of the NDEF message, in as few reads as the tag allows, and whether all of
+    # it was read. A tag taken away partway leaves only what was read before. Without a capability container there is
+    # no telling where the message ends, so that is never complete either.
+    # head is the answer to a READ of page 3 if the caller already has it.
+    if head is None:
+        head = transport.read(CAPABILITY_CONTAINER_PAGE)
+    if head is None:
+        return bytearray(), False
+    size: Optional[int] = user_memory_size(head[:PAGE_SIZE])
+    if size is None:
+        return _read_until_failure(transport), False
+
+    data: bytearray = bytearray(head[PAGE_SIZE:])
+    use_fast_read: bool = True
+    while (end := ndef_end(data, size)) > len(data):
+        start_page: int = USER_MEMORY_PAGE + len(data) // PAGE_SIZE
+        end_page: int = USER_MEMORY_PAGE + (end - 1) // PAGE_SIZE
+        chunk: Optional[bytes] = None
+        if use_fast_read and end_page - start_page + 1 > READ_PAGES:
+            chunk = transport.fast_read(start_page, min(end_page, start_page + MAX_FAST_READ_PAGES - 1))
+            use_fast_read = chunk is not None
+        if chunk is None:
+            chunk = transport.read(start_page)
+        if chunk is None:
+            return data, False
+        data += chunk
+    return data[:end], True
+
+
+def read_pages(transport: NtagTransport,
+               start_page: int,
+               end_page: int) -> Optional[bytearray]:
+    # Every page from start_page to end_page inclusive in as few reads as the tag allows, None if a read failed
+    size: int = (end_page - start_page + 1) * PAGE_SIZE
+    data: bytearray = bytearray()
+    use_fast_read: bool = True
+    while len(data) < size:
+        page: int = start_page + len(data) // PAGE_SIZE
+        chunk: Optional[bytes] = None
+        if use_fast_read and end_page - page + 1 > READ_PAGES:
+            chunk = transport.fast_read(page, min(end_page, page + MAX_FAST_READ_PAGES - 1))
+            use_fast_read = chunk is not None
+        if chunk is None:
+            chunk = transport.read(page)
+        if chunk is None:
+            return None
+        data += chunk
+    return data[:size]
+
+
+def changed_pages(current: Buffer,
+                  desired: Buffer,
+                  start_page: int = USER_MEMORY_PAGE) -> List[int]:
+    # Pages whose contents differ, desired is padded with zeros to whole pages and anything current lacks differs
+    current = memoryview(current)
+    desired = memoryview(desired)
+    pages: List[int] = []
+    for offset in range(0, len(desired), PAGE_SIZE):
+        page_data: bytes = bytes(desired[offset:offset + PAGE_SIZE]).ljust(PAGE_SIZE, b'\x00')
+        if bytes(current[offset:offset + PAGE_SIZE]) != page_data:
+            pages.append(start_page + offset // PAGE_SIZE)
+    return pages
+
+
+def _read_until_failure(transport: NtagTransport) -> bytearray:
+    # Without a capability container there is no telling where memory ends
+    data: bytearray = bytearray()
+    page: int = USER_MEMORY_PAGE
+    while (chunk := transport.read(page)) is not None:
+        data += chunk
+        page += READ_PAGES
+    return data
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import dataclasses
+from typing import Dict, Optional
+
+from typing_extensions import Self, final, override
+
+from tophat.api.metrics import LatencyHistogram
+
+_NS_PER_SECOND: int = 1_000_000_000
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class PollSettings:
+    # How long each poll keeps the field up waiting for a tag
+    poll_timeout: float = 0.1
+    # Polls run back to back for this long after a scan, and for as long as a reader is waiting
+    fast_period: float = 10.0
+    # Idle polls back off from the shortest to the longest interval, multiplying it each time
+    min_interval: float = 0.1
+    max_interval: float = 1.8
+    backoff: float = 2.0
+    # Only sleeps at least this long power the reader down first, waking it costs a few milliseconds
+    power_down_interval: float = 0.8
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class PollStats:
+    polls: int
+    scans: int
+    fast_polls: int
+    power_downs: int
+    active_ns: int
+    idle_ns: int
+    # Upper bound on how long a tag waited to be seen, from the end of the poll before it to its detection
+    detect_latency: Dict[str, int]
+
+    @property
+    def duty_cycle(self: Self) -> float:
+        total_ns: int = self.active_ns + self.idle_ns
+        return self.active_ns / total_ns if total_ns else 0.0
+
+    @override
+    def __str__(self: Self) -> str:
+        return (f'{self.polls} polls, {self.scans} scans, {self.duty_cycle:.1%} duty cycle, '
+                f'{self.power_downs} power downs, '
+                f'detect p50 {self.detect_latency["p50_ns"] / 1e6:.0f} ms, '
+                f'p99 {self.detect_latency["p99_ns"] / 1e6:.0f} ms')
+
+
+@final
+class PollScheduler:
+
+    @property
+    def settings(self: Self) -> PollSettings:
+        return self._settings
+
+    @property
+    def interval(self: Self) -> float:
+        return self._interval
+
+    @property
+    def stats(self: Self) -> PollStats:
+        return PollStats(self._polls,
+                         self._scans,
+                         self._fast_polls,
+                         self._power_downs,
+                         self._active_ns,
+                         self._idle_ns,
+                         self._detect_latency.snapshot())
+
+    def fast(self: Self,
+             now_ns: int,
+             reader_waiting: bool) -> bool:
+        return reader_waiting or (self._last_scan_ns is not None
+                                  and now_ns - self._last_scan_ns < self._settings.fast_period * _NS_PER_SECOND)
+
+    def next_delay(self: Self,
+                   now_ns: int,
+                   reader_waiting: bool) -> float:
+        # Seconds to wait before the next poll, backing off further with every empty poll while idle
+        if self.fast(now_ns, reader_waiting):
+            self._interval = self._settings.min_interval
+            self._fast_polls += 1
+            return 0.0
+        delay: float = self._interval
+        self._interval = min(self._interval * self._settings.backoff, self._settings.max_interval)
+        return delay
+
+    def should_power_down(self: Self,
+                          delay: float) -> bool:
+        return delay >= self._settings.power_down_interval
+
+    def record_poll(self: Self,
+                    started_ns: int,
+                    finished_ns: int,
+                    found: bool) -> None:
+        self._polls += 1
+        self._active_ns += finished_ns - started_ns
+        if found:
+            self._scans += 1
+            self._last_scan_ns = finished_ns
+            self._interval = self._settings.min_interval
+            if self._last_poll_ns is not None:
+                self._detect_latency.record(finished_ns - self._last_poll_ns)
+        self._last_poll_ns = finished_ns
+
+    def record_idle(self: Self,
+                    idle_ns: int,
+                    powered_down: bool) -> None:
+        self._idle_ns += idle_ns
+        if powered_down:
+            self._power_downs += 1
+
+    @override
+    def __init__(self,
+                 settings: PollSettings) -> None:
+        self._settings: PollSettings = settings
+        self._interval: float = settings.min_interval
+        self._last_scan_ns: Optional[int] = None
+        self._last_poll_ns: Optional[int] = None
+        self._polls: int = 0
+        self._scans: int = 0
+        self._fast_polls: int = 0
+        self._power_downs: int = 0
+        self._active_ns: int = 0
+        self._idle_ns: int = 0
+        self._detect_latency: LatencyHistogram = LatencyHistogram()
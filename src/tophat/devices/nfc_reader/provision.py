@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import dataclasses
+import time
+from typing import List, Optional
+
+from typing_extensions import Self, final, override
+
+from tophat.devices.nfc_reader.ntag import (CAPABILITY_CONTAINER_PAGE, PAGE_SIZE, USER_MEMORY_PAGE, NtagTransport,
+                                            changed_pages, read_pages, user_memory_size)
+
+
+@final
+class CardWriteError(Exception):
+    pass
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class CardWriteStats:
+    uid: bytes
+    size: int
+    pages: int
+    pages_written: int
+    read_ns: int
+    write_ns: int
+    verify_ns: int
+
+    @property
+    def total_ns(self: Self) -> int:
+        return self.read_ns + self.write_ns + self.verify_ns
+
+    @property
+    def throughput(self: Self) -> float:
+        # Payload bytes per second, counting every byte of the payload whether it had to be written or not
+        return self.size / (self.total_ns / 1e9) if self.total_ns else 0.0
+
+    @override
+    def __str__(self: Self) -> str:
+        return (f'{self.uid.hex()}: {self.size} bytes, {self.pages_written}/{self.pages} pages written in '
+                f'{self.total_ns / 1e6:.0f} ms (read {self.read_ns / 1e6:.0f} ms, write {self.write_ns / 1e6:.0f} ms, '
+                f'verify {self.verify_ns / 1e6:.0f} ms), {self.throughput:.0f} B/s')
+
+
+def write_card(transport: NtagTransport,
+               uid: bytes,
+               data: bytes) -> CardWriteStats:
+    # Writes data to user memory from page 4, skipping the pages that already hold it
+    desired: bytes = data.ljust(-(-len(data) // PAGE_SIZE) * PAGE_SIZE, b'\x00')
+    end_page: int = USER_MEMORY_PAGE + len(desired) // PAGE_SIZE - 1
+
+    read_start_ns: int = time.perf_counter_ns()
+    head: Optional[bytes] = transport.read(CAPABILITY_CONTAINER_PAGE)
+    if head is None:
+        raise CardWriteError('Card did not answer')
+    size: Optional[int] = user_memory_size(head[:PAGE_SIZE])
+    if size is not None and len(desired) > size:
+        raise CardWriteError(f'Data of size {len(desired)} does not fit in {size} bytes of user memory')
+    current: Optional[bytearray] = _read_user_memory(transport, head, end_page)
+    if current is None:
+        raise CardWriteError('Failed to read card')
+
+    write_start_ns: int = time.perf_counter_ns()
+    pages: List[int] = changed_pages(current, desired)
+    for page in pages:
+        offset: int = (page - USER_MEMORY_PAGE) * PAGE_SIZE
+        if not transport.write(page, desired[offset:offset + PAGE_SIZE]):
+            raise CardWriteError(f'Failed to write page {page}')
+
+    verify_start_ns: int = time.perf_counter_ns()
+    if pages:
+        written: Optional[bytearray] = _read_user_memory(transport, None, end_page)
+        if written != desired:
+            raise CardWriteError('Card contents do not match data after writing')
+    verify_end_ns: int = time.perf_counter_ns()
+
+    return CardWriteStats(uid,
+                          len(data),
+                          len(desired) // PAGE_SIZE,
+                          len(pages),
+                          write_start_ns - read_start_ns,
+                          verify_start_ns - write_start_ns,
+                          verify_end_ns - verify_start_ns)
+
+
+def _read_user_memory(transport: NtagTransport,
+                      head: Optional[bytes],
+                      end_page: int) -> Optional[bytearray]:
+    # User memory up to end_page, starting from the pages a READ of page 3 already returned if there is one
+    data: bytearray = bytearray(head[PAGE_SIZE:]) if head is not None else bytearray()
+    size: int = (end_page - USER_MEMORY_PAGE + 1) * PAGE_SIZE
+    if len(data) < size:
+        rest: Optional[bytearray] = read_pages(transport, USER_MEMORY_PAGE + len(data) // PAGE_SIZE, end_page)
+        if rest is None:
+            return None
+        data += rest
+    return data[:size]
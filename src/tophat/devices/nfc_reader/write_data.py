@@ -2,8 +2,9 @@ from __future__ import annotations
 
 import argparse
 import sys
-from os import stat_result
+import time
 from pathlib import Path
+from typing import List, Optional, Tuple
 
 from adafruit_platformdetect import Detector
 
@@ -18,11 +19,64 @@ from adafruit_pn532.spi import PN532_SPI
 from busio import SPI
 from digitalio import DigitalInOut
 
+from tophat.devices.nfc_reader._device_impl import PN532Transport
+from tophat.devices.nfc_reader.provision import CardWriteError, CardWriteStats, write_card
+
 DEFAULT_SCK_PIN: int = board.SCK.id
 DEFAULT_MISO_PIN: int = board.MISO.id
 DEFAULT_MOSI_PIN: int = board.MOSI.id
 DEFAULT_CS_PIN: int = board.D25.id
 MAX_DATA_SIZE: int = 512
+CARD_POLL_TIMEOUT: float = 0.5
+
+
+def load_payloads(paths: List[Path]) -> List[Tuple[Path, bytes]]:
+    # Files are written in the order given, the files of a directory in name order
+    file_paths: List[Path] = []
+    for path in paths:
+        if path.is_dir():
+            file_paths.extend(sorted(child for child in path.iterdir() if child.is_file()))
+        elif path.is_file():
+            file_paths.append(path)
+        else:
+            print(f'Invalid input file {path}', file=sys.stderr)
+            exit(1)
+
+    payloads: List[Tuple[Path, bytes]] = []
+    for file_path in file_paths:
+        file_size: int = file_path.lstat().st_size
+        if file_size > MAX_DATA_SIZE:
+            print(f'Input file {file_path} of size {hex(file_size)} is too large (max size is {hex(MAX_DATA_SIZE)})',
+                  file=sys.stderr)
+            exit(2)
+        payloads.append((file_path, file_path.read_bytes()))
+    return payloads
+
+
+def await_card(pn532: PN532,
+               previous_uid: Optional[bytes]) -> bytes:
+    # The card written last has to leave the field before it can be taken for the next one
+    present_uid: Optional[bytes] = previous_uid
+    while True:
+        uid: Optional[bytearray] = pn532.read_passive_target(timeout=CARD_POLL_TIMEOUT)
+        if uid is None:
+            present_uid = None
+        elif bytes(uid) != present_uid:
+            return bytes(uid)
+
+
+def print_summary(card_stats: List[CardWriteStats],
+                  elapsed_ns: int) -> None:
+    if not card_stats:
+        return
+    data_size: int = sum(stats.size for stats in card_stats)
+    pages: int = sum(stats.pages for stats in card_stats)
+    pages_written: int = sum(stats.pages_written for stats in card_stats)
+    write_ns: int = sum(stats.total_ns for stats in card_stats)
+    print(f'Wrote {len(card_stats)} cards in {elapsed_ns / 1e9:.1f} s: {data_size} bytes, '
+          f'{pages_written}/{pages} pages written, {write_ns / len(card_stats) / 1e6:.0f} ms per card, '
+          f'{data_size / (write_ns / 1e9) if write_ns else 0.0:.0f} B/s')
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -41,23 +95,14 @@ if __name__ == '__main__':
     parser.add_argument('--debug',
                         action='store_true',
                         default=False)
-    parser.add_argument('file_path',
-                        type=Path)
+    parser.add_argument('paths',
+                        type=Path,
+                        nargs='+',
+                        help='Files to write, one card each, or directories of them')
 
     args = parser.parse_args()
 
-    file_path: Path = args.file_path
-    if not file_path.is_file():
-        print(f'Invalid input file {file_path}', file=sys.stderr)
-        exit(1)
-
-    file_stat: stat_result = file_path.lstat()
-    if file_stat.st_size > MAX_DATA_SIZE:
-        print(f'Input file of size {hex(file_stat.st_size)} is too large (max size is {hex(MAX_DATA_SIZE)})',
-              file=sys.stderr)
-        exit(2)
-
-    file_data: bytes = file_path.read_bytes()
+    payloads: List[Tuple[Path, bytes]] = load_payloads(args.paths)
 
     sck_pin: board.pin.Pin = board.pin.Pin(args.sck)
     mosi_pin: board.pin.Pin = board.pin.Pin(args.mosi)
@@ -67,17 +112,28 @@ if __name__ == '__main__':
                              cs_pin=DigitalInOut(cs_pin),
                              debug=args.debug)
     pn532.call_function(_COMMAND_SAMCONFIGURATION, params=[0x01, 0x00, 0x00])
+    transport: PN532Transport = PN532Transport(pn532)
 
-    while pn532.read_passive_target(timeout=5) is None:
+    # A card that fails is not skipped, its payload waits for the next card presented
+    card_stats: List[CardWriteStats] = []
+    previous_uid: Optional[bytes] = None
+    session_start_ns: int = time.perf_counter_ns()
+    try:
+        while len(card_stats) < len(payloads):
+            file_path, file_data = payloads[len(card_stats)]
+            print(f'Present card {len(card_stats) + 1}/{len(payloads)} for {file_path}')
+            previous_uid = await_card(pn532, previous_uid)
+            try:
+                card_stats.append(write_card(transport, previous_uid, file_data))
+            except CardWriteError as write_error:
+                print(f'Failed to write {file_path} to card {previous_uid.hex()}: {write_error}', file=sys.stderr)
+                continue
+            print(f'Successfully wrote {file_path} to card {card_stats[-1]}')
+    except KeyboardInterrupt:
         pass
+    finally:
+        pn532.power_down()
 
-    for index, file_data_block in enumerate(file_data[i:i + 4] for i in range(0, len(file_data), 4)):
-        block_num: int = index + 0x4
-        if pn532.ntag2xx_write_block(block_num, file_data_block.ljust(4, b'\x00')):
-            print(f'Successfully wrote block {block_num}')
-        else:
-            print(f'Failed to write block {block_num}', file=sys.stderr)
-            exit(3)
-
-    pn532.power_down()
-    print(f'Successfully wrote {hex(file_stat.st_size)} bytes to NFC card')
+    print_summary(card_stats, time.perf_counter_ns() - session_start_ns)
+    if len(card_stats) < len(payloads):
+        exit(3)
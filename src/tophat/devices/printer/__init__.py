@@ -5,6 +5,7 @@ from typing import Any, Callable, Set, Type, final
 
 from typing_extensions import Concatenate, Self, override
 
+from tophat.api.codec import register_record
 from tophat.api.device import AsyncCommand, Command, Device, DeviceExtraParams
 
 
@@ -26,8 +27,13 @@ class PrinterDevice(Device):
         return cls
 
 
+@register_record(0x0400, fields=('output',), types={'output': str})
 class PrintCommand(AsyncCommand[PrinterDevice]):
 
+    @property
+    def output(self: Self) -> str:
+        return self._output
+
     @override
     def run(self: Self,
             device: PrinterDevice) -> None:
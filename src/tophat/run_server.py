@@ -16,19 +16,22 @@ else:
     exit(-1)
 
 from tophat.api.server import TopHatServer
+from tophat.api.worker import ConcurrentDeviceWorker
 from tophat.devices.neopixel import NeopixelDeviceProxy
 from tophat.devices.nfc_reader import PN532Device
 
 
 def main() -> None:
-    server = TopHatServer(Path('/srv/tophat/tophat.socket'))
+    server = TopHatServer(Path('/srv/tophat/tophat.socket'),
+                          metrics_path=Path('/srv/tophat/metrics.prom'))
     server.register_device(NeopixelDeviceProxy,
                            'neopixels',
                            Path('/srv/tophat/neopixel.socket'))
+    # Reads only wait on the scan event bus, every waiting hat has to be blocked on it at once to get the same scan
     server.register_device(PN532Device,
                            'nfc_reader',
                            board.SCK, board.MOSI, board.MISO, board.D25,
-                           server.manager).start_reader()
+                           worker_type=ConcurrentDeviceWorker).start_reader()
     server.register_device(DigitalSwitchDevice,
                            'headlamp',
                            board.D23)